@@ -0,0 +1,202 @@
+# Eva arrays
+###############################
+# a native array value for bulk numeric work: one Eva operation applies to
+# every element, instead of a `for` loop running interpreted nodes per
+# element. backed by numpy when it is installed, by array.array otherwise
+# ('q' for integers, 'd' for floats, 'b' for comparison results). values
+# that are not all machine numbers (strings, arrays, functions, ints past
+# 64 bits) are kept in a list, element by element like an Eva list.
+#
+# - binary operators + - * < > = broadcast:
+#   array op array (same length), array op number, number op array
+# - unary - negates every element
+# - builtins, defined in the global env by Eva (see builtins()):
+#   (array 1 2 3)        new array of the arguments
+#   (range n) (range start stop [step])
+#   (len a) (get a i) (sum a)
+#   (map fn a)           fn applied to every element, fn is a builtin or
+#                        an Eva function
+
+import operator
+from array import array
+from itertools import repeat
+
+from host import declare
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class Array:
+    __slots__ = ("data",)
+    # == broadcasts, arrays are not hashable
+    __hash__ = None
+
+    def __init__(self, data):
+        # numpy.ndarray, array.array or list (objects)
+        self.data = data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.tolist())
+
+    def __getitem__(self, index):
+        value = self.data[index]
+        return value.item() if numpy is not None and type(self.data) is not list else value
+
+    def __bool__(self):
+        raise TypeError("The truth value of an array is ambiguous.")
+
+    def __repr__(self):
+        return f"Array({self.tolist()})"
+
+    def tolist(self):
+        if type(self.data) is list:
+            return list(self.data)
+        return self.data.tolist()
+
+    def __add__(self, other):
+        return _binary(operator.add, self, other)
+
+    def __radd__(self, other):
+        return _binary(operator.add, other, self)
+
+    def __sub__(self, other):
+        return _binary(operator.sub, self, other)
+
+    def __rsub__(self, other):
+        return _binary(operator.sub, other, self)
+
+    def __mul__(self, other):
+        return _binary(operator.mul, self, other)
+
+    def __rmul__(self, other):
+        return _binary(operator.mul, other, self)
+
+    def __lt__(self, other):
+        return _binary(operator.lt, self, other)
+
+    def __gt__(self, other):
+        return _binary(operator.gt, self, other)
+
+    def __eq__(self, other):
+        return _binary(operator.eq, self, other)
+
+    def __neg__(self):
+        if type(self.data) is list:
+            return fromValues(map(operator.neg, self.data))
+        if numpy is not None:
+            return Array(-self.data)
+        return Array(array(self.data.typecode, map(operator.neg, self.data)))
+
+
+_COMPARISONS = {operator.lt, operator.gt, operator.eq}
+# element types kept in typed memory (bool: comparison results)
+_MACHINE = {int, float, bool}
+
+
+def _objects(value):
+    return type(value) is Array and type(value.data) is list
+
+
+def _binary(op, left, right):
+    if _objects(left) or _objects(right):
+        return fromValues(_map(op, left, right))
+    if numpy is not None:
+        left = left.data if type(left) is Array else left
+        right = right.data if type(right) is Array else right
+        return Array(op(left, right))
+    values = _map(op, left, right)
+    if op in _COMPARISONS:
+        return Array(array("b", values))
+    if not _integral(left) or not _integral(right):
+        return Array(array("d", values))
+    values = list(values)
+    try:
+        return Array(array("q", values))
+    except OverflowError:
+        # past 64 bits: exact python ints
+        return Array(values)
+
+
+def _map(op, left, right):
+    # op over the elements, broadcasting a number
+    if type(left) is Array and type(right) is Array:
+        if len(left) != len(right):
+            raise ValueError(
+                f"Arrays of different lengths {len(left)} and {len(right)}."
+            )
+        return map(op, left.data, right.data)
+    if type(left) is Array:
+        return map(op, left.data, repeat(right))
+    return map(op, repeat(left), right.data)
+
+
+def _integral(value):
+    if type(value) is Array:
+        return value.data.typecode != "d"
+    return isinstance(value, int)
+
+
+def fromValues(values):
+    values = list(values)
+    if not all(type(i) in _MACHINE for i in values):
+        return Array(values)
+    if numpy is not None:
+        data = numpy.array(values)
+        # ints past 64 bits make an object array
+        return Array(values if data.dtype.kind == "O" else data)
+    if all(isinstance(i, int) for i in values):
+        try:
+            return Array(array("q", values))
+        except OverflowError:
+            return Array(values)
+    return Array(array("d", values))
+
+
+# builtins
+# --------------------------
+def builtins(apply):
+    # apply(fn, args) calls an Eva function value, see Eva.apply
+    @declare(pure=True)
+    def new_array(*values):
+        return fromValues(values)
+
+    @declare(pure=True)
+    def array_range(*args):
+        if numpy is not None:
+            return Array(numpy.arange(*args))
+        return Array(array("q", range(*args)))
+
+    @declare(arity=1, pure=True)
+    def array_len(a):
+        return len(a)
+
+    @declare(arity=2, pure=True)
+    def array_get(a, index):
+        return a[index]
+
+    @declare(arity=1, pure=True)
+    def array_sum(a):
+        if numpy is not None and type(a.data) is not list:
+            return a.data.sum().item()
+        return sum(a.data)
+
+    @declare(arity=2)
+    def array_map(fn, a):
+        if callable(fn):
+            return fromValues(map(fn, a))
+        return fromValues([apply(fn, [i]) for i in a])
+
+    return {
+        "array": new_array,
+        "range": array_range,
+        "len": array_len,
+        "get": array_get,
+        "sum": array_sum,
+        "map": array_map,
+    }
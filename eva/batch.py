@@ -0,0 +1,147 @@
+# Batch evaluation
+###############################
+# one program over many input rows:
+#
+#   scores = eva.evalBatch(["begin", ["def", "score", ...], ["score", "x", "y"]],
+#                          ({"x": x, "y": y} for x, y in records))
+#   for value in scores: ...            # lazily, one result per row
+#   eva.evalBatch(program, rows, out=array("d", bytes(8 * n)))   # filled in
+#
+# every row is a dict of variable bindings, all rows bind the same names.
+# eva.eval of one row at a time optimizes/compiles the program again and
+# builds a new env for it; a batch
+# - optimizes the program once, with the row names bound (never inlined)
+# - compiles it once: the closure and vm engines with their compilers, the
+#   ast and stack engines with the closure compiler too, when no global
+#   the program reads is a function/class/module of their own (else the
+#   program is walked as usual)
+# - runs the program's leading function definitions (def, var of a
+#   lambda) once: their values close over the env rows run in, which is
+#   the same object for every row
+# - runs every row in that env, the program's forms directly in it: its
+#   record is cleared and filled with the row. functions a row's
+#   evaluation returns close over it, they see the names of later rows
+#   (and, compiled for the ast/stack engines, are called through eva.apply)
+#
+# parallel=True sends chunks of rows to the worker processes of
+# evalParallel (parallel.Parallel.batch), when the program is pure.
+#
+# bench/bench_batch.py, rows/s of a batch over one eva.eval per row: about
+# x15-30 on the closure and vm engines, but only x4-6 on the ast and stack
+# engines, short of 10x. their eval per row walks the program without
+# compiling it, the batch runs it closure compiled in one reused env: the
+# time left per row is the program's own evaluation, as fast as on the
+# closure engine.
+
+from itertools import chain
+
+from env import Environment, Instance
+from optimizer import boundNames
+from parallel import freeNames
+
+
+class Batch:
+    def __init__(self, eva, program, names):
+        self.eva = eva
+        # the env rows run in, its record is refilled per row
+        self.env = Environment(dict.fromkeys(names), eva.global_env)
+        program = eva.optimize(program, self.env, cache=False)
+        if not (isinstance(program, list) and program and program[0] == "begin"):
+            program = ["begin", program]
+        # closure compiled or walked, the whole program one way
+        self._compiled = eva.engine == "closure" or self._compilable(program)
+        if self._compiled and eva.engine != "closure":
+            try:
+                eva._compiler.compileProgram(program, self.env, body=True)
+            except ValueError:
+                # an undefined name or a form only the engine has, the
+                # engine reports it (or runs it) per row
+                self._compiled = False
+        functions, program = _functions(program, names)
+        if len(functions) > 1:
+            # defined once, in an env between the row env and the globals
+            self.env.parent = Environment({}, eva.global_env)
+            self._compile(functions)(self.env)
+            for form in functions[1:]:
+                self.env.parent.define(form[1], self.env.record.pop(form[1]))
+        self.program = program
+        self.run = self._compile(program)
+
+    def _compile(self, body):
+        # run(env): the forms of ['begin', ...] body evaluated in env
+        eva = self.eva
+        if eva.engine == "vm":
+            proto = eva._vm.compile(body, body=True)
+            return lambda env: eva._vm.execute(proto, env)
+        if self._compiled:
+            compiled = eva._compiler.compileProgram(body, self.env, body=True)
+            return lambda env: eva.run(compiled, env)
+        if eva.engine == "stack":
+            return lambda env: eva._machine.evalBody(body, env)
+        return lambda env: eva._eval_block(body, env)
+
+    def _compilable(self, body):
+        # the closure compiler makes its own function values: the program
+        # must not call functions (or use classes/modules) of the engine
+        for name in freeNames(body, self.eva._special_forms):
+            try:
+                value = self.env.lookup(name)
+            except ValueError:
+                # not a variable (switch's `else`), or undefined: compiling
+                # reports it
+                continue
+            if isinstance(value, (list, Environment, Instance)):
+                return False
+        return True
+
+    def results(self, rows):
+        env, run = self.env, self.run
+        record = env.record
+        for row in rows:
+            record.clear()
+            record.update(row)
+            yield run(env)
+
+
+def _functions(program, names):
+    # (['begin', leading function definitions], ['begin', rest]) of a
+    # ['begin', ...] program. a definition stays in the rest when a row
+    # binds its name or the program binds it again
+    forms = program[1:]
+    count = 0
+    while count < len(forms) and _definesFunction(forms[count]):
+        count += 1
+    rebound = boundNames(["begin", *forms[count:]])
+    functions = []
+    for form in forms[:count]:
+        name = form[1]
+        if name in names or name in rebound or any(name == i[1] for i in functions):
+            break
+        functions.append(form)
+    return ["begin", *functions], ["begin", *forms[len(functions) :]]
+
+
+def _definesFunction(form):
+    if not isinstance(form, list) or len(form) < 3 or not isinstance(form[1], str):
+        return False
+    if form[0] == "def":
+        return True
+    value = form[2]
+    return form[0] == "var" and isinstance(value, list) and bool(value) and value[0] == "lambda"
+
+
+def evalBatch(eva, program, rows, parallel=False, chunk=1000):
+    # generator of the results of program over rows, in row order
+    rows = iter(rows)
+    for first in rows:
+        rows = chain([first], rows)
+        break
+    else:
+        return
+    names = list(first)
+    if parallel:
+        results = eva.parallel.batch(program, names, rows, chunk)
+        if results is not None:
+            yield from results
+            return
+    yield from Batch(eva, program, names).results(rows)
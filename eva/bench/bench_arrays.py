@@ -0,0 +1,50 @@
+# benchmark: Eva loop vs whole-array expression
+###############################
+# run from the eva/ directory:  python bench/bench_arrays.py [n]
+# sum of 2*i + 1 for i < n, once as an Eva `for` loop and once as the
+# array expression (sum (+ (* (range n) 2) 1)), per engine.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import arrays
+from env import Environment
+from evai import Eva
+
+
+def loop(n):
+    return [
+        "begin",
+        ["var", "total", 0],
+        [
+            "for",
+            ["var", "i", 0],
+            ["<", "i", n],
+            ["++", "i"],
+            ["+=", "total", ["+", ["*", "i", 2], 1]],
+        ],
+        "total",
+    ]
+
+
+def vectorized(n):
+    return ["sum", ["+", ["*", ["range", n], 2], 1]]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    backend = "numpy" if arrays.numpy is not None else "array.array"
+    print(f"n={n}, arrays backed by {backend}")
+    for engine in ("ast", "closure", "stack", "vm"):
+        eva = Eva(Environment({}), engine=engine)
+        timings = []
+        for exp in (loop(n), vectorized(n)):
+            start = time.perf_counter()
+            assert eva.eval(exp) == n * n
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{engine:<8} loop {timings[0] * 1e3:8.1f} ms"
+            f"  array {timings[1] * 1e3:7.1f} ms  x{timings[0] / timings[1]:6.1f}"
+        )
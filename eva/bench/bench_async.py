@@ -0,0 +1,58 @@
+# benchmark: scripts waiting on slow builtins
+###############################
+# run from the eva/ directory:  python bench/bench_async.py [scripts] [latency ms]
+# every script makes 3 calls to `fetch`, a stand-in for a remote service
+# that answers after `latency`. a blocking fetch (time.sleep) with eval,
+# one script after the other, vs an `async def` fetch (asyncio.sleep) with
+# all scripts running concurrently through evalAsync on one event loop,
+# then the calls of each script made concurrently with await-all.
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+SEQUENTIAL = ["+", ["+", ["fetch", 1], ["fetch", 2]], ["fetch", 3]]
+CONCURRENT = [
+    "begin",
+    ["var", "r", ["await-all", ["fetch", 1], ["fetch", 2], ["fetch", 3]]],
+    ["+", ["+", ["get", "r", 0], ["get", "r", 1]], ["get", "r", 2]],
+]
+
+
+if __name__ == "__main__":
+    scripts = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 20) / 1e3
+
+    def fetch(x):
+        time.sleep(latency)
+        return x
+
+    async def fetch_async(x):
+        await asyncio.sleep(latency)
+        return x
+
+    # blocking: measured on a sample, scaled to all scripts
+    sample = max(1, min(scripts, 20))
+    eva = Eva(Environment({"fetch": fetch}))
+    start = time.perf_counter()
+    for _ in range(sample):
+        assert eva.eval(SEQUENTIAL) == 6
+    blocking = (time.perf_counter() - start) * scripts / sample
+    print(f"{scripts} scripts x 3 calls, {latency * 1e3:.0f} ms latency")
+    print(f"eval, blocking fetch      {blocking:8.2f} s  (from {sample} scripts)")
+
+    eva = Eva(Environment({"fetch": fetch_async}))
+    for name, program in (("evalAsync", SEQUENTIAL), ("evalAsync + await-all", CONCURRENT)):
+
+        async def run_all():
+            return await asyncio.gather(*(eva.evalAsync(program) for _ in range(scripts)))
+
+        start = time.perf_counter()
+        assert set(asyncio.run(run_all())) == {6}
+        elapsed = time.perf_counter() - start
+        print(f"{name:<25} {elapsed:8.2f} s  x{blocking / elapsed:,.0f}")
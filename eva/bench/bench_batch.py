@@ -0,0 +1,77 @@
+# benchmark: batch evaluation
+###############################
+# run from the eva/ directory:  python bench/bench_batch.py [rows]
+# a scoring function (def + switch + if) over `rows` records (default
+# 20000), per engine: one eva.eval per record (its own env) vs
+# eva.evalBatch, lazily and into a preallocated array, and with the rows
+# split across the worker processes. rows per second, best of 3.
+import os
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+PROGRAM = [
+    "begin",
+    [
+        "def",
+        "score",
+        ["amount", "age", "visits"],
+        [
+            "switch",
+            [[">", "amount", 900], ["+", ["*", "amount", 2], "visits"]],
+            [["<", "age", 25], ["if", [">", "visits", 3], ["*", "amount", 3], "amount"]],
+            ["else", ["-", ["+", "amount", ["*", "visits", 10]], "age"]],
+        ],
+    ],
+    ["score", "amount", "age", "visits"],
+]
+
+
+def records(n):
+    return [{"amount": i * 37 % 1000, "age": 18 + i % 60, "visits": i % 9} for i in range(n)]
+
+
+def best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = records(n)
+    print(f"{n} rows, {os.cpu_count()} cpu(s)")
+    for engine in ("ast", "closure", "stack", "vm"):
+        eva = Eva(Environment({"None": None, "true": True}), engine=engine)
+
+        def naive():
+            return [eva.eval(PROGRAM, Environment(dict(row), eva.global_env)) for row in rows]
+
+        expected = naive()
+        out = array("q", bytes(8 * n))
+
+        def lazy():
+            return list(eva.evalBatch(PROGRAM, rows))
+
+        def filled():
+            return eva.evalBatch(PROGRAM, rows, out=out)
+
+        def parallel():
+            return list(eva.evalBatch(PROGRAM, rows, parallel=True, chunk=2000))
+
+        assert lazy() == expected and list(filled()) == expected and parallel() == expected
+        base = best_of(naive)
+        line = f"{engine:<8} eval {n / base:9.0f} rows/s"
+        for name, fn in (("batch", lazy), ("out", filled), ("workers", parallel)):
+            seconds = best_of(fn)
+            line += f"  {name} {n / seconds:9.0f} rows/s x{base / seconds:5.1f}"
+        print(line)
+        eva.parallel.shutdown()
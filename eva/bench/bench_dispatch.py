@@ -0,0 +1,80 @@
+# micro-benchmark: per-node cost of Eva.eval
+###############################
+# run from the eva/ directory:  python bench/bench_dispatch.py
+# counts the nodes one program evaluates, then reports wall time / node
+# for a call-heavy program (recursive fib) and an arithmetic-heavy one
+# (while loop over nested arithmetic).
+import os
+import sys
+import time
+import operator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+CALL_HEAVY = [
+    "begin",
+    [
+        "def",
+        "fib",
+        "n",
+        ["if", ["<", "n", 2], "n", ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]],
+    ],
+    ["fib", 18],
+]
+
+ARITH_HEAVY = [
+    "begin",
+    ["var", "i", 0],
+    ["var", "acc", 0],
+    [
+        "while",
+        ["<", "i", 20000],
+        [
+            "begin",
+            ["set", "acc", ["+", "acc", ["*", ["-", "i", 1], ["+", 2, 3]]]],
+            ["set", "i", ["+", "i", 1]],
+        ],
+    ],
+    "acc",
+]
+
+
+class CountingEva(Eva):
+    def __init__(self, global_env):
+        super().__init__(global_env)
+        self.nodes = 0
+
+    # every node goes through _eval (eval is the entry point only)
+    def _eval(self, exp, env=None):
+        self.nodes += 1
+        return super()._eval(exp, env)
+
+
+def make_global_env():
+    return Environment({"None": None, "true": True, "print": print, "add": operator.add})
+
+
+def count_nodes(program):
+    eva = CountingEva(make_global_env())
+    eva.eval(program)
+    return eva.nodes
+
+
+def run(name, program, repeat=5):
+    nodes = count_nodes(program)
+    best = float("inf")
+    for _ in range(repeat):
+        eva = Eva(make_global_env())
+        start = time.perf_counter()
+        eva.eval(program)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<12} nodes={nodes:>8}  total={best * 1e3:8.2f} ms  per-node={best / nodes * 1e9:7.1f} ns")
+
+
+if __name__ == "__main__":
+    run("call-heavy", CALL_HEAVY)
+    run("arith-heavy", ARITH_HEAVY)
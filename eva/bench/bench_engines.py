@@ -0,0 +1,78 @@
+# benchmark: tree-walking engine vs the other engines
+###############################
+# run from the eva/ directory:  python bench/bench_engines.py
+# the programs are the loop / recursion programs of test_eva.py with
+# bigger inputs. compile time is excluded for the closure and vm engines.
+import os
+import sys
+import time
+import operator
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+PROGRAMS = {
+    "factorial": [
+        "begin",
+        [
+            "def",
+            "factorial",
+            "x",
+            ["if", ["=", "x", 1], 1, ["*", "x", ["factorial", ["-", "x", 1]]]],
+        ],
+        ["var", "n", 0],
+        ["while", ["<", "n", 500], ["begin", ["factorial", 100], ["++", "n"]]],
+    ],
+    "while": [
+        "begin",
+        ["var", "x", 0],
+        ["var", "sum", 0],
+        [
+            "while",
+            ["<", "x", 50000],
+            ["begin", ["set", "sum", ["+", "sum", 100]], ["set", "x", ["+", "x", 1]]],
+        ],
+        "sum",
+    ],
+    "for": [
+        "begin",
+        ["var", "sum", 0],
+        ["for", ["var", "i", 0], ["<", "i", 50000], ["++", "i"], ["+=", "sum", "i"]],
+        "sum",
+    ],
+}
+
+
+def make_eva(engine):
+    global_env = Environment({"None": None, "true": True, "+": operator.add})
+    return Eva(global_env, engine=engine)
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def timed(engine, program):
+    eva = make_eva(engine)
+    if engine in ("closure", "vm"):
+        compiled = eva.compile(program)
+        return best_of(lambda: eva.run(compiled))
+    return best_of(lambda: eva.eval(program))
+
+
+if __name__ == "__main__":
+    for name, program in PROGRAMS.items():
+        t_ast = timed("ast", program)
+        line = f"{name:<10} ast={t_ast * 1e3:8.2f} ms"
+        for engine in ("closure", "stack", "vm"):
+            elapsed = timed(engine, program)
+            line += f"  {engine}={elapsed * 1e3:8.2f} ms ({t_ast / elapsed:4.2f}x)"
+        print(line)
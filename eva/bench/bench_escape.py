@@ -0,0 +1,85 @@
+# benchmark: closures and the environments they keep alive
+###############################
+# run from the eva/ directory:  python bench/bench_escape.py [closures]
+# a function makes a closure in a loop body block holding a scratch array,
+# `closures` (default 20000) of them are kept alive by the host:
+# - callback: the lambda references no local  (lambda (x) (* x 2))
+# - adder:    it references the function's parameter only
+# per engine with the compilers' escape analysis off and on: memory still
+# allocated while the closures are alive (tracemalloc), the time of a full
+# gc.collect() then, and the time to make them.
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+def program(n, lambda_exp):
+    return [
+        "begin",
+        [
+            "def",
+            "make",
+            "k",
+            [
+                "begin",
+                ["var", "made", 0],
+                [
+                    "for",
+                    ["var", "j", 0],
+                    ["<", "j", 1],
+                    ["++", "j"],
+                    ["begin", ["var", "scratch", ["range", 64]], ["set", "made", lambda_exp]],
+                ],
+                "made",
+            ],
+        ],
+        ["for", ["var", "i", 0], ["<", "i", n], ["++", "i"], ["keep", ["make", "i"]]],
+    ]
+
+
+CLOSURES = {
+    "callback": ["lambda", "x", ["*", "x", 2]],
+    "adder": ["lambda", "x", ["+", "x", "k"]],
+}
+
+
+def measure(engine, exp, analysis):
+    kept = []
+    eva = Eva(Environment({"None": None, "keep": kept.append}), engine=engine)
+    eva._compiler.escape_analysis = analysis
+    eva._vm._compiler.escape_analysis = analysis
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    eva.eval(exp)
+    seconds = time.perf_counter() - start
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    collect = time.perf_counter() - start
+    assert kept[-1] is not None
+    return retained, collect, seconds
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for engine in ("closure", "vm"):
+        for name, lambda_exp in CLOSURES.items():
+            exp = program(n, lambda_exp)
+            line = f"{engine:<8} {name:<9}"
+            for analysis in (False, True):
+                runs = [measure(engine, exp, analysis) for _ in range(3)]
+                retained, collect, seconds = (min(column) for column in zip(*runs))
+                line += (
+                    f"  {'on ' if analysis else 'off'}: {retained / n:7.1f} B/closure"
+                    f" gc {collect * 1000:6.2f} ms make {seconds:5.2f} s"
+                )
+            print(line)
@@ -0,0 +1,84 @@
+# benchmark: host (builtin) function calls
+###############################
+# run from the eva/ directory:  python bench/bench_host.py [calls]
+# a loop making `calls` (default 80000) calls of a 1-, 2- and 3-argument
+# python builtin, 8 per iteration, per engine. the time of the same loop
+# with the calls' first argument in their place is subtracted: builtin
+# calls per second, best of 7 (the two loops interleaved).
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from host import declare
+
+
+@declare(arity=1, pure=True)
+def one(a):
+    return a
+
+
+@declare(arity=2, pure=True)
+def two(a, b):
+    return b
+
+
+@declare(arity=3, pure=True)
+def three(a, b, c):
+    return c
+
+
+PER_ITERATION = 8
+
+
+def loop(n, body):
+    return [
+        "begin",
+        ["var", "i", 0],
+        ["var", "r", 0],
+        [
+            "while",
+            ["<", "i", n // PER_ITERATION],
+            ["begin", *[["set", "r", body] for _ in range(PER_ITERATION)], ["++", "i"]],
+        ],
+        "r",
+    ]
+
+
+CALLS = {
+    1: ["one", "i"],
+    2: ["two", "i", "i"],
+    3: ["three", "i", "i", "i"],
+}
+
+
+def timed(eva, program):
+    start = time.perf_counter()
+    eva.eval(program)
+    return time.perf_counter() - start
+
+
+def call_time(eva, n, call, repeat=7):
+    # best of the loop with the calls minus best of the loop without
+    calls, empty = loop(n, call), loop(n, "i")
+    best_calls = best_empty = float("inf")
+    for _ in range(repeat):
+        best_calls = min(best_calls, timed(eva, calls))
+        best_empty = min(best_empty, timed(eva, empty))
+    return best_calls - best_empty
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 80000
+    for engine in ("ast", "closure", "stack", "vm"):
+        eva = Eva(
+            Environment({"None": None, "one": one, "two": two, "three": three}), engine=engine
+        )
+        line = f"{engine:<8}"
+        for nargs, call in CALLS.items():
+            seconds = call_time(eva, n, call)
+            line += f"  {nargs} arg(s) {n / seconds / 1e6:6.2f} M calls/s"
+        print(line)
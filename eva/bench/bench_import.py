@@ -0,0 +1,56 @@
+# benchmark: repeated import
+###############################
+# run from the eva/ directory:  python bench/bench_import.py
+# 10k `import Math` from inside an Eva loop per engine, and the cold load
+# of a module from the on-disk parse cache.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from modules import ModuleRegistry
+
+IMPORTS = 10000
+
+PROGRAM = [
+    "begin",
+    ["var", "total", 0],
+    [
+        "for",
+        ["var", "i", 0],
+        ["<", "i", IMPORTS],
+        ["++", "i"],
+        ["begin", ["import", "Math"], ["+=", "total", ["prop", "Math", "MAX_VALUE"]]],
+    ],
+    "total",
+]
+
+
+def generated_module(definitions):
+    return ",\n".join(
+        f"['def','f{i}','x',['+',['*','x',{i}],['prop','Math','MAX_VALUE']]]"
+        for i in range(definitions)
+    )
+
+
+if __name__ == "__main__":
+    for engine in ("ast", "closure", "stack", "vm"):
+        eva = Eva(Environment({}), engine=engine)
+        start = time.perf_counter()
+        eva.eval(PROGRAM)
+        elapsed = time.perf_counter() - start
+        print(f"{engine:<8} {IMPORTS} imports  {elapsed * 1e3:8.2f} ms  {elapsed / IMPORTS * 1e6:6.2f} us/import")
+
+    with tempfile.TemporaryDirectory() as path:
+        with open(os.path.join(path, "Big"), "w") as file:
+            file.write(generated_module(2000))
+        cache_dir = os.path.join(path, "__evacache__")
+        for label in ("parse", "disk cache"):
+            registry = ModuleRegistry(path, cache_dir=cache_dir)
+            start = time.perf_counter()
+            registry.source("Big")
+            print(f"cold load, 2000 defs, {label:<10} {(time.perf_counter() - start) * 1e3:8.2f} ms")
@@ -0,0 +1,64 @@
+# benchmark: variable lookup at deep scope nesting
+###############################
+# run from the eva/ directory:  python bench/bench_lookup.py
+# a global (MAX_VALUE) and a function local (acc) are read from inside
+# `depth` nested begin blocks, inside a for loop, inside a function.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+def nested(depth, exp):
+    for _ in range(depth):
+        exp = ["begin", exp]
+    return exp
+
+
+def program(depth, iterations=20000):
+    return [
+        "begin",
+        ["var", "MAX_VALUE", 1000],
+        [
+            "def",
+            "run",
+            "n",
+            [
+                "begin",
+                ["var", "acc", 0],
+                [
+                    "for",
+                    ["var", "i", 0],
+                    ["<", "i", "n"],
+                    ["++", "i"],
+                    nested(depth, ["set", "acc", ["+", "acc", "MAX_VALUE"]]),
+                ],
+                "acc",
+            ],
+        ],
+        ["run", iterations],
+    ]
+
+
+def best_of(fn, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    for depth in (0, 4, 8, 16):
+        exp = program(depth)
+        ast = Eva(Environment({}), engine="ast")
+        closure = Eva(Environment({}), engine="closure")
+        compiled = closure.compile(exp)
+        t_ast = best_of(lambda: ast.eval(exp))
+        t_closure = best_of(lambda: closure.run(compiled))
+        print(f"depth={depth:<3} ast={t_ast * 1e3:8.2f} ms  closure={t_closure * 1e3:8.2f} ms")
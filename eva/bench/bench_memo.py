@@ -0,0 +1,37 @@
+# benchmark: naive vs memoized fib
+###############################
+# run from the eva/ directory:  python bench/bench_memo.py [n] [engines...]
+# fib(n) (default 30) defined with `def` and with `def-memo`, per engine.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+def fib(n, form):
+    body = ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]
+    return [
+        "begin",
+        [form, "fib", "n", ["if", ["<", "n", 2], "n", body]],
+        ["fib", n],
+    ]
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    engines = sys.argv[2:] or ["closure", "vm", "ast"]
+    for engine in engines:
+        timings = []
+        for form in ("def", "def-memo"):
+            eva = Eva(Environment({}), engine=engine)
+            start = time.perf_counter()
+            value = eva.eval(fib(n, form))
+            timings.append(time.perf_counter() - start)
+        print(
+            f"{engine:<8} fib({n})={value}  def {timings[0]:8.3f} s"
+            f"  def-memo {timings[1] * 1e3:7.2f} ms  x{timings[0] / timings[1]:,.0f}"
+        )
@@ -0,0 +1,96 @@
+# benchmark: memory of environments/frames
+###############################
+# run from the eva/ directory:  python bench/bench_memory.py
+# tracemalloc peak and live blocks at the deepest point of a recursion
+# (plain, and through a block declaring nothing), and with many live class
+# instances, per engine.
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+DEPTH = 2000
+INSTANCES = 20000
+
+RECURSION = [
+    "begin",
+    [
+        "def",
+        "down",
+        "n",
+        ["if", ["=", "n", 0], ["begin", ["probe"], 0], ["+", 1, ["down", ["-", "n", 1]]]],
+    ],
+    ["down", DEPTH],
+]
+
+# the recursive call in a var-less block: no env of its own
+BLOCK_RECURSION = [
+    "begin",
+    [
+        "def",
+        "down",
+        "n",
+        [
+            "if",
+            ["=", "n", 0],
+            ["begin", ["probe"], 0],
+            ["begin", ["+", 1, ["down", ["-", "n", 1]]]],
+        ],
+    ],
+    ["down", DEPTH],
+]
+
+INSTANCE_LOOP = [
+    "begin",
+    [
+        "class",
+        "Node",
+        "None",
+        ["begin", ["def", "constructor", ["self", "next"], ["set", ["prop", "self", "next"], "next"]]],
+    ],
+    ["var", "head", "None"],
+    ["for", ["var", "i", 0], ["<", "i", INSTANCES], ["++", "i"], ["set", "head", ["new", "Node", "head"]]],
+    ["probe"],
+]
+
+
+def measure(engine, program, count):
+    probe = {}
+
+    def take_probe():
+        probe["bytes"] = tracemalloc.get_traced_memory()[0]
+        probe["blocks"] = len(tracemalloc.take_snapshot().traces)
+
+    eva = Eva(Environment({"None": None, "probe": take_probe}), engine=engine)
+    compiled = eva.compile(program) if engine == "closure" else None
+    tracemalloc.start()
+    base_bytes = tracemalloc.get_traced_memory()[0]
+    base_blocks = len(tracemalloc.take_snapshot().traces)
+    if compiled is None:
+        eva.eval(program)
+    else:
+        eva.run(compiled)
+    peak = tracemalloc.get_traced_memory()[1] - base_bytes
+    tracemalloc.stop()
+    live_bytes = probe["bytes"] - base_bytes
+    live_blocks = probe["blocks"] - base_blocks
+    return peak, live_bytes / count, live_blocks / count
+
+
+if __name__ == "__main__":
+    sys.setrecursionlimit(100000)
+    for engine in ("ast", "closure", "stack"):
+        for name, program, count in (
+            ("recursion", RECURSION, DEPTH),
+            ("blocks", BLOCK_RECURSION, DEPTH),
+            ("instances", INSTANCE_LOOP, INSTANCES),
+        ):
+            peak, per_bytes, per_blocks = measure(engine, program, count)
+            print(
+                f"{engine:<8} {name:<10} peak={peak / 1024:9.1f} KiB"
+                f"  live/unit={per_bytes:7.1f} B  blocks/unit={per_blocks:5.2f}"
+            )
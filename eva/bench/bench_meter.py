@@ -0,0 +1,82 @@
+# benchmark: metering overhead
+###############################
+# run from the eva/ directory:  python bench/bench_meter.py [rounds]
+# every workload of suite.py per engine, unmetered and under limits it
+# never reaches (suite.METERED), the two runs interleaved so both see the
+# same machine load. best of `rounds` (default 15) each.
+#
+# on a loaded machine the ratio of the two moves by several % from run to
+# run, the `model` column is steady: the steps and allocations the meter
+# counted for one run, times the cost of counting one as the engines'
+# hot paths do (inlined meter.step()/meter.alloc()) measured here, over
+# the unmetered time.
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from meter import Meter
+from suite import ENGINES, METERED, WORKLOADS
+
+
+def interpreter(engine, setup, limits):
+    eva = Eva(Environment({"None": None, "true": True}), engine=engine, limits=limits)
+    if setup:
+        eva.evalGlobal(*setup)
+    return eva
+
+
+def eventCost():
+    # seconds per step/alloc counted by a running meter, inlined as in
+    # the engines, the `is not None` test included
+    meter = Meter(**METERED)
+    number = 10**6
+
+    def step():
+        if meter is not None:
+            meter.left -= 1
+            if meter.left < 0:
+                meter.overrun()
+
+    def alloc():
+        if meter is not None:
+            meter.room -= 1
+            if meter.room < 0:
+                meter.overrun()
+
+    empty = min(timeit.repeat(lambda: None, number=number, repeat=5))
+    return {
+        name: (min(timeit.repeat(fn, number=number, repeat=5)) - empty) / number
+        for name, fn in (("step", step), ("alloc", alloc))
+    }
+
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 15
+    cost = eventCost()
+    print(f"step {cost['step'] * 1e9:.0f} ns  alloc {cost['alloc'] * 1e9:.0f} ns")
+    worst = 0
+    for engine in ENGINES:
+        for name, (setup, program, expected) in WORKLOADS.items():
+            runs = {"off": interpreter(engine, setup, None), "on": interpreter(engine, setup, METERED)}
+            best = {"off": float("inf"), "on": float("inf")}
+            for _ in range(rounds):
+                for mode, eva in runs.items():
+                    start = time.perf_counter()
+                    assert eva.eval(program) == expected
+                    best[mode] = min(best[mode], time.perf_counter() - start)
+            used = runs["on"].meter.used()
+            model = (used["steps"] * cost["step"] + used["memory"] * cost["alloc"]) / rounds
+            model /= best["off"]
+            worst = max(worst, model)
+            print(
+                f"{engine + '/' + name:<18} off {best['off'] * 1e3:8.2f} ms"
+                f"  on {best['on'] * 1e3:8.2f} ms  x{best['on'] / best['off']:5.3f}"
+                f"  {used['steps'] // rounds:7} steps {used['memory'] // rounds:7} allocs"
+                f"  model +{model:6.1%}"
+            )
+    print(f"worst model +{worst:.1%}")
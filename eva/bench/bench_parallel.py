@@ -0,0 +1,60 @@
+# benchmark: parallel evaluation
+###############################
+# run from the eva/ directory:  python bench/bench_parallel.py [n] [forms]
+# `forms` independent (var rK (fib n)) top-level forms, by evalGlobal and
+# by evalParallel with 1, 2, 4, ... worker processes up to the core count,
+# then (map fib xs) vs (pmap fib xs). ast engine.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+FIB = ["def", "fib", "n", ["if", ["<", "n", 2], "n", ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]]]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    value = fn()
+    return value, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    cores = os.cpu_count()
+    forms = [["var", f"r{i}", ["fib", n]] for i in range(count)]
+    program = [FIB, *forms, ["+", "r0", f"r{count - 1}"]]
+    print(f"{count} x fib({n}), {cores} cores")
+
+    eva = Eva(Environment({}), workers=0)
+    expected, sequential = timed(lambda: eva.evalGlobal(*program))
+    print(f"evalGlobal            {sequential * 1e3:8.1f} ms")
+    workers = 1
+    while True:
+        eva = Eva(Environment({}), workers=workers)
+        # start the worker processes before timing
+        eva.evalParallel(FIB, ["var", "warm", ["fib", 1]])
+        value, elapsed = timed(lambda: eva.evalParallel(*program))
+        assert value == expected
+        print(
+            f"evalParallel workers={workers:<3}{elapsed * 1e3:8.1f} ms  x{sequential / elapsed:5.2f}"
+        )
+        eva.parallel.shutdown()
+        if workers >= cores:
+            break
+        workers = min(workers * 2, cores)
+
+    eva = Eva(Environment({}))
+    # count times n
+    eva.evalGlobal(FIB, ["var", "xs", ["+", ["*", ["range", count], 0], n]])
+    eva.eval(["pmap", "fib", ["range", 2]])
+    expected, sequential = timed(lambda: eva.eval(["map", "fib", "xs"]))
+    value, elapsed = timed(lambda: eva.eval(["pmap", "fib", "xs"]))
+    assert list(value) == list(expected)
+    print(f"map   {sequential * 1e3:8.1f} ms")
+    print(f"pmap  {elapsed * 1e3:8.1f} ms  x{sequential / elapsed:5.2f}  workers={cores}")
+    eva.parallel.shutdown()
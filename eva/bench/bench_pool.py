@@ -0,0 +1,81 @@
+# benchmark: interpreters per request
+###############################
+# run from the eva/ directory:  python bench/bench_pool.py [scripts] [engine]
+# short scripts per second on 1, 2, 4, 8 threads. every script gets its own
+# interpreter with a prelude of 50 defs, a class and `import Math`:
+# evaluated per script (fresh Eva) vs a snapshot from an EvaPool.
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from pool import EvaPool
+
+PRELUDE = [
+    *[["def", f"f{i}", "x", ["+", "x", i]] for i in range(50)],
+    [
+        "class",
+        "Point",
+        "None",
+        [
+            "begin",
+            ["def", "constructor", ["self", "x"], ["set", ["prop", "self", "x"], "x"]],
+            ["def", "get", "self", ["prop", "self", "x"]],
+        ],
+    ],
+    ["import", "Math"],
+]
+
+SCRIPT = [
+    "begin",
+    ["var", "p", ["new", "Point", 3]],
+    ["var", "total", 0],
+    ["for", ["var", "i", 0], ["<", "i", 20], ["++", "i"], ["+=", "total", ["f7", "i"]]],
+    ["+", "total", [["prop", "p", "get"], "p"]],
+]
+
+
+def fresh(engine):
+    eva = Eva(Environment({"None": None}), engine=engine)
+    eva.evalGlobal(*PRELUDE)
+    return eva.eval(SCRIPT)
+
+
+def pooled(pool):
+    with pool.interpreter() as eva:
+        return eva.eval(SCRIPT)
+
+
+def throughput(run, scripts, threads):
+    per_thread = scripts // threads
+
+    def work():
+        for _ in range(per_thread):
+            assert run() == 333
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return per_thread * threads / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    scripts = int(sys.argv[1]) if len(sys.argv) > 1 else 800
+    engine = sys.argv[2] if len(sys.argv) > 2 else "ast"
+    start = time.perf_counter()
+    pool = EvaPool(Environment({"None": None}), engine=engine, prelude=PRELUDE, size=8)
+    print(f"{engine}: pool built in {(time.perf_counter() - start) * 1e3:.1f} ms, {os.cpu_count()} cores")
+    for threads in (1, 2, 4, 8):
+        slow = throughput(lambda: fresh(engine), scripts, threads)
+        fast = throughput(lambda: pooled(pool), scripts, threads)
+        print(
+            f"threads={threads}  fresh {slow:8.0f} scripts/s"
+            f"  pool {fast:8.0f} scripts/s  x{fast / slow:5.1f}"
+        )
@@ -0,0 +1,41 @@
+# benchmark: profiler overhead
+###############################
+# run from the eva/ directory:  python bench/bench_profile.py [n] [repeat]
+# fib(n) (default 22) on the ast engine: not profiled, profiled, and
+# not profiled again after a profile block ended (must match the first).
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+FIB = ["if", ["<", "n", 2], "n", ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]]
+
+
+def best(eva, n, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        eva.eval(["fib", n])
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 22
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    eva = Eva(Environment({}))
+    eva.eval(["def", "fib", "n", FIB])
+    off = best(eva, n, repeat)
+    with eva.profile() as profiler:
+        on = best(eva, n, repeat)
+    after = best(eva, n, repeat)
+    print(f"fib({n}) ast, best of {repeat}")
+    print(f"off        {off * 1e3:8.1f} ms")
+    print(f"profiled   {on * 1e3:8.1f} ms  x{on / off:.2f}")
+    print(f"off again  {after * 1e3:8.1f} ms  x{after / off:.2f}")
+    print()
+    print(profiler.report())
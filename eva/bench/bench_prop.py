@@ -0,0 +1,79 @@
+# benchmark: method calls through an inheritance chain
+###############################
+# run from the eva/ directory:  python bench/bench_prop.py [calls]
+# classes C1 <- C2 <- ... <- C10, C1 defines `get`; an instance of Cd
+# calls ((prop o get) o) in a loop, so every call looks `get` up at
+# inheritance depth d. reports ns per call for d = 1..10 per engine, then
+# the lookup alone: Environment.lookup (the walk) against PropCache.lookup.
+import os
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import ClassEnvironment, Environment
+from evai import Eva
+from inline_cache import PropCache
+
+ENGINES = ("ast", "closure", "stack", "vm")
+
+
+def classes(depth):
+    exps = [
+        [
+            "class",
+            "C1",
+            "None",
+            [
+                "begin",
+                ["def", "constructor", ["self", "x"], ["set", ["prop", "self", "x"], "x"]],
+                ["def", "get", "self", ["prop", "self", "x"]],
+            ],
+        ]
+    ]
+    for i in range(2, depth + 1):
+        exps.append(["class", f"C{i}", f"C{i - 1}", ["begin"]])
+    return exps
+
+
+def program(depth, calls):
+    return [
+        "begin",
+        *classes(depth),
+        ["var", "o", ["new", f"C{depth}", 1]],
+        ["var", "total", 0],
+        ["var", "i", 0],
+        [
+            "while",
+            ["<", "i", calls],
+            ["begin", ["+=", "total", [["prop", "o", "get"], "o"]], ["++", "i"]],
+        ],
+        "total",
+    ]
+
+
+if __name__ == "__main__":
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print("depth " + "".join(f"{engine:>10}" for engine in ENGINES) + "   (ns/call)")
+    for depth in range(1, 11):
+        row = f"{depth:>5} "
+        for engine in ENGINES:
+            eva = Eva(Environment({"None": None}), engine=engine)
+            exp = program(depth, calls)
+            start = time.perf_counter()
+            assert eva.eval(exp) == calls
+            row += f"{(time.perf_counter() - start) / calls * 1e9:10.0f}"
+        print(row)
+
+    print("\ndepth      walk    cached   (ns/lookup)")
+    for depth in range(1, 11):
+        cls = ClassEnvironment({"get": 1}, Environment({}))
+        for _ in range(depth - 1):
+            cls = ClassEnvironment({}, cls)
+        instance = Environment({}, cls)
+        cache = PropCache("get")
+        number = 200000
+        walk = timeit.timeit(lambda: instance.lookup("get"), number=number)
+        cached = timeit.timeit(lambda: cache.lookup(instance), number=number)
+        print(f"{depth:>5} {walk / number * 1e9:9.0f} {cached / number * 1e9:9.0f}")
@@ -0,0 +1,78 @@
+# benchmark: reader throughput
+###############################
+# run from the eva/ directory:  python bench/bench_reader.py [megabytes]
+# parses a generated multi-megabyte module in S-expression syntax from a
+# file object and from an mmap, and the same module in the old bracket
+# syntax with python eval, reports MB/s, then the tracemalloc peak of a
+# second pass while streaming the forms (they are counted, not kept).
+import mmap
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reader import readForms
+
+
+def generate(path, megabytes, brackets=False):
+    size = 0
+    i = 0
+    with open(path, "w") as file:
+        while size < megabytes * 1e6:
+            if brackets:
+                line = f"['def','f{i}',['x','y'],['if',['<','x',{i}],['+','x','y'],['*','x',2.5]]],\n"
+            else:
+                line = f"(def f{i} (x y) (if (< x {i}) (+ x y) (* x 2.5)))  ; form {i}\n"
+            file.write(line)
+            size += len(line)
+            i += 1
+    return size, i
+
+
+def timed_stream(label, size, make_source, trace=True):
+    # timed without tracemalloc, it slows allocation-heavy code a lot
+    start = time.perf_counter()
+    count = sum(1 for _ in make_source())
+    elapsed = time.perf_counter() - start
+    peak = ""
+    if trace:
+        tracemalloc.start()
+        sum(1 for _ in make_source())
+        peak = f"  peak={tracemalloc.get_traced_memory()[1] / 1024:8.1f} KiB"
+        tracemalloc.stop()
+    print(f"{label:<22} {count:>8} forms  {size / elapsed / 1e6:6.2f} MB/s{peak}")
+
+
+if __name__ == "__main__":
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    with tempfile.TemporaryDirectory() as path:
+        sexp = os.path.join(path, "sexp")
+        size, _ = generate(sexp, megabytes)
+
+        def from_file(path):
+            with open(path, "rb") as file:
+                yield from readForms(file)
+
+        def from_mmap(path):
+            with open(path, "rb") as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    yield from readForms(mapped)
+
+        timed_stream("reader, file object", size, lambda: from_file(sexp))
+        timed_stream("reader, mmap", size, lambda: from_mmap(sexp))
+
+        brackets = os.path.join(path, "brackets")
+        size, _ = generate(brackets, megabytes, brackets=True)
+        timed_stream("reader, bracket syntax", size, lambda: from_file(brackets))
+
+        def python_eval():
+            with open(brackets, "r") as file:
+                body_str = file.read().replace("\n", "")
+            return eval("['begin'," + body_str + "]")[1:]
+
+        # python's compiler under tracemalloc takes minutes, the whole file
+        # and its AST are in memory anyway
+        timed_stream("python eval (before)", size, python_eval, trace=False)
@@ -0,0 +1,78 @@
+# benchmark: hot reload of an edited module
+###############################
+# run from the eva/ directory:  python bench/bench_reload.py [defs]
+# a module of `defs` (default 2000) functions, every 10th with a table
+# computed from it, one def edited at a time, per engine:
+# - import:  the next import evaluates the whole module again
+# - poll:    eva.pollModules() evaluates the def and its table only
+# - idle:    eva.pollModules() when no file changed
+# milliseconds from the file written to the module env updated, best of 5.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from modules import ModuleRegistry
+
+
+def source(defs, edited, version):
+    lines = ["; generated"]
+    for i in range(defs):
+        factor = version if i == edited else 1
+        lines.append(f"(def f{i} (x) (+ (* x {i}) {factor}))")
+        if i % 10 == 0:
+            lines.append(f"(var t{i} (+ (f{i} 1) (f{i} 2)))")
+    return "\n".join(lines)
+
+
+def write(path, text, stamp):
+    with open(path, "w") as file:
+        file.write(text)
+    # a distinct mtime however fast the edits come
+    os.utime(path, ns=(stamp, stamp))
+
+
+def best_of(fn, edit, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        edit()
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    defs = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for engine in ("ast", "closure", "stack", "vm"):
+        with tempfile.TemporaryDirectory() as path:
+            module = os.path.join(path, "Big")
+            stamps = iter(range(10**18, 10**18 + 10**12, 10**9))
+            edited = defs // 2 // 10 * 10
+            versions = iter(range(2, 1000))
+
+            def edit():
+                write(module, source(defs, edited, next(versions)), next(stamps))
+
+            write(module, source(defs, edited, 1), next(stamps))
+            eva = Eva(Environment({"None": None}), engine=engine)
+            eva.modules = ModuleRegistry(path)
+            eva.eval(["import", "Big"])
+
+            full = best_of(lambda: eva.eval(["import", "Big"]), edit)
+            patched = best_of(eva.pollModules, edit)
+            idle = best_of(eva.pollModules, lambda: None)
+            assert eva.pollModules() == {}
+            value = eva.eval(["prop", "Big", f"t{edited}"])
+            expected = eva.eval([["prop", "Big", f"f{edited}"], 1]) + eva.eval(
+                [["prop", "Big", f"f{edited}"], 2]
+            )
+            assert value == expected
+            print(
+                f"{engine:<8} {defs} defs  import {full * 1e3:8.2f} ms"
+                f"  poll {patched * 1e3:7.2f} ms x{full / patched:5.1f}  idle {idle * 1e3:6.3f} ms"
+            )
@@ -0,0 +1,61 @@
+# benchmark: startup from a snapshot
+###############################
+# run from the eva/ directory:  python bench/bench_snapshot.py [defs]
+# a prelude of `defs` (default 1000) function definitions, a class and
+# `import Math`, as source text. startup of a new interpreter that
+# parses and evaluates the prelude vs one that restores the snapshot
+# written by the first. best of 5, per engine.
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+from reader import parse
+
+
+def prelude(defs):
+    lines = [f"(def f{i} (x) (if (< x {i}) (+ x {i}) (* x 2)))" for i in range(defs)]
+    lines.append(
+        "(class Point None (begin"
+        " (def constructor (self x) (set (prop self x) x))"
+        " (def get (self) (prop self x))))"
+    )
+    lines.append("(import Math)")
+    return "\n".join(lines)
+
+
+def best_of(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    defs = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    source = prelude(defs)
+    path = os.path.join(tempfile.mkdtemp(), "prelude.eva-snapshot")
+    print(f"prelude: {defs} defs, {len(source) / 1024:.0f} KiB of source")
+    for engine in ("ast", "stack", "vm"):
+
+        def evaluate():
+            eva = Eva(Environment({"None": None}), engine=engine)
+            eva.evalGlobal(*parse(source))
+            return eva
+
+        def restore():
+            return Eva(Environment({"None": None}), engine=engine).restore(path)
+
+        evaluate().snapshot(path)
+        assert restore().eval([f"f{defs - 1}", 1]) == evaluate().eval([f"f{defs - 1}", 1])
+        t_evaluate, t_restore = best_of(evaluate), best_of(restore)
+        print(
+            f"{engine:<6} evaluate {t_evaluate * 1e3:7.1f} ms  restore {t_restore * 1e3:6.1f} ms"
+            f"  x{t_evaluate / t_restore:4.1f}  snapshot {os.path.getsize(path) / 1024:6.0f} KiB"
+        )
@@ -0,0 +1,55 @@
+# benchmark: tail calls and deep recursion
+###############################
+# run from the eva/ directory:  python bench/bench_tailcall.py [iterations]
+# a tail-recursive loop of 1e6 iterations per engine (constant python
+# stack), then a non-tail recursion far past sys.getrecursionlimit() on the
+# explicit-stack engine.
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+
+def tail_loop(n):
+    return [
+        "begin",
+        [
+            "def",
+            "loop",
+            ["n", "acc"],
+            ["if", ["=", "n", 0], "acc", ["loop", ["-", "n", 1], ["+", "acc", "n"]]],
+        ],
+        ["loop", n, 0],
+    ]
+
+
+def deep_recursion(n):
+    return [
+        "begin",
+        ["def", "count", "n", ["if", ["=", "n", 0], 0, ["+", 1, ["count", ["-", "n", 1]]]]],
+        ["count", n],
+    ]
+
+
+def timed(eva, exp):
+    start = time.perf_counter()
+    value = eva.eval(exp)
+    return value, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    print(f"recursion limit: {sys.getrecursionlimit()}")
+    for engine in ("ast", "closure", "stack"):
+        value, elapsed = timed(Eva(Environment({}), engine=engine), tail_loop(iterations))
+        print(
+            f"tail loop  {engine:<8} n={iterations}  {elapsed:6.2f} s"
+            f"  {elapsed / iterations * 1e9:7.1f} ns/iter  result={value}"
+        )
+    for depth in (10000, 100000):
+        value, elapsed = timed(Eva(Environment({}), engine="stack"), deep_recursion(depth))
+        print(f"non-tail   stack    depth={depth}  {elapsed:6.2f} s  result={value}")
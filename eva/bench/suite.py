@@ -0,0 +1,358 @@
+# benchmark suite with regression tracking
+###############################
+# run from the eva/ directory:
+#   python bench/suite.py run [-o results.json] [--engines ast vm]
+#                             [--workloads fib loops] [--warmup 2] [--repeat 10]
+#                             [--metered]
+#   python bench/suite.py compare old.json new.json [--threshold 0.1]
+#
+# every workload runs per engine, in a fresh interpreter: `warmup` runs
+# that are not measured, then `repeat` timed runs (median/p95), then one
+# more run for the allocation numbers: the environments and instances it
+# allocated (counted by a Meter, see meter.py), and under tracemalloc the
+# peak bytes python allocated during the run and the blocks still
+# allocated after it.
+# compare prints old/new medians per engine/workload and exits with 1 when
+# one got slower by more than the threshold (a fraction, 0.1 = 10%).
+# --metered runs every interpreter under limits it never reaches
+# (meter.py): compare against an unmetered run for the metering overhead.
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from env import Environment
+from evai import Eva
+
+ENGINES = ("ast", "closure", "stack", "vm")
+
+# limits of --metered, never reached
+METERED = {"steps": 10**12, "memory": 10**12, "timeout": 10**6}
+
+
+def nested(depth, exp):
+    for _ in range(depth):
+        exp = ["begin", exp]
+    return exp
+
+
+POINT = [
+    "class",
+    "Point",
+    "None",
+    [
+        "begin",
+        [
+            "def",
+            "constructor",
+            ["self", "x", "y"],
+            ["begin", ["set", ["prop", "self", "x"], "x"], ["set", ["prop", "self", "y"], "y"]],
+        ],
+        ["def", "calc", "self", ["+", ["prop", "self", "x"], ["prop", "self", "y"]]],
+    ],
+]
+
+POINT3D = [
+    "class",
+    "Point3D",
+    "Point",
+    [
+        "begin",
+        [
+            "def",
+            "constructor",
+            ["self", "x", "y", "z"],
+            [
+                "begin",
+                [["prop", ["super", "Point3D"], "constructor"], "self", "x", "y"],
+                ["set", ["prop", "self", "z"], "z"],
+            ],
+        ],
+        [
+            "def",
+            "calc",
+            "self",
+            ["+", [["prop", ["super", "Point3D"], "calc"], "self"], ["prop", "self", "z"]],
+        ],
+    ],
+]
+
+# name -> (program, expected result)
+WORKLOADS = {
+    "factorial": (
+        [
+            "begin",
+            [
+                "def",
+                "factorial",
+                "x",
+                ["if", ["=", "x", 1], 1, ["*", "x", ["factorial", ["-", "x", 1]]]],
+            ],
+            ["var", "total", 0],
+            ["for", ["var", "i", 0], ["<", "i", 200], ["++", "i"], ["+=", "total", ["factorial", 20]]],
+            "total",
+        ],
+        200 * 2432902008176640000,
+    ),
+    "fib": (
+        [
+            "begin",
+            [
+                "def",
+                "fib",
+                "n",
+                ["if", ["<", "n", 2], "n", ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]],
+            ],
+            ["fib", 16],
+        ],
+        987,
+    ),
+    "loops": (
+        [
+            "begin",
+            ["var", "sum", 0],
+            [
+                "for",
+                ["var", "i", 0],
+                ["<", "i", 100],
+                ["++", "i"],
+                [
+                    "begin",
+                    ["var", "j", 0],
+                    ["while", ["<", "j", 100], ["begin", ["+=", "sum", "j"], ["++", "j"]]],
+                ],
+            ],
+            "sum",
+        ],
+        100 * 4950,
+    ),
+    "closures": (
+        [
+            "begin",
+            [
+                "def",
+                "makeCounter",
+                "start",
+                [
+                    "begin",
+                    ["var", "count", "start"],
+                    ["lambda", [], ["begin", ["++", "count"], "count"]],
+                ],
+            ],
+            ["var", "total", 0],
+            [
+                "for",
+                ["var", "i", 0],
+                ["<", "i", 2000],
+                ["++", "i"],
+                [
+                    "begin",
+                    ["var", "counter", ["makeCounter", "i"]],
+                    ["counter"],
+                    ["+=", "total", ["counter"]],
+                ],
+            ],
+            "total",
+        ],
+        sum(i + 2 for i in range(2000)),
+    ),
+    "classes": (
+        [
+            "begin",
+            POINT,
+            POINT3D,
+            ["var", "total", 0],
+            [
+                "for",
+                ["var", "i", 0],
+                ["<", "i", 2000],
+                ["++", "i"],
+                [
+                    "begin",
+                    ["var", "p", ["new", "Point3D", "i", 1, 2]],
+                    ["+=", "total", [["prop", "p", "calc"], "p"]],
+                ],
+            ],
+            "total",
+        ],
+        sum(i + 3 for i in range(2000)),
+    ),
+    "import": (
+        [
+            "begin",
+            ["var", "total", 0],
+            [
+                "for",
+                ["var", "i", 0],
+                ["<", "i", 2000],
+                ["++", "i"],
+                ["begin", ["import", "Math"], ["+=", "total", ["prop", "Math", "MAX_VALUE"]]],
+            ],
+            "total",
+        ],
+        2000 * 1000,
+    ),
+    "lookup": (
+        [
+            "begin",
+            ["var", "MAX_VALUE", 1000],
+            [
+                "def",
+                "run",
+                "n",
+                [
+                    "begin",
+                    ["var", "acc", 0],
+                    [
+                        "for",
+                        ["var", "i", 0],
+                        ["<", "i", "n"],
+                        ["++", "i"],
+                        nested(8, ["set", "acc", ["+", "acc", "MAX_VALUE"]]),
+                    ],
+                    "acc",
+                ],
+            ],
+            ["run", 5000],
+        ],
+        5000 * 1000,
+    ),
+}
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(fraction * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def measure(engine, name, warmup=2, repeat=10, limits=None):
+    program, expected = WORKLOADS[name]
+    eva = Eva(Environment({"None": None, "true": True}), engine=engine, limits=limits)
+
+    def run():
+        value = eva.eval(program)
+        if value != expected:
+            raise AssertionError(f"{engine}/{name}: got {value}, expected {expected}")
+
+    for _ in range(warmup):
+        run()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    # --metered: the interpreter's own meter, else one without limits
+    meter = eva.meter or eva.limit()
+    allocs = meter.used()["memory"]
+    tracemalloc.start()
+    blocks = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.reset_peak()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    retained = sum(stat.count for stat in tracemalloc.take_snapshot().statistics("filename"))
+    tracemalloc.stop()
+    allocs = meter.used()["memory"] - allocs
+    if limits is None:
+        meter.stop()
+    return {
+        "median_ms": statistics.median(timings) * 1e3,
+        "p95_ms": percentile(timings, 0.95) * 1e3,
+        "min_ms": min(timings) * 1e3,
+        "allocs": allocs,
+        "peak_alloc_bytes": peak,
+        "retained_blocks": retained - blocks,
+        "repeat": repeat,
+    }
+
+
+def runSuite(
+    engines=ENGINES, workloads=None, warmup=2, repeat=10, out=sys.stdout, limits=None
+):
+    results = {}
+    for engine in engines:
+        for name in workloads or WORKLOADS:
+            key = f"{engine}/{name}"
+            results[key] = measure(engine, name, warmup, repeat, limits)
+            entry = results[key]
+            print(
+                f"{key:<18} median {entry['median_ms']:9.2f} ms  p95 {entry['p95_ms']:9.2f} ms"
+                f"  allocs {entry['allocs']:7}  peak {entry['peak_alloc_bytes'] / 1024:9.1f} KiB"
+                f"  retained {entry['retained_blocks']:6} blocks",
+                file=out,
+            )
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+
+
+def compare(old, new, threshold=0.1, out=sys.stdout):
+    # engine/workload keys that got slower than old median * (1 + threshold)
+    regressions = []
+    for key, entry in new["results"].items():
+        before = old["results"].get(key)
+        if before is None:
+            print(f"{key:<18} new", file=out)
+            continue
+        ratio = entry["median_ms"] / before["median_ms"]
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(
+            f"{key:<18} {before['median_ms']:9.2f} -> {entry['median_ms']:9.2f} ms"
+            f"  x{ratio:5.2f}{flag}",
+            file=out,
+        )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Eva benchmark suite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the suite")
+    run.add_argument("-o", "--output", help="write the results to this JSON file")
+    run.add_argument("--engines", nargs="+", choices=ENGINES, default=list(ENGINES))
+    run.add_argument("--workloads", nargs="+", choices=list(WORKLOADS))
+    run.add_argument("--warmup", type=int, default=2)
+    run.add_argument("--repeat", type=int, default=10)
+    run.add_argument("--metered", action="store_true", help="run under resource limits")
+    diff = commands.add_parser("compare", help="flag regressions between two result files")
+    diff.add_argument("old")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        limits = METERED if args.metered else None
+        results = runSuite(
+            args.engines, args.workloads, args.warmup, args.repeat, limits=limits
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,568 @@
+# Bytecode compiler
+###############################
+# compile an Eva AST to a flat array('i') of instructions plus a constant
+# pool, executed by vm.VM.
+#
+# instruction: 3 ints (op, a, b), jumps are absolute instruction offsets.
+#
+# functions
+#######################
+# every lambda becomes a Proto (code, consts, frame layout). locals of a
+# function (params, vars of its begin blocks) live in the activation's
+# `locals` list. a local that an inner lambda references is kept in a Cell,
+# and the inner closure captures the cell as an upvalue, so a closure holds
+# its upvalues instead of the whole environment chain.
+#
+# dict-backed scopes (root env, class body, module body, instances) are
+# the same env.Environment objects the AST interpreter uses. a name that
+# reaches one of them is looked up by name in the frame's dynamic env.
+#
+# addresses
+#######################
+# ("local", slot, is_cell)  this activation's locals[slot]
+# ("upval", index)          this closure's cells[index]
+# ("name",)                 dynamic env lookup by name
+# ("dynamic",)              dynamic env lookup by name, in the body of a
+#                           class with a parent class: it may be inherited,
+#                           else it is one of the enclosing bindings
+# a reference compiles to its innermost address; the enclosing bindings of
+# the same name are kept in the constant pool, they are used while the
+# innermost one is not defined yet (read before its `var` ran), like
+# Environment.resolve falls back to the parent env.
+
+from array import array
+from inline_cache import PropCache
+from resolver import collectDeclarations
+from transformer import Transformer
+
+OPCODES = [
+    "LOAD_CONST",
+    "LOAD_LOCAL",
+    "LOAD_CELL",
+    "LOAD_UPVAL",
+    "LOAD_NAME",
+    "STORE_LOCAL",
+    "STORE_CELL",
+    "DEFINE_NAME",
+    "ASSIGN_LOCAL",
+    "ASSIGN_CELL",
+    "ASSIGN_UPVAL",
+    "ASSIGN_NAME",
+    "CLEAR_LOCAL",
+    "MAKE_CELL",
+    "CELL_PARAM",
+    "POP",
+    "ADD",
+    "SUB",
+    "MUL",
+    "GT",
+    "LT",
+    "EQ",
+    "NEG",
+    "JUMP",
+    "JUMP_IF_FALSE",
+    "MAKE_CLOSURE",
+    "CALL",
+    "TAIL_CALL",
+    "NEW",
+    "GET_PROP",
+    "SET_PROP",
+    "SUPER",
+    "CLASS_ENTER",
+    "CLASS_EXIT",
+    "MODULE_ENTER",
+    "MODULE_EXIT",
+    "IMPORT",
+    "REGISTER_MODULE",
+    "RETURN",
+]
+(
+    LOAD_CONST,
+    LOAD_LOCAL,
+    LOAD_CELL,
+    LOAD_UPVAL,
+    LOAD_NAME,
+    STORE_LOCAL,
+    STORE_CELL,
+    DEFINE_NAME,
+    ASSIGN_LOCAL,
+    ASSIGN_CELL,
+    ASSIGN_UPVAL,
+    ASSIGN_NAME,
+    CLEAR_LOCAL,
+    MAKE_CELL,
+    CELL_PARAM,
+    POP,
+    ADD,
+    SUB,
+    MUL,
+    GT,
+    LT,
+    EQ,
+    NEG,
+    JUMP,
+    JUMP_IF_FALSE,
+    MAKE_CLOSURE,
+    CALL,
+    TAIL_CALL,
+    NEW,
+    GET_PROP,
+    SET_PROP,
+    SUPER,
+    CLASS_ENTER,
+    CLASS_EXIT,
+    MODULE_ENTER,
+    MODULE_EXIT,
+    IMPORT,
+    REGISTER_MODULE,
+    RETURN,
+) = range(len(OPCODES))
+
+BINARY_OPCODES = {"+": ADD, "-": SUB, "*": MUL, ">": GT, "<": LT, "=": EQ}
+
+
+class Proto:
+    # compiled function
+    def __init__(self, name, nparams):
+        self.name = name
+        self.nparams = nparams
+        self.code = array("i")
+        self.consts = []
+        self.nlocals = nparams
+        # (from_parent_local, index) per upvalue
+        self.upvalues = []
+
+
+def disassemble(proto):
+    lines = []
+    code = proto.code
+    for ip in range(0, len(code), 3):
+        op, a, b = code[ip], code[ip + 1], code[ip + 2]
+        lines.append(f"{ip:5} {OPCODES[op]:<14} {a:4} {b:4}")
+    return "\n".join(lines)
+
+
+class _Block:
+    def __init__(self, dynamic=False, static_parent=True):
+        self.dynamic = dynamic
+        self.static_parent = static_parent
+        # frame block: {var:(slot, is_cell)}, dynamic block: declared names
+        self.names = {}
+
+
+class _FunctionState:
+    def __init__(self, proto, parent, body):
+        self.proto = proto
+        self.parent = parent
+        self.blocks = []
+        self.next_slot = proto.nparams
+        self._consts = {}
+        self._upvalues = {}
+        # names inner lambdas may reference: these locals are cells
+        self.captured = set()
+        _lambdaNames(body, self.captured)
+
+    def const(self, value):
+        key = (type(value), value) if _hashable(value) else id(value)
+        if key not in self._consts:
+            self._consts[key] = len(self.proto.consts)
+            self.proto.consts.append(value)
+        return self._consts[key]
+
+    def upvalue(self, from_parent_local, index):
+        key = (from_parent_local, index)
+        if key not in self._upvalues:
+            self._upvalues[key] = len(self.proto.upvalues)
+            self.proto.upvalues.append(key)
+        return self._upvalues[key]
+
+    def declare(self, block, var):
+        if var not in block.names:
+            block.names[var] = (self.next_slot, var in self.captured)
+            self.next_slot += 1
+            self.proto.nlocals = max(self.proto.nlocals, self.next_slot)
+        return block.names[var]
+
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+def _lambdaNames(exp, names, inside=False):
+    if isinstance(exp, str):
+        if inside:
+            names.add(exp)
+    elif isinstance(exp, list):
+        if exp and exp[0] in ("lambda", "def", "def-memo"):
+            inside = True
+        for i in exp:
+            _lambdaNames(i, names, inside)
+
+
+class BytecodeCompiler:
+    def __init__(self, transformer=None):
+        self._transformer = transformer or Transformer()
+        self._fs = None
+        # share closures without upvalues (MAKE_CLOSURE b=1)
+        self.escape_analysis = True
+        self._special_forms = {
+            "++": self._compile_sugar(self._transformer.transformIncToSet),
+            "--": self._compile_sugar(self._transformer.transformDecToSet),
+            "+=": self._compile_sugar(self._transformer.transformIncValToSet),
+            "-=": self._compile_sugar(self._transformer.transformDecValToSet),
+            "for": self._compile_sugar(self._transformer.transformForToWhile),
+            "def": self._compile_sugar(self._transformer.transformDefToVarLambda),
+            "def-memo": self._compile_sugar(self._transformer.transform),
+            "var": self._compile_var,
+            "set": self._compile_set,
+            "begin": self._compile_begin,
+            "if": self._compile_if,
+            "switch": self._compile_switch,
+            "while": self._compile_while,
+            "lambda": self._compile_lambda,
+            "class": self._compile_class,
+            "new": self._compile_new,
+            "prop": self._compile_prop,
+            "super": self._compile_super,
+            "module": self._compile_module,
+            "import": self._compile_import,
+            "await-all": self._compile_await_all,
+        }
+
+    # entry points
+    # --------------------------
+    def compileProgram(self, exp, body=False):
+        # a program runs in a dict-backed (dynamic) root env
+        # body=True: exp is a ['begin', ...] evaluated directly in the root
+        exps = exp[1:] if body else [exp]
+        return self._compileRoot("<program>", exps, exp)
+
+    def compileModuleBody(self, name, body):
+        # body of an imported module, runs with the module env as root
+        return self._compileRoot(name, _bodyExps(body), body)
+
+    def _compileRoot(self, name, exps, source):
+        outer = self._fs
+        self._fs = _FunctionState(Proto(name, 0), None, source)
+        try:
+            block = self._pushBlock(dynamic=True)
+            for var in collectDeclarations(exps):
+                block.names[var] = True
+            self._compile_sequence(exps)
+            self._emit(RETURN)
+            return self._fs.proto
+        finally:
+            self._fs = outer
+
+    # emit helpers
+    # --------------------------
+    def _emit(self, op, a=0, b=0):
+        code = self._fs.proto.code
+        code.extend((op, a, b))
+        return len(code) - 3
+
+    def _here(self):
+        return len(self._fs.proto.code)
+
+    def _patch(self, ip, target):
+        self._fs.proto.code[ip + 1] = target
+
+    def _pushBlock(self, dynamic=False, static_parent=True):
+        block = _Block(dynamic, static_parent)
+        self._fs.blocks.append(block)
+        return block
+
+    def _popBlock(self, saved_slot):
+        self._fs.blocks.pop()
+        # slots of a finished block are reused by the next one
+        self._fs.next_slot = saved_slot
+
+    # name resolution
+    # --------------------------
+    def _bindings(self, fs, var):
+        # every binding of var visible from fs, innermost first
+        addresses = []
+        for block in reversed(fs.blocks):
+            if block.dynamic:
+                if var in block.names:
+                    addresses.append(("name",))
+                    return addresses
+                if not block.static_parent:
+                    addresses.append(("dynamic",))
+            elif var in block.names:
+                slot, is_cell = block.names[var]
+                addresses.append(("local", slot, is_cell))
+        if fs.parent is None:
+            addresses.append(("name",))
+            return addresses
+        for address in self._bindings(fs.parent, var):
+            if address[0] == "name" or address[0] == "dynamic":
+                addresses.append(address)
+            elif address[0] == "local":
+                addresses.append(("upval", fs.upvalue(True, address[1])))
+            else:
+                addresses.append(("upval", fs.upvalue(False, address[1])))
+        return addresses
+
+    def _reference(self, var):
+        first, *rest = self._bindings(self._fs, var)
+        fallback = self._fs.const((var, tuple(rest)))
+        return first, fallback
+
+    def _compile_lookup(self, var):
+        address, fallback = self._reference(var)
+        if address[0] == "local":
+            _, slot, is_cell = address
+            self._emit(LOAD_CELL if is_cell else LOAD_LOCAL, slot, fallback)
+        elif address[0] == "upval":
+            self._emit(LOAD_UPVAL, address[1], fallback)
+        else:
+            # b: 1 + the fallback of a ("dynamic",) lookup, 0: none
+            dynamic = fallback + 1 if address[0] == "dynamic" else 0
+            self._emit(LOAD_NAME, self._fs.const(var), dynamic)
+
+    def _compile_assign(self, var):
+        address, fallback = self._reference(var)
+        if address[0] == "local":
+            _, slot, is_cell = address
+            self._emit(ASSIGN_CELL if is_cell else ASSIGN_LOCAL, slot, fallback)
+        elif address[0] == "upval":
+            self._emit(ASSIGN_UPVAL, address[1], fallback)
+        else:
+            dynamic = fallback + 1 if address[0] == "dynamic" else 0
+            self._emit(ASSIGN_NAME, self._fs.const(var), dynamic)
+
+    def _compile_define(self, var):
+        # declare var in the innermost scope (var/def/class/module/import)
+        block = self._fs.blocks[-1]
+        if block.dynamic:
+            self._emit(DEFINE_NAME, self._fs.const(var))
+            return
+        slot, is_cell = self._fs.declare(block, var)
+        self._emit(STORE_CELL if is_cell else STORE_LOCAL, slot)
+
+    # expressions
+    # --------------------------
+    def compile(self, exp, tail=False):
+        # self-evaluating
+        if isinstance(exp, (int, float)):
+            self._emit(LOAD_CONST, self._fs.const(exp))
+            return
+        if isinstance(exp, str):
+            if exp[0] == '"' and exp[-1] == '"':
+                self._emit(LOAD_CONST, self._fs.const(exp[1:-1]))
+                return
+            if exp[0].isalpha():
+                self._compile_lookup(exp)
+                return
+        if isinstance(exp, list):
+            head = exp[0]
+            if isinstance(head, str):
+                op = BINARY_OPCODES.get(head)
+                if op is not None:
+                    self.compile(exp[1])
+                    if head == "-" and len(exp) == 2:
+                        self._emit(NEG)
+                        return
+                    self.compile(exp[2])
+                    self._emit(op)
+                    return
+                handler = self._special_forms.get(head)
+                if handler is not None:
+                    handler(exp, tail)
+                    return
+            self._compile_call(exp, tail)
+            return
+        print(f"not inplemented {exp}")
+        self._emit(LOAD_CONST, self._fs.const(None))
+
+    def _compile_sequence(self, exps, tail=False):
+        if not exps:
+            self._emit(LOAD_CONST, self._fs.const(None))
+            return
+        for i in exps[:-1]:
+            self.compile(i)
+            self._emit(POP)
+        self.compile(exps[-1], tail)
+
+    def _compile_sugar(self, transform):
+        return lambda exp, tail=False: self.compile(transform(exp), tail)
+
+    # ['var', var_name ,value]
+    def _compile_var(self, exp, tail=False):
+        _, var, value = exp
+        self.compile(value)
+        self._compile_define(var)
+
+    # ['set',var_name, value]
+    # ['set',['prop','self','x'],10]
+    def _compile_set(self, exp, tail=False):
+        _, ref, value = exp
+        if ref[0] == "prop":
+            _, instance, prop_name = ref
+            self.compile(instance)
+            self.compile(value)
+            self._emit(SET_PROP, self._fs.const(prop_name))
+            return
+        self.compile(value)
+        self._compile_assign(ref)
+
+    # block scope: its locals get slots in the enclosing activation
+    def _compile_begin(self, exp, tail=False):
+        declarations = collectDeclarations(exp[1:])
+        saved_slot = self._fs.next_slot
+        block = self._pushBlock()
+        try:
+            for var in declarations:
+                slot, is_cell = self._fs.declare(block, var)
+                # a fresh binding each time the block is entered
+                self._emit(MAKE_CELL if is_cell else CLEAR_LOCAL, slot)
+            self._compile_sequence(exp[1:], tail)
+        finally:
+            self._popBlock(saved_slot)
+
+    # ['if', condition, stmt_then, stmt_else]
+    def _compile_if(self, exp, tail=False):
+        _, cond, stmt1, stmt2 = exp
+        self.compile(cond)
+        jump_else = self._emit(JUMP_IF_FALSE)
+        self.compile(stmt1, tail)
+        jump_end = self._emit(JUMP)
+        self._patch(jump_else, self._here())
+        self.compile(stmt2, tail)
+        self._patch(jump_end, self._here())
+
+    def _compile_switch(self, exp, tail=False):
+        self._compile_if(self._transformer.transformSwitchToIfexp(exp), tail)
+
+    # ['while', cond, body]: the value of the last body run stays on stack
+    def _compile_while(self, exp, tail=False):
+        _, cond, body = exp
+        self._emit(LOAD_CONST, self._fs.const(None))
+        loop = self._here()
+        self.compile(cond)
+        jump_end = self._emit(JUMP_IF_FALSE)
+        self._emit(POP)
+        self.compile(body)
+        self._emit(JUMP, loop)
+        self._patch(jump_end, self._here())
+
+    # ['lambda', params, body]
+    def _compile_lambda(self, exp, tail=False):
+        _, params, body = exp
+        if not isinstance(params, list):
+            params = [params]
+        proto = Proto("lambda", len(params))
+        outer = self._fs
+        self._fs = _FunctionState(proto, outer, body)
+        try:
+            block = self._pushBlock()
+            for slot, param in enumerate(params):
+                is_cell = param in self._fs.captured
+                block.names[param] = (slot, is_cell)
+                if is_cell:
+                    self._emit(CELL_PARAM, slot)
+            for var in collectDeclarations(_bodyExps(body)):
+                if var not in block.names:
+                    slot, is_cell = self._fs.declare(block, var)
+                    if is_cell:
+                        self._emit(MAKE_CELL, slot)
+            if isinstance(body, list) and body and body[0] == "begin":
+                self._compile_sequence(body[1:], tail=True)
+            else:
+                self.compile(body, tail=True)
+            self._emit(RETURN)
+        finally:
+            self._fs = outer
+        # capturing no cell, the closure only holds the dynamic env: every
+        # evaluation there can return the same one, kept in the env's
+        # `closures`
+        shared = self.escape_analysis and not proto.upvalues
+        self._emit(MAKE_CLOSURE, self._fs.const(proto), int(shared))
+
+    # ['class', class_name, parent, body]
+    def _compile_class(self, exp, tail=False):
+        _, class_name, parent, body = exp
+        self.compile(parent)
+        self._emit(CLASS_ENTER)
+        self._compile_dynamic_body(body, static_parent=parent == "None")
+        self._emit(CLASS_EXIT)
+        self._compile_define(class_name)
+
+    # ['module', module_name, body]
+    def _compile_module(self, exp, tail=False):
+        _, module_name, body = exp
+        self._emit(MODULE_ENTER)
+        self._compile_dynamic_body(body)
+        self._emit(MODULE_EXIT)
+        self._compile_define(module_name)
+
+    def _compile_dynamic_body(self, body, static_parent=True):
+        # class/module body, runs with the new env as the dynamic env
+        block = self._pushBlock(dynamic=True, static_parent=static_parent)
+        try:
+            exps = _bodyExps(body)
+            for var in collectDeclarations(exps):
+                block.names[var] = True
+            for i in exps:
+                self.compile(i)
+                self._emit(POP)
+        finally:
+            self._popBlock(self._fs.next_slot)
+
+    # ['import','Math']: IMPORT runs the body of a module not loaded yet,
+    # REGISTER_MODULE registers it once the body finished (skipped when
+    # IMPORT found it loaded)
+    def _compile_import(self, exp, tail=False):
+        _, module_name = exp
+        name = self._fs.const(module_name)
+        self._emit(IMPORT, name)
+        self._emit(REGISTER_MODULE, name)
+        self._compile_define(module_name)
+
+    # ['new', class_name, args]
+    def _compile_new(self, exp, tail=False):
+        _, class_name, *args = exp
+        self._compile_lookup(class_name)
+        for i in args:
+            self.compile(i)
+        self._emit(NEW, len(args))
+
+    # ['prop', instante, var_name]
+    def _compile_prop(self, exp, tail=False):
+        _, instance, var_name = exp
+        self.compile(instance)
+        # a new const per site: the site's inline cache
+        self._emit(GET_PROP, self._fs.const(PropCache(var_name)))
+
+    # ['super', class_name]
+    def _compile_super(self, exp, tail=False):
+        self.compile(exp[1])
+        self._emit(SUPER)
+
+    # ['await-all', exp...]: a call of _awaitAll, the list of the values
+    def _compile_await_all(self, exp, tail=False):
+        self._emit(LOAD_CONST, self._fs.const(_awaitAll))
+        for i in exp[1:]:
+            self.compile(i)
+        self._emit(CALL, len(exp) - 1)
+
+    # function call
+    def _compile_call(self, exp, tail=False):
+        for i in exp:
+            self.compile(i)
+        self._emit(TAIL_CALL if tail else CALL, len(exp) - 1)
+
+
+def _awaitAll(*values):
+    return list(values)
+
+
+def _bodyExps(body):
+    if isinstance(body, list) and body and body[0] == "begin":
+        return body[1:]
+    return [body]
@@ -0,0 +1,659 @@
+# Closure compiler
+###############################
+# walk the AST once and turn every node into a python closure `run(env)`.
+# the special form decision (and syntax sugar transform) is made at compile
+# time, so executing a loop body or a recursive call never re-inspects the
+# raw list AST again.
+
+# variables are resolved to lexical addresses while compiling (see
+# resolver.py): locals of begin blocks and function activations live in
+# array-backed env.Frame slots, names that reach a dict-backed scope
+# (global, class, module) are looked up there by name.
+
+# compiled function
+#######################
+# a lambda evaluates to [params, code, env] (same shape as the AST
+# interpreter's [params, body, env]), code is a Code object that keeps the
+# source body next to its compiled closure and the activation frame layout.
+
+import host
+from env import ClassEnvironment, Environment, Frame, Instance, UNDEFINED
+from inline_cache import PropCache
+from optimizer import boundNames
+from resolver import Scope, collectDeclarations, referencedNames
+from runtime import running
+
+
+class Code:
+    __slots__ = ("exp", "run", "names", "nparams", "pad")
+
+    def __init__(self, exp, run, names, nparams):
+        self.exp = exp
+        self.run = run
+        # activation frame layout: params first, then the body's locals
+        self.names = names
+        self.nparams = nparams
+        self.pad = [UNDEFINED] * (len(names) - nparams)
+
+    def __call__(self, env):
+        return self.run(env)
+
+
+# proper tail calls
+#######################
+# a user function call in tail position of a function body (through
+# if/begin/switch) returns TailCall(fn, args) instead of calling, and the
+# caller's trampoline runs it in place of the finished activation.
+
+
+class TailCall:
+    __slots__ = ("fn", "args")
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+
+
+def callFunction(fn, args, meter=None):
+    # meter: the Meter of the running interpreter (meter.py, runtime.py)
+    while True:
+        params, code, fn_env = fn
+        if meter is not None:
+            # meter.call()
+            meter.left -= 1
+            meter.room -= 1
+            if meter.left < 0 or meter.room < 0:
+                meter.overrun()
+        if len(args) != code.nparams:
+            if len(args) < code.nparams:
+                raise ValueError(f"Expected {code.nparams} arguments, got {len(args)}.")
+            args = args[: code.nparams]
+        ret = code.run(Frame(code.names, args + code.pad, fn_env))  # static scope
+        if type(ret) is not TailCall:
+            return ret
+        fn, args = ret.fn, ret.args
+
+
+def _hop(env, depth):
+    for _ in range(depth):
+        env = env.parent
+    return env
+
+
+class Compiler:
+    def __init__(self, eva):
+        self.eva = eva
+        self._transformer = eva._transformer
+        self._scope = None
+        self._unresolved = set()
+        # (global name, number of arguments) of the calls compiled
+        self._calls = set()
+        # see _compile_lambda
+        self.escape_analysis = True
+        self._special_forms = {
+            "+": self._compile_add,
+            "-": self._compile_sub,
+            "*": self._compile_mul,
+            ">": self._compile_gt,
+            "<": self._compile_lt,
+            "=": self._compile_eq,
+            "++": self._compile_inc,
+            "--": self._compile_dec,
+            "+=": self._compile_inc_val,
+            "-=": self._compile_dec_val,
+            "var": self._compile_var,
+            "set": self._compile_set,
+            "begin": self._compile_begin,
+            "if": self._compile_if,
+            "switch": self._compile_switch,
+            "while": self._compile_while,
+            "for": self._compile_for,
+            "def": self._compile_def,
+            "def-memo": self._compile_def_memo,
+            "lambda": self._compile_lambda,
+            "class": self._compile_class,
+            "new": self._compile_new,
+            "prop": self._compile_prop,
+            "super": self._compile_super,
+            "module": self._compile_module,
+            "import": self._compile_import,
+            "await-all": self._compile_await_all,
+        }
+
+    def compileProgram(self, exp, env, body=False):
+        # compile exp to run in env (the root, dict-backed scope)
+        # body=True: exp is a ['begin', ...] evaluated directly in env
+        outer = self._scope, self._unresolved, self._calls
+        self._scope, self._unresolved, self._calls = Scope("dynamic"), set(), set()
+        try:
+            if body:
+                for var in collectDeclarations(exp[1:]):
+                    self._scope.declare(var)
+                compiled = self.compileBody(exp)
+            else:
+                for var in collectDeclarations([exp]):
+                    self._scope.declare(var)
+                compiled = self.compile(exp)
+            # report names that are declared nowhere once, before running
+            for var in sorted(self._unresolved):
+                env.resolve(var)
+            self._checkArity(exp, env)
+        finally:
+            self._scope, self._unresolved, self._calls = outer
+        return compiled
+
+    def _checkArity(self, exp, env):
+        # calls of a host function declared with an arity (host.py), by a
+        # global name the program never assigns
+        if not self._calls:
+            return
+        assigned = boundNames(exp)
+        for name, nargs in sorted(self._calls):
+            if name in assigned:
+                continue
+            entry = host.describe(env.lookup(name))
+            if entry is not None and entry.arity is not None and entry.arity != nargs:
+                raise ValueError(
+                    f"Expected {entry.arity} arguments for '{name}', got {nargs}."
+                )
+
+    def compile(self, exp):
+        # self-evaluating
+        # -----------------------
+        if isinstance(exp, (int, float)):
+            return lambda env: exp
+        if isinstance(exp, str):
+            if exp[0] == '"' and exp[-1] == '"':
+                value = exp[1:-1]
+                return lambda env: value
+            # var lookup/access
+            if exp[0].isalpha():
+                return self._compile_lookup(exp)
+
+        # special forms
+        # --------------------------
+        if isinstance(exp, list):
+            head = exp[0]
+            if isinstance(head, str):
+                handler = self._special_forms.get(head)
+                if handler is not None:
+                    return handler(exp)
+            return self._compile_call(exp)
+
+        def run(env):
+            print(f"not inplemented {exp}")
+
+        return run
+
+    def _enterScope(self, kind, declarations=(), static_parent=True):
+        self._scope = Scope(kind, self._scope, static_parent)
+        for var in declarations:
+            self._scope.declare(var)
+        return self._scope
+
+    def _leaveScope(self):
+        self._scope = self._scope.parent
+
+    def _address(self, var):
+        address, known = self._scope.resolve(var)
+        if not known:
+            self._unresolved.add(var)
+        return address
+
+    # variable reference by lexical address
+    # --------------------------
+    def _compile_lookup(self, var):
+        address = self._address(var)
+        if address[0] == "slot":
+            _, depth, slot = address
+
+            # a declared local whose `var` has not run yet falls back to
+            # the enclosing scopes, like Environment.resolve does
+            if depth == 0:
+
+                def run(env):
+                    value = env.values[slot]
+                    if value is UNDEFINED:
+                        return env.lookup(var)
+                    return value
+
+            elif depth == 1:
+
+                def run(env):
+                    value = env.parent.values[slot]
+                    if value is UNDEFINED:
+                        return env.parent.lookup(var)
+                    return value
+
+            else:
+
+                def run(env):
+                    frame = _hop(env, depth)
+                    value = frame.values[slot]
+                    if value is UNDEFINED:
+                        return frame.lookup(var)
+                    return value
+
+            return run
+
+        _, depth = address
+        if depth == 0:
+            return lambda env: env.lookup(var)
+        if depth == 1:
+            return lambda env: env.parent.lookup(var)
+        return lambda env: _hop(env, depth).lookup(var)
+
+    def _compile_assign(self, var, value):
+        address = self._address(var)
+        if address[0] == "slot":
+            _, depth, slot = address
+
+            def run(env):
+                frame = _hop(env, depth)
+                if frame.values[slot] is UNDEFINED:
+                    return frame.assign(var, value(env))
+                frame.values[slot] = ret = value(env)
+                return ret
+
+            return run
+
+        _, depth = address
+        return lambda env: _hop(env, depth).assign(var, value(env))
+
+    def compileBody(self, body, tail=False):
+        # function/class/module body: a 'begin' body runs in the given env
+        # without opening a new block scope (see Eva._eval_body)
+        if isinstance(body, list) and body and body[0] == "begin":
+            return self._compile_sequence(body[1:], tail)
+        if tail:
+            return self.compileTail(body)
+        return self.compile(body)
+
+    def compileTail(self, exp):
+        # exp is in tail position of a function body
+        if isinstance(exp, list) and exp:
+            head = exp[0]
+            if head in ("if", "begin", "switch"):
+                return self._special_forms[head](exp, tail=True)
+            if not (isinstance(head, str) and head in self._special_forms):
+                return self._compile_call(exp, tail=True)
+        return self.compile(exp)
+
+    def _compile_sequence(self, exps, tail=False):
+        stmts = [self.compile(i) for i in exps[:-1]]
+        if exps:
+            stmts.append(self.compileTail(exps[-1]) if tail else self.compile(exps[-1]))
+        if not stmts:
+            return lambda env: None
+        if len(stmts) == 1:
+            return stmts[0]
+        *init, last = stmts
+
+        def run(env):
+            for stmt in init:
+                stmt(env)
+            return last(env)
+
+        return run
+
+    # binary operator
+    # --------------------------
+    def _compile_add(self, exp):
+        left, right = self.compile(exp[1]), self.compile(exp[2])
+        return lambda env: left(env) + right(env)
+
+    def _compile_sub(self, exp):
+        left = self.compile(exp[1])
+        if len(exp) == 2:
+            return lambda env: -left(env)
+        right = self.compile(exp[2])
+        return lambda env: left(env) - right(env)
+
+    def _compile_mul(self, exp):
+        left, right = self.compile(exp[1]), self.compile(exp[2])
+        return lambda env: left(env) * right(env)
+
+    def _compile_gt(self, exp):
+        left, right = self.compile(exp[1]), self.compile(exp[2])
+        return lambda env: left(env) > right(env)
+
+    def _compile_lt(self, exp):
+        left, right = self.compile(exp[1]), self.compile(exp[2])
+        return lambda env: left(env) < right(env)
+
+    def _compile_eq(self, exp):
+        left, right = self.compile(exp[1]), self.compile(exp[2])
+        return lambda env: left(env) == right(env)
+
+    # inc: syntax sugar is transformed once, at compile time
+    # --------------------------
+    def _compile_inc(self, exp):
+        return self.compile(self._transformer.transformIncToSet(exp))
+
+    def _compile_dec(self, exp):
+        return self.compile(self._transformer.transformDecToSet(exp))
+
+    def _compile_inc_val(self, exp):
+        return self.compile(self._transformer.transformIncValToSet(exp))
+
+    def _compile_dec_val(self, exp):
+        return self.compile(self._transformer.transformDecValToSet(exp))
+
+    # ['var', var_name ,value]
+    # --------------------------
+    def _compile_var(self, exp):
+        _, var, value = exp
+        value = self.compile(value)
+        if self._scope.kind == "frame":
+            slot = self._scope.declare(var)
+
+            def run(env):
+                env.values[slot] = ret = value(env)
+                return ret
+
+            return run
+        return lambda env: env.define(var, value(env))
+
+    # ['set',var_name, value]
+    # ['set',['prop','self','x'],10]
+    # --------------------------
+    def _compile_set(self, exp):
+        _, ref, value = exp
+        value = self.compile(value)
+        if ref[0] == "prop":
+            _, instance, prop_name = ref
+            instance = self.compile(instance)
+            return lambda env: instance(env).define(prop_name, value(env))
+        return self._compile_assign(ref, value)
+
+    # block scope, new frame on block enter
+    # --------------------------
+    def _compile_begin(self, exp, tail=False):
+        declarations = collectDeclarations(exp[1:])
+        if not declarations:
+            # nothing to hold: run in the enclosing env, no frame allocated
+            return self._compile_sequence(exp[1:], tail)
+        scope = self._enterScope("frame", declarations)
+        try:
+            body = self._compile_sequence(exp[1:], tail)
+        finally:
+            self._leaveScope()
+        names, size = scope.names, len(scope.names)
+
+        def run(env):
+            meter = running.meter
+            if meter is not None:
+                # meter.alloc()
+                meter.room -= 1
+                if meter.room < 0:
+                    meter.overrun()
+            return body(Frame(names, [UNDEFINED] * size, env))
+
+        return run
+
+    # ['if', condition, stmt_then, stmt_else]
+    # --------------------------
+    def _compile_if(self, exp, tail=False):
+        _, cond, stmt1, stmt2 = exp
+        branch = self.compileTail if tail else self.compile
+        cond, stmt1, stmt2 = self.compile(cond), branch(stmt1), branch(stmt2)
+        return lambda env: stmt1(env) if cond(env) else stmt2(env)
+
+    def _compile_switch(self, exp, tail=False):
+        return self._compile_if(self._transformer.transformSwitchToIfexp(exp), tail)
+
+    # ['while', cond, body]
+    # --------------------------
+    def _compile_while(self, exp):
+        _, cond, body = exp
+        cond, body = self.compile(cond), self.compile(body)
+
+        def run(env):
+            ret = None
+            meter = running.meter
+            while cond(env):
+                if meter is not None:
+                    # meter.step()
+                    meter.left -= 1
+                    if meter.left < 0:
+                        meter.overrun()
+                ret = body(env)
+            return ret
+
+        return run
+
+    def _compile_for(self, exp):
+        return self.compile(self._transformer.transformForToWhile(exp))
+
+    def _compile_def(self, exp):
+        return self.compile(self._transformer.transformDefToVarLambda(exp))
+
+    def _compile_def_memo(self, exp):
+        return self.compile(self._transformer.transform(exp))
+
+    # ['lambda', params, body]
+    # --------------------------
+    # escape analysis: a function value is [params, code, env] and keeps
+    # env's whole chain alive, while it exists. env is the innermost frame
+    # a name of the lambda is declared in, not the frame it is evaluated in:
+    # blocks and activations past it are freed when they finish even if the
+    # function escapes. a lambda referencing no frame at all captures the
+    # dynamic env (global/class/module) only, and evaluating it again there
+    # returns the same function value: one shared object, not one per
+    # evaluation.
+    def _compile_lambda(self, exp):
+        _, params, body = exp
+        if not isinstance(params, list):
+            params = [params]
+        enclosing, hops = self._scope, 0
+        if self.escape_analysis:
+            names = referencedNames(body)
+            # an imported module's body looks names up through the env
+            while "import" not in names and enclosing.kind == "frame":
+                if not names.isdisjoint(enclosing.names):
+                    break
+                enclosing, hops = enclosing.parent, hops + 1
+        outer, self._scope = self._scope, enclosing
+        scope = self._enterScope("frame", params)
+        try:
+            for var in collectDeclarations(_bodyExps(body)):
+                scope.declare(var)
+            code = Code(body, self.compileBody(body, tail=True), scope.names, len(params))
+        finally:
+            self._scope = outer
+        if not self.escape_analysis:
+            return lambda env: [params, code, env]
+        if enclosing.kind == "frame":
+            if not hops:
+                return lambda env: [params, code, env]
+            return lambda env: [params, code, _hop(env, hops)]
+
+        def run(env):
+            env = _hop(env, hops)
+            try:
+                closures = env.closures
+            except AttributeError:
+                closures = env.closures = {}
+            fn = closures.get(code)
+            if fn is None:
+                fn = closures[code] = [params, code, env]
+            return fn
+
+        return run
+
+    # ['class', class_name, parent, body]
+    # --------------------------
+    def _compile_class(self, exp):
+        _, class_name, parent, body = exp
+        parent = self.compile(parent)
+        self._enterScope(
+            "dynamic", collectDeclarations(_bodyExps(body)), parent == "None"
+        )
+        try:
+            body = self.compileBody(body)
+        finally:
+            self._leaveScope()
+
+        def run(env):
+            parent_env = parent(env) or env
+            meter = running.meter
+            if meter is not None:
+                meter.alloc()
+            class_env = ClassEnvironment({}, parent_env)
+            body(class_env)
+            return env.define(class_name, class_env)
+
+        return run
+
+    # ['new', class_name, args]
+    # --------------------------
+    def _compile_new(self, exp):
+        _, class_name, *args = exp
+        class_ref = self._compile_lookup(class_name)
+        args = [self.compile(i) for i in args]
+
+        def run(env):
+            class_env = class_ref(env)
+            evaluated_args = [i(env) for i in args]
+            meter = running.meter
+            if meter is not None:
+                meter.alloc()
+            instance_env = Instance(class_env)
+            callFunction(class_env.lookup("constructor"), [instance_env, *evaluated_args], meter)
+            return instance_env
+
+        return run
+
+    # ['prop', instante, var_name]
+    # --------------------------
+    def _compile_prop(self, exp):
+        _, instance, var_name = exp
+        instance = self.compile(instance)
+        cache = PropCache(var_name)
+        return lambda env: cache.lookup(instance(env))
+
+    # ['super', class_name]
+    # --------------------------
+    def _compile_super(self, exp):
+        _, class_name = exp
+        class_name = self.compile(class_name)
+        return lambda env: class_name(env).parent
+
+    # ['module', module_name, body]
+    # ---------------------------
+    def _compile_module(self, exp):
+        _, module_name, body = exp
+        self._enterScope("dynamic", collectDeclarations(_bodyExps(body)))
+        try:
+            body = self.compileBody(body)
+        finally:
+            self._leaveScope()
+
+        def run(env):
+            meter = running.meter
+            if meter is not None:
+                meter.alloc()
+            module_env = Environment({}, env)
+            body(module_env)
+            return env.define(module_name, module_env)
+
+        return run
+
+    # ['import','Math']: the module is loaded when the import runs
+    # ---------------------------
+    def _compile_import(self, exp):
+        _, module_name = exp
+
+        def run(env):
+            # the registry and compiler of the interpreter running the code
+            eva = running.eva or self.eva
+            modules = eva.modules
+            module_env = modules.lookup(module_name)
+            if module_env is not None:
+                return env.define(module_name, module_env)
+            module_exp = ["module", module_name, modules.source(module_name)]
+            module_env = eva._compiler.compileProgram(module_exp, env)(env)
+            return modules.register(module_name, module_env)
+
+        return run
+
+    # ['await-all', exp...]
+    # the list of the values, one after the other (no evalAsync here)
+    # --------------------------
+    def _compile_await_all(self, exp):
+        exps = [self.compile(i) for i in exp[1:]]
+        return lambda env: [i(env) for i in exps]
+
+    # function call
+    # --------------------------
+    def _compile_call(self, exp, tail=False):
+        fn, args = self.compile(exp[0]), [self.compile(i) for i in exp[1:]]
+        if isinstance(exp[0], str) and exp[0] in self._unresolved:
+            # a global: its arity is checked before running, see compileProgram
+            self._calls.add((exp[0], len(args)))
+
+        # a builtin takes up to 3 arguments as they are evaluated, no args
+        # list. a user function gets one: a TailCall in tail position, else
+        # it is called here
+        if len(args) == 0:
+
+            def run(env):
+                func = fn(env)
+                if callable(func):
+                    return func()
+                if tail:
+                    return TailCall(func, [])
+                return callFunction(func, [], running.meter)
+
+        elif len(args) == 1:
+            (a,) = args
+
+            def run(env):
+                func = fn(env)
+                if callable(func):
+                    return func(a(env))
+                if tail:
+                    return TailCall(func, [a(env)])
+                return callFunction(func, [a(env)], running.meter)
+
+        elif len(args) == 2:
+            a, b = args
+
+            def run(env):
+                func = fn(env)
+                if callable(func):
+                    return func(a(env), b(env))
+                if tail:
+                    return TailCall(func, [a(env), b(env)])
+                return callFunction(func, [a(env), b(env)], running.meter)
+
+        elif len(args) == 3:
+            a, b, c = args
+
+            def run(env):
+                func = fn(env)
+                if callable(func):
+                    return func(a(env), b(env), c(env))
+                if tail:
+                    return TailCall(func, [a(env), b(env), c(env)])
+                return callFunction(func, [a(env), b(env), c(env)], running.meter)
+
+        else:
+
+            def run(env):
+                func = fn(env)
+                evaluated_args = [i(env) for i in args]
+                if callable(func):
+                    return func(*evaluated_args)
+                if tail:
+                    return TailCall(func, evaluated_args)
+                return callFunction(func, evaluated_args, running.meter)
+
+        return run
+
+
+def _bodyExps(body):
+    # statements of a function/class/module body
+    if isinstance(body, list) and body and body[0] == "begin":
+        return body[1:]
+    return [body]
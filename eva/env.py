@@ -15,24 +15,45 @@
 # parent (optional)
 
 
+import itertools
+
+
 class Environment:
-    def __init__(self, record={}, parent=None):
-        self.record = record
+    # no per-object __dict__: one env per block/call/instance adds up.
+    # closures: {code: function value} of the lambdas without upvalues
+    # made in this env (shared, see compiler/bytecode _compile_lambda),
+    # unset until the first one
+    __slots__ = ("record", "parent", "closures")
+
+    def __init__(self, record=None, parent=None):
+        # a new dict per env, a shared default would leak names between envs
+        self.record = {} if record is None else record
         self.parent = parent
 
+    def __getstate__(self):
+        # shared closures are made again after loading
+        state, slots = super().__getstate__()
+        slots.pop("closures", None)
+        return state, slots
+
     def define(self, var, value):
         self.record[var] = value
         return value
 
     def assign(self, var, value):
         env = self.resolve(var)
-        env.record[var] = value
-        return value
+        if env is self:
+            self.record[var] = value
+            return value
+        # the owner may be an array-backed Frame
+        return env.assign(var, value)
 
     def lookup(self, var):
         # after resolve, may be curr_env/global_env
         env = self.resolve(var)
-        return env.record[var]
+        if env is self:
+            return self.record[var]
+        return env.lookup(var)
 
     def resolve(self, var):
         #  return current_env /parant_env/NotDefined!
@@ -41,3 +62,173 @@ class Environment:
         if self.parent is None:
             raise ValueError(f"Variable '{var}' is not defined.")
         return self.parent.resolve(var)
+
+
+# class environment
+#######################
+# the env of a class body. inline caches of prop sites (inline_cache.py)
+# remember in which class env of an instance's chain a name was found;
+# defining a new name in any class env may shadow such a result, so it
+# bumps `epoch` and every cached entry of an older epoch is dropped.
+# assigning an existing name keeps the epoch, cached holders are read live.
+
+
+# next() on a count is atomic, `epoch += 1` from two threads may lose a bump
+_EPOCHS = itertools.count(1)
+
+
+class ClassEnvironment(Environment):
+    # shape: the empty shape of this class's instances
+    __slots__ = ("shape",)
+    epoch = 0
+
+    def __init__(self, record=None, parent=None):
+        super().__init__(record, parent)
+        self.shape = Shape(self)
+
+    def define(self, var, value):
+        new = var not in self.record
+        self.record[var] = value
+        # after the write: an entry cached in between is invalidated too
+        if new:
+            ClassEnvironment.epoch = next(_EPOCHS)
+        return value
+
+
+# array-backed environment (frame)
+#######################
+# used by the closure engine: the resolver knows at compile time which
+# names a scope declares, so a frame stores its values in a list and a
+# variable reference is a (depth, slot) address instead of a dict probe.
+# names {var:slot} is shared by every frame of the same static scope, and
+# keeps the Environment api (define/assign/lookup/resolve) working by name.
+
+# slot value of a declared variable whose `var` has not run yet
+UNDEFINED = object()
+
+
+class Frame:
+    __slots__ = ("names", "values", "parent")
+
+    def __init__(self, names, values, parent=None):
+        self.names = names
+        self.values = values
+        self.parent = parent
+
+    @property
+    def record(self):
+        return {
+            var: self.values[slot]
+            for var, slot in self.names.items()
+            if self.values[slot] is not UNDEFINED
+        }
+
+    def define(self, var, value):
+        slot = self.names.get(var)
+        if slot is None:
+            raise ValueError(f"Variable '{var}' has no slot in this frame.")
+        self.values[slot] = value
+        return value
+
+    def assign(self, var, value):
+        env = self.resolve(var)
+        if env is self:
+            self.values[self.names[var]] = value
+            return value
+        return env.assign(var, value)
+
+    def lookup(self, var):
+        env = self.resolve(var)
+        if env is self:
+            return self.values[self.names[var]]
+        return env.lookup(var)
+
+    def resolve(self, var):
+        slot = self.names.get(var)
+        if slot is not None and self.values[slot] is not UNDEFINED:
+            return self
+        if self.parent is None:
+            raise ValueError(f"Variable '{var}' is not defined.")
+        return self.parent.resolve(var)
+
+
+# class instance
+#######################
+# ['new', Class, ...] used to create an Environment with its own dict per
+# instance. an Instance keeps its field values in a list, and the field
+# names in a Shape (hidden class) shared by every instance that got the
+# same fields in the same order: `(set (prop self x) ..)` on a new field
+# moves the instance to the next shape, cached in `transitions`, so all
+# Points built by one constructor end up on the same shape object.
+# - names {var:slot} of a shape never change once created
+# - a shape knows the env instances fall back to (`parent` of the
+#   instance), every class has its own empty root shape
+# - the root remembers the most fields an instance of the class got, new
+#   instances allocate their value list at that size once
+
+
+class Shape:
+    __slots__ = ("names", "transitions", "parent", "root", "size")
+
+    def __init__(self, parent, names=None, root=None):
+        self.names = names or {}
+        self.transitions = {}
+        self.parent = parent
+        self.root = root or self
+        self.size = 0
+
+    def add(self, var):
+        shape = self.transitions.get(var)
+        if shape is None:
+            names = dict(self.names)
+            names[var] = len(names)
+            shape = self.transitions[var] = Shape(self.parent, names, self.root)
+            self.root.size = max(self.root.size, len(names))
+        return shape
+
+
+class Instance:
+    __slots__ = ("shape", "values")
+
+    def __init__(self, parent):
+        # parent: a class env (or any env used with `new`)
+        shape = parent.shape if type(parent) is ClassEnvironment else Shape(parent)
+        self.shape = shape
+        self.values = [None] * shape.size
+
+    @property
+    def parent(self):
+        return self.shape.parent
+
+    @property
+    def record(self):
+        return {var: self.values[slot] for var, slot in self.shape.names.items()}
+
+    def define(self, var, value):
+        slot = self.shape.names.get(var)
+        if slot is None:
+            self.shape = self.shape.add(var)
+            slot = len(self.shape.names) - 1
+            if slot == len(self.values):
+                self.values.append(value)
+                return value
+        self.values[slot] = value
+        return value
+
+    def assign(self, var, value):
+        slot = self.shape.names.get(var)
+        if slot is None:
+            return self.parent.assign(var, value)
+        self.values[slot] = value
+        return value
+
+    def lookup(self, var):
+        slot = self.shape.names.get(var)
+        if slot is None:
+            return self.parent.lookup(var)
+        return self.values[slot]
+
+    def resolve(self, var):
+        if var in self.shape.names:
+            return self
+        return self.parent.resolve(var)
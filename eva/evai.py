@@ -1,6 +1,24 @@
 import inspect
-from env import Environment
+import arrays
+import memo
+import parallel
+from env import ClassEnvironment, Environment, Instance
+from inline_cache import PropCache
+from node_cache import NodeCache
 from transformer import Transformer
+from modules import ModuleRegistry
+from optimizer import Optimizer
+from resolver import collectDeclarations
+from parallel import Parallel
+from profiler import Profiler
+from meter import Meter
+import snapshot
+import batch
+import hotreload
+import runtime
+from compiler import Code, Compiler, TailCall, callFunction
+from machine import Machine
+from vm import VM
 
 
 def isVariableName(exp):
@@ -12,134 +30,434 @@ def isVariableName(exp):
 
 class Eva:
     # create a Eva instance with global environment
-    def __init__(self, global_env=Environment()):
+    # engine: "ast"     walk the list AST on every evaluation
+    #         "closure" compile the AST into python closures once, then run
+    #         "stack"   walk the AST on an explicit continuation stack, deep
+    #                   recursion is not limited by the python stack
+    #         "vm"      compile the AST to bytecode, run it on a stack VM
+    # opt_level: optimizer level of programs passed to eval/evalGlobal, see
+    #            optimizer.py (0: run as written)
+    # profile: profile every evaluation into self.profiler ("ast" engine),
+    #          see profiler.py and Eva.profile
+    # workers: worker processes of evalParallel and pmap (parallel.py),
+    #          None: one per core, 0: run everything in this process
+    # limits: {"steps", "memory", "timeout"} to meter every evaluation
+    #         against, see meter.py and Eva.limit
+    def __init__(
+        self,
+        global_env=None,
+        engine="ast",
+        opt_level=0,
+        profile=False,
+        workers=None,
+        limits=None,
+    ):
+        # a new global env per interpreter by default, see pool.py to share
+        # a prepared one
+        if global_env is None:
+            global_env = Environment()
         self.global_env = global_env
+        self.engine = engine
         self._transformer = Transformer()
+        # loaded modules of this interpreter, see modules.py
+        self.modules = ModuleRegistry()
+        # prop site inline caches: prop node -> PropCache, see node_cache.py
+        self._prop_caches = NodeCache()
+        # begin node -> does it declare a name, see _declares
+        self._block_declarations = NodeCache()
+        self._compiler = Compiler(self)
+        self._machine = Machine(self)
+        self._vm = VM(self)
+        if engine == "closure":
+            self.eval = self._evalCompiled
+            self.evalGlobal = self._evalGlobalCompiled
+        elif engine == "stack":
+            self.eval = self._evalStack
+            self.evalGlobal = self._evalGlobalStack
+        elif engine == "vm":
+            self.eval = self._evalVM
+            self.evalGlobal = self._evalGlobalVM
+        elif engine != "ast":
+            raise ValueError(f"Unknown engine '{engine}'.")
+        self.optimizer = Optimizer(opt_level)
+        if opt_level > 0:
+            self._engineEval, self._engineEvalGlobal = self.eval, self.evalGlobal
+            self.eval = self._evalOptimized
+            self.evalGlobal = self._evalGlobalOptimized
+        self.parallel = Parallel(self, workers)
+        # array (arrays.py), memo (memo.py) and pmap (parallel.py) builtins,
+        # names the global env defines win
+        self.builtins = {
+            **arrays.builtins(self.apply),
+            **memo.builtins(self.apply),
+            **parallel.builtins(self.parallel),
+        }
+        for name, fn in self.builtins.items():
+            if name not in global_env.record:
+                global_env.define(name, fn)
+        # special form dispatch table: exp[0] -> handler(exp, env)
+        # one dict probe per node instead of a linear chain of comparisons
+        self._special_forms = {
+            "+": self._eval_add,
+            "-": self._eval_sub,
+            "*": self._eval_mul,
+            ">": self._eval_gt,
+            "<": self._eval_lt,
+            "=": self._eval_eq,
+            "++": self._eval_inc,
+            "--": self._eval_dec,
+            "+=": self._eval_inc_val,
+            "-=": self._eval_dec_val,
+            "var": self._eval_var,
+            "set": self._eval_set,
+            "begin": self._eval_begin,
+            "if": self._eval_if,
+            "switch": self._eval_switch,
+            "while": self._eval_while,
+            "for": self._eval_for,
+            "def": self._eval_def,
+            "def-memo": self._eval_def,
+            "lambda": self._eval_lambda,
+            "class": self._eval_class,
+            "new": self._eval_new,
+            "prop": self._eval_prop,
+            "super": self._eval_super,
+            "module": self._eval_module,
+            "import": self._eval_import,
+            "await-all": self._eval_await_all,
+        }
+        self.profiler = Profiler().start(self) if profile else None
+        # the running Meter, None: unmetered
+        self.meter = None
+        if limits:
+            self.limit(**limits)
 
     def evalGlobal(self, *exp):
         return self._eval_block(["begin", *exp], self.global_env)
 
+    # async evaluation
+    # --------------------------
+    # builtins may be coroutine functions: the evaluation suspends at their
+    # calls and other evaluations run meanwhile, see machine.py. runs on the
+    # explicit-stack machine, which shares the function values and envs of
+    # the "ast" and "stack" engines
+    async def evalAsync(self, exp, env=None):
+        if self.engine not in ("ast", "stack"):
+            raise ValueError(f"evalAsync needs the 'ast' or 'stack' engine, not '{self.engine}'.")
+        if env is None:
+            env = self.global_env
+        return await self._machine.evalAsync(self.optimize(exp, env), env)
+
+    # snapshot
+    # --------------------------
+    # write the globals (and loaded modules) to a file, restore them into
+    # another interpreter of the same engine, see snapshot.py
+    def snapshot(self, path):
+        snapshot.save(self, path)
+
+    def restore(self, path):
+        return snapshot.load(self, path)
+
+    # hot reload
+    # --------------------------
+    # patch the envs of loaded modules whose file changed, evaluating the
+    # changed definitions and what reads them again, see hotreload.py.
+    # {module name: names evaluated again or removed}
+    def pollModules(self):
+        return hotreload.pollModules(self)
+
+    # evalGlobal, independent pure forms run in worker processes
+    def evalParallel(self, *exp):
+        return self.parallel.evalGlobal(*exp)
+
+    # batch evaluation
+    # --------------------------
+    # exp evaluated once per row, a dict binding variables, compiled once
+    # (see batch.py). lazy generator of the results, or filled into out
+    # (out[i] = result of row i) and out returned. parallel: chunks of
+    # `chunk` rows run in the worker processes of evalParallel
+    def evalBatch(self, exp, rows, out=None, parallel=False, chunk=1000):
+        results = batch.evalBatch(self, exp, rows, parallel, chunk)
+        if out is None:
+            return results
+        for i, value in enumerate(results):
+            out[i] = value
+        return out
+
+    # optimizer
+    # --------------------------
+    def optimize(self, exp, env=None, cache=True):
+        return self.optimizer.optimize(exp, env or self.global_env, cache)
+
+    # the program is optimized once as a whole, then run by the engine
+    # (the ast engine evaluates nested nodes with _eval, not eval)
+    def _evalOptimized(self, exp, env=None):
+        return self._engineEval(self.optimize(exp, env), env)
+
+    def _evalGlobalOptimized(self, *exp):
+        body = self.optimize(["begin", *exp], cache=False)
+        return self._engineEvalGlobal(*body[1:])
+
+    # profiler
+    # --------------------------
+    # with eva.profile() as profiler:
+    #     eva.eval(...)
+    # print(profiler.report())
+    def profile(self):
+        return Profiler().start(self)
+
+    # resource limits
+    # --------------------------
+    # with eva.limit(steps=10**6, timeout=1.0):
+    #     eva.eval(...)     # raises meter.ResourceExceeded past a limit
+    def limit(self, steps=None, memory=None, timeout=None):
+        if self.meter is not None:
+            self.meter.stop()
+        return Meter(steps, memory, timeout).start(self)
+
+    # call a function value of this engine (or a builtin) from python
+    def apply(self, fn, args):
+        if callable(fn):
+            return fn(*args)
+        if self.engine == "closure":
+            return runtime.call(self, callFunction, fn, args, self.meter)
+        if self.engine == "vm":
+            return self._vm.call(fn, args)
+        if type(fn[1]) is Code:
+            # compiled by evalBatch for the "ast"/"stack" engine
+            return runtime.call(self, callFunction, fn, args, self.meter)
+        if self.engine == "stack":
+            return self._machine.apply(fn, args)
+        return self._callUserDefinedFunction(fn, args)
+
+    # number of syntax sugar transformations performed so far
+    @property
+    def transformations(self):
+        return self._transformer.transformations
+
+    # closure engine
+    # --------------------------
+    # exp is compiled against env (global env by default): names it can't
+    # resolve there or in its own scopes are reported before it runs
+    # (the vm engine compiles to bytecode instead)
+    def compile(self, exp, env=None):
+        if env is None:
+            env = self.global_env
+        if self.engine == "vm":
+            return self._vm.compile(exp)
+        return self._compiler.compileProgram(exp, env)
+
+    def run(self, compiled, env=None):
+        if env is None:
+            env = self.global_env
+        if self.engine == "vm":
+            return self._vm.execute(compiled, env)
+        return runtime.call(self, compiled, env)
+
+    def _evalCompiled(self, exp, env=None):
+        if env is None:
+            env = self.global_env
+        return self.run(self.compile(exp, env), env)
+
+    def _evalGlobalCompiled(self, *exp):
+        return self.run(
+            self._compiler.compileProgram(["begin", *exp], self.global_env, body=True)
+        )
+
+    # explicit-stack engine
+    # --------------------------
+    def _evalStack(self, exp, env=None):
+        if env is None:
+            env = self.global_env
+        return self._machine.eval(exp, env)
+
+    def _evalGlobalStack(self, *exp):
+        return self._machine.evalBody(["begin", *exp], self.global_env)
+
+    # bytecode vm engine
+    # --------------------------
+    def _evalVM(self, exp, env=None):
+        if env is None:
+            env = self.global_env
+        return self._vm.eval(exp, env)
+
+    def _evalGlobalVM(self, *exp):
+        return self._vm.evalBody(["begin", *exp], self.global_env)
+
+    # "ast" engine
+    # --------------------------
+    # the other engines (and opt_level > 0) replace eval, see __init__.
+    # nodes evaluate their children with _eval, the engine itself
     def eval(self, exp, env=None):
+        return self._eval(exp, env)
+
+    def _eval(self, exp, env=None):
         if env is None:
             env = self.global_env
         # self-evaluating
         # -----------------------
         if isinstance(exp, (int, float)):
             return exp
-        if isinstance(exp, str) and exp[0] == '"' and exp[-1] == '"':
-            return exp[1:-1]
-
-        # var lookup/access
-        if isVariableName(exp):
-            return env.lookup(exp)
+        if isinstance(exp, str):
+            if exp[0] == '"' and exp[-1] == '"':
+                return exp[1:-1]
+            # var lookup/access
+            if exp[0].isalpha():
+                return env.lookup(exp)
 
-        # binary operator
-        # --------------------------
-        if exp[0] == "+":
-            return self.eval(exp[1], env) + self.eval(exp[2], env)
-        if exp[0] == "-":
-            if len(exp) == 2:
-                return -self.eval(exp[1], env)
-            return self.eval(exp[1], env) - self.eval(exp[2], env)
-        if exp[0] == "*":
-            return self.eval(exp[1], env) * self.eval(exp[2], env)
-        if exp[0] == ">":
-            return self.eval(exp[1], env) > self.eval(exp[2], env)
-        if exp[0] == "<":
-            return self.eval(exp[1], env) < self.eval(exp[2], env)
-        if exp[0] == "=":
-            return self.eval(exp[1], env) == self.eval(exp[2], env)
-
-        # inc
-        # --------------------------
-        if exp[0] == "++":
-            set_exp = self._transformer.transformIncToSet(exp)
-            return self.eval(set_exp, env)
-        if exp[0] == "--":
-            set_exp = self._transformer.transformDecToSet(exp)
-            return self.eval(set_exp, env)
-        if exp[0] == "+=":
-            set_exp = self._transformer.transformIncValToSet(exp)
-            return self.eval(set_exp, env)
-        if exp[0] == "-=":
-            set_exp = self._transformer.transformDecValToSet(exp)
-            return self.eval(set_exp, env)
-
-        # var declare: should eval value at define
-        # ['var', var_name ,value]
+        # special forms
         # --------------------------
-        if exp[0] == "var":
-            _, var, value = exp
-            return env.define(var, self.eval(value, env))
-
-        # var update/assign
-        # ['set',var_name, value]
-        # ['set',['prop','self','x'],10]
-        if exp[0] == "set":
-            _, ref, value = exp
-            if ref[0] == "prop":
-                _, instance, prop_name = ref
-                # instance_env = env.lookup(instance) maybe instance is ['super','classname']
-                instance_env = self.eval(instance, env)
-                return instance_env.define(prop_name, self.eval(value, env))
-
-            return env.assign(ref, self.eval(value, env))
-
-        # block: group of exprs (stmt_seq)
-        # block scope, new env on block enter
-        # --------------------------
-        if exp[0] == "begin":
-            block_env = Environment({}, env)
-            return self._eval_block(exp, block_env)
+        if isinstance(exp, list):
+            head = exp[0]
+            if isinstance(head, str):
+                handler = self._special_forms.get(head)
+                if handler is not None:
+                    return handler(exp, env)
+            return self._eval_call(exp, env)
 
-        # if
-        # ['if', condition, stmt_then, stmt_else]
-        # --------------------------
-        if exp[0] == "if":
-            _, cond, stmt1, stmt2 = exp
-            if self.eval(cond, env):
-                return self.eval(stmt1, env)
-            return self.eval(stmt2, env)
-
-        # switch
-        # ['switch',[cond1, block1], [cond2, block2], ..., ['else', block]]
-        # ---------------------------
-        if exp[0] == "switch":
-            if_exp = self._transformer.transformSwitchToIfexp(exp)
-            return self.eval(if_exp, env)
-
-        # while
-        # ['while', cond, body]
-        # --------------------------
-        if exp[0] == "while":
-            _, cond, body = exp
-            ret = None
-            while self.eval(cond, env):
-                ret = self.eval(body, env)
-            return ret
-
-        # for
-        # ['for', init, end_cond, update, body]
-        # ---------------------------
-        if exp[0] == "for":
-            while_exp = self._transformer.transformForToWhile(exp)
-            return self.eval(while_exp, env)
-        # def
-        # ['def',fname, params, body]
-        # --------------------------
-        # if exp[0] == "def":
-        #     _, fname, params, body = exp
-        #     func = [params, body, env]
-        #     return env.define(fname, func)
-        # syntax sugar:
-
-        if exp[0] == "def":
-            # JIT transpile to var decalration
-            var_expr = self._transformer.transformDefToVarLambda(exp)
-            return self.eval(var_expr, env)
-        # lambda
-        # ['lambda', params, body]
-        # --------------------------
+        print(f"not inplemented {exp}")
+
+    # binary operator
+    # --------------------------
+    def _eval_add(self, exp, env):
+        return self._eval(exp[1], env) + self._eval(exp[2], env)
+
+    def _eval_sub(self, exp, env):
+        if len(exp) == 2:
+            return -self._eval(exp[1], env)
+        return self._eval(exp[1], env) - self._eval(exp[2], env)
+
+    def _eval_mul(self, exp, env):
+        return self._eval(exp[1], env) * self._eval(exp[2], env)
+
+    def _eval_gt(self, exp, env):
+        return self._eval(exp[1], env) > self._eval(exp[2], env)
+
+    def _eval_lt(self, exp, env):
+        return self._eval(exp[1], env) < self._eval(exp[2], env)
+
+    def _eval_eq(self, exp, env):
+        return self._eval(exp[1], env) == self._eval(exp[2], env)
+
+    # inc
+    # --------------------------
+    def _eval_inc(self, exp, env):
+        set_exp = self._transformer.transform(exp)
+        return self._eval(set_exp, env)
+
+    def _eval_dec(self, exp, env):
+        set_exp = self._transformer.transform(exp)
+        return self._eval(set_exp, env)
+
+    def _eval_inc_val(self, exp, env):
+        set_exp = self._transformer.transform(exp)
+        return self._eval(set_exp, env)
+
+    def _eval_dec_val(self, exp, env):
+        set_exp = self._transformer.transform(exp)
+        return self._eval(set_exp, env)
+
+    # var declare: should eval value at define
+    # ['var', var_name ,value]
+    # --------------------------
+    def _eval_var(self, exp, env):
+        _, var, value = exp
+        return env.define(var, self._eval(value, env))
+
+    # var update/assign
+    # ['set',var_name, value]
+    # ['set',['prop','self','x'],10]
+    # --------------------------
+    def _eval_set(self, exp, env):
+        _, ref, value = exp
+        if ref[0] == "prop":
+            _, instance, prop_name = ref
+            # instance_env = env.lookup(instance) maybe instance is ['super','classname']
+            instance_env = self._eval(instance, env)
+            return instance_env.define(prop_name, self._eval(value, env))
+
+        return env.assign(ref, self._eval(value, env))
+
+    # block: group of exprs (stmt_seq)
+    # block scope, new env on block enter
+    # --------------------------
+    def _eval_begin(self, exp, env):
+        if not self._declares(exp):
+            # nothing to hold: run in the enclosing env, no env allocated
+            return self._eval_block(exp, env)
+        meter = self.meter
+        if meter is not None:
+            # meter.alloc(), one method call less per block
+            meter.room -= 1
+            if meter.room < 0:
+                meter.overrun()
+        block_env = Environment({}, env)
+        return self._eval_block(exp, block_env)
+
+    def _declares(self, block):
+        # does the block declare a name (var, def, class, ...), per node
+        declares = self._block_declarations.get(block)
+        if declares is None:
+            declares = bool(collectDeclarations(block[1:]))
+            self._block_declarations.put(block, declares)
+        return declares
+
+    # if
+    # ['if', condition, stmt_then, stmt_else]
+    # --------------------------
+    def _eval_if(self, exp, env):
+        _, cond, stmt1, stmt2 = exp
+        if self._eval(cond, env):
+            return self._eval(stmt1, env)
+        return self._eval(stmt2, env)
+
+    # switch
+    # ['switch',[cond1, block1], [cond2, block2], ..., ['else', block]]
+    # ---------------------------
+    def _eval_switch(self, exp, env):
+        if_exp = self._transformer.transform(exp)
+        return self._eval(if_exp, env)
+
+    # while
+    # ['while', cond, body]
+    # --------------------------
+    def _eval_while(self, exp, env):
+        _, cond, body = exp
+        ret = None
+        meter = self.meter
+        while self._eval(cond, env):
+            if meter is not None:
+                # meter.step()
+                meter.left -= 1
+                if meter.left < 0:
+                    meter.overrun()
+            ret = self._eval(body, env)
+        return ret
+
+    # for
+    # ['for', init, end_cond, update, body]
+    # ---------------------------
+    def _eval_for(self, exp, env):
+        while_exp = self._transformer.transform(exp)
+        return self._eval(while_exp, env)
+
+    # def
+    # ['def',fname, params, body]
+    # --------------------------
+    # def _eval_def(self, exp, env):
+    #     _, fname, params, body = exp
+    #     func = [params, body, env]
+    #     return env.define(fname, func)
+    # syntax sugar:
+    def _eval_def(self, exp, env):
+        # JIT transpile to var decalration (once per node, see Transformer.transform)
+        var_expr = self._transformer.transform(exp)
+        return self._eval(var_expr, env)
+
+    # lambda
+    # ['lambda', params, body]
+    # --------------------------
+    def _eval_lambda(self, exp, env):
         """
         define function, param can be single, of multi params with list
         def func x [*,x,x]
@@ -151,101 +469,186 @@ class Eva:
         func 2 3
         call we will get args[ i for i in exp[1:]]
         """
-        if exp[0] == "lambda":
-            _, params, body = exp
-            if not isinstance(params, list):
-                params = [params]
-            func = [params, body, env]
-            return func
-
-        # class
-        # ['class', class_name, parent, body]
-        # --------------------------
-        if exp[0] == "class":
-            _, class_name, parent, body = exp
-            parent_env = self.eval(parent, env)
-            parent_env = parent_env or env
-            class_env = Environment({}, parent_env)
-            self._eval_body(body, class_env)
-            return env.define(class_name, class_env)
-
-        # class instance
-        # ['new', class_name, args]
-        # when call constructor(self, x), the self is the instance_env
-        # ============================
-        if exp[0] == "new":
-            _, class_name, *args = exp
-            class_env = env.lookup(class_name)
-            # class_env = self.eval(class_name, env)
-            evaluated_args = [self.eval(i, env) for i in args]
-            instance_env = Environment({}, class_env)
-            self._callUserDefinedFunction(
-                class_env.lookup("constructor"), [instance_env, *evaluated_args]
-            )
-            return instance_env
-
-        # class prop access
-        # ['prop', instante, var_name]
-        if exp[0] == "prop":
-            _, instance, var_name = exp
-            instance_env = self.eval(instance, env)
-            return instance_env.lookup(var_name)
-
-        # super instance
-        # ['prop',['super',Point3D],'constructor']
-        # --------------------------
-        if exp[0] == "super":
-            _, class_name = exp
-            return self.eval(class_name, env).parent
-
-        # module
-        # ['module', module_name, body]
-        # ---------------------------
-        if exp[0] == "module":
-            _, module_name, body = exp
-            module_env = Environment({}, env)
-            self._eval_body(body, module_env)
+        _, params, body = exp
+        if not isinstance(params, list):
+            params = [params]
+        func = [params, body, env]
+        return func
+
+    # class
+    # ['class', class_name, parent, body]
+    # --------------------------
+    def _eval_class(self, exp, env):
+        _, class_name, parent, body = exp
+        parent_env = self._eval(parent, env)
+        parent_env = parent_env or env
+        if self.meter is not None:
+            self.meter.alloc()
+        class_env = ClassEnvironment({}, parent_env)
+        self._eval_body(body, class_env)
+        return env.define(class_name, class_env)
+
+    # class instance
+    # ['new', class_name, args]
+    # when call constructor(self, x), the self is the instance_env
+    # ============================
+    def _eval_new(self, exp, env):
+        _, class_name, *args = exp
+        class_env = env.lookup(class_name)
+        # class_env = self._eval(class_name, env)
+        evaluated_args = [self._eval(i, env) for i in args]
+        if self.meter is not None:
+            self.meter.alloc()
+        instance_env = Instance(class_env)
+        self._callUserDefinedFunction(
+            class_env.lookup("constructor"), [instance_env, *evaluated_args]
+        )
+        return instance_env
+
+    # class prop access
+    # ['prop', instante, var_name]
+    # the lookup goes through the inline cache of this prop node
+    # --------------------------
+    def _eval_prop(self, exp, env):
+        instance_env = self._eval(exp[1], env)
+        return self._propCache(exp).lookup(instance_env)
+
+    def _propCache(self, exp):
+        cache = self._prop_caches.get(exp)
+        if cache is None:
+            cache = self._prop_caches.put(exp, PropCache(exp[2]))
+        return cache
+
+    # super instance
+    # ['prop',['super',Point3D],'constructor']
+    # --------------------------
+    def _eval_super(self, exp, env):
+        _, class_name = exp
+        return self._eval(class_name, env).parent
+
+    # module
+    # ['module', module_name, body]
+    # ---------------------------
+    def _eval_module(self, exp, env):
+        _, module_name, body = exp
+        if self.meter is not None:
+            self.meter.alloc()
+        module_env = Environment({}, env)
+        self._eval_body(body, module_env)
+        return env.define(module_name, module_env)
+
+    # import
+    # ['import','Math']
+    # an already loaded (and unchanged) module is not evaluated again
+    # ---------------------------
+    def _eval_import(self, exp, env):
+        _, module_name = exp
+        module_env = self.modules.lookup(module_name)
+        if module_env is not None:
             return env.define(module_name, module_env)
+        body = self.modules.source(module_name)
+        module_exp = ["module", module_name, body]
+        return self.modules.register(module_name, self._eval(module_exp, env))
 
-        # import
-        # ['import','Math']
-        if exp[0] == "import":
-            _, module_name = exp
-            with open(f"./import/{module_name}", "r") as file:
-                body_str = file.read().replace("\n", "")
-                body = eval("['begin'," + body_str + "]")
-                module_exp = ["module", module_name, body]
-                return self.eval(module_exp, env)
-
-        # function call
-        # --------------------------
-        if isinstance(exp, list):
-            fn = self.eval(exp[0], env)
-            args = [self.eval(i, env) for i in exp[1:]]
-            # built-in func
-            if callable(fn):
-                fn(*args)
-                return
-            # user defined func
-            return self._callUserDefinedFunction(fn, args)
+    # ['await-all', exp...]
+    # concurrent under evalAsync, here one after the other
+    # --------------------------
+    def _eval_await_all(self, exp, env):
+        return [self._eval(i, env) for i in exp[1:]]
 
-        print(f"not inplemented {exp}")
+    # function call
+    # --------------------------
+    def _eval_call(self, exp, env):
+        fn = self._eval(exp[0], env)
+        # built-in func
+        if callable(fn):
+            return self._callHost(fn, exp, env)
+        # user defined func
+        args = [self._eval(i, env) for i in exp[1:]]
+        return self._callUserDefinedFunction(fn, args)
+
+    def _callHost(self, fn, exp, env):
+        # up to 3 arguments are passed as they are evaluated, no args list
+        n = len(exp)
+        if n == 2:
+            return fn(self._eval(exp[1], env))
+        if n == 3:
+            return fn(self._eval(exp[1], env), self._eval(exp[2], env))
+        if n == 4:
+            return fn(self._eval(exp[1], env), self._eval(exp[2], env), self._eval(exp[3], env))
+        return fn(*[self._eval(i, env) for i in exp[1:]])
 
     def _eval_block(self, exp, env):
         ret = None
         for i in exp[1:]:
-            ret = self.eval(i, env)
+            ret = self._eval(i, env)
         return ret
 
     def _eval_body(self, body, env):
         if body[0] == "begin":
             return self._eval_block(body, env)
-        return self.eval(body, env)
+        return self._eval(body, env)
+
+    # proper tail calls
+    # --------------------------
+    # a call in tail position of a function body (through if/begin/switch)
+    # is not made, it is returned as a TailCall and the loop in
+    # _callUserDefinedFunction runs it in place of the current activation,
+    # so tail recursion does not grow the python stack.
+    def _eval_tail(self, exp, env):
+        while isinstance(exp, list):
+            head = exp[0]
+            if head == "if":
+                _, cond, stmt1, stmt2 = exp
+                exp = stmt1 if self._eval(cond, env) else stmt2
+            elif head == "begin":
+                if self._declares(exp):
+                    meter = self.meter
+                    if meter is not None:
+                        # meter.alloc()
+                        meter.room -= 1
+                        if meter.room < 0:
+                            meter.overrun()
+                    env = Environment({}, env)
+                for i in exp[1:-1]:
+                    self._eval(i, env)
+                exp = exp[-1] if len(exp) > 1 else None
+            elif head == "switch":
+                exp = self._transformer.transform(exp)
+            elif isinstance(head, str) and head in self._special_forms:
+                break
+            else:
+                fn = self._eval(head, env)
+                if callable(fn):
+                    return self._callHost(fn, exp, env)
+                return TailCall(fn, [self._eval(i, env) for i in exp[1:]])
+        if exp is None:
+            return None
+        return self._eval(exp, env)
 
     def _callUserDefinedFunction(self, fn, args):
+        while True:
+            ret = self._activate(fn, args)
+            if type(ret) is not TailCall:
+                return ret
+            fn, args = ret.fn, ret.args
+
+    def _activate(self, fn, args):
+        # one activation of fn, returns a TailCall for a call in tail position
         params, body, fn_env = fn
+        meter = self.meter
+        if meter is not None:
+            # meter.call()
+            meter.left -= 1
+            meter.room -= 1
+            if meter.left < 0 or meter.room < 0:
+                meter.overrun()
         activation_record = {}
         for idx, param in enumerate(params):
             activation_record[param] = args[idx]
         activation_env = Environment(activation_record, fn_env)  # static scope
-        return self._eval_body(body, activation_env)
+        if body[0] == "begin":
+            for i in body[1:-1]:
+                self._eval(i, activation_env)
+            body = body[-1] if len(body) > 1 else None
+        return self._eval_tail(body, activation_env)
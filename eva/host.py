@@ -0,0 +1,101 @@
+# Host functions
+###############################
+# python callables Eva programs call like functions (builtins). what is
+# known about one is registered here:
+# - arity: the number of arguments it takes, None: varies
+# - pure:  no side effects, the result depends on the arguments only
+#
+# calls use it:
+# - optimizer.py (level 2) folds a call of a pure one with constant
+#   arguments at compile time:  (sqrt 16)  ->  4.0
+# - the closure compiler reports a call with the wrong number of
+#   arguments when it compiles the program
+# - parallel.py runs forms calling only pure ones in worker processes
+#
+# functions written in python carry their entry (the `declare` decorator),
+# builtins of the interpreter (operator.add, math.sqrt, ...) are kept in
+# a dict.
+
+import builtins
+import math
+import operator
+
+
+class HostFunction:
+    __slots__ = ("name", "arity", "pure")
+
+    def __init__(self, name, arity=None, pure=False):
+        self.name = name
+        self.arity = arity
+        self.pure = pure
+
+
+# python builtin -> HostFunction, they take no attributes
+_BUILTINS = {}
+
+
+def register(fn, arity=None, pure=False, name=None):
+    entry = HostFunction(name or getattr(fn, "__name__", repr(fn)), arity, pure)
+    try:
+        fn.__eva_host__ = entry
+    except (AttributeError, TypeError):
+        _BUILTINS[fn] = entry
+    return fn
+
+
+def declare(arity=None, pure=False):
+    # @declare(arity=1, pure=True)
+    # def double(x): ...
+    def decorate(fn):
+        return register(fn, arity, pure)
+
+    return decorate
+
+
+def describe(fn):
+    # the HostFunction of fn, None when it is not registered
+    entry = getattr(fn, "__eva_host__", None)
+    if entry is not None:
+        return entry
+    try:
+        return _BUILTINS.get(fn)
+    except TypeError:
+        # unhashable callable
+        return None
+
+
+def isPure(fn, nargs=None):
+    # fn is registered pure (and takes nargs arguments)
+    entry = describe(fn)
+    if entry is None or not entry.pure:
+        return False
+    return nargs is None or entry.arity is None or entry.arity == nargs
+
+
+# the interpreter's own
+# --------------------------
+for _fn in (operator.neg, operator.pos, operator.not_, operator.abs, operator.inv):
+    register(_fn, 1, True)
+for _fn in (
+    operator.add, operator.sub, operator.mul, operator.truediv, operator.floordiv,
+    operator.mod, operator.pow, operator.lt, operator.le, operator.gt, operator.ge,
+    operator.eq, operator.ne, operator.and_, operator.or_, operator.xor,
+    operator.lshift, operator.rshift, math.atan2, math.copysign, math.fmod,
+    math.isclose, math.comb,
+):
+    register(_fn, 2, True)
+for _fn in (
+    math.sqrt, math.exp, math.sin, math.cos, math.tan, math.asin, math.acos,
+    math.atan, math.floor, math.ceil, math.trunc, math.fabs, math.factorial,
+    math.log2, math.log10, math.isnan, math.isinf, math.isfinite, math.degrees,
+    math.radians,
+):
+    register(_fn, 1, True)
+for _fn in (math.log, math.hypot, math.gcd, math.perm):
+    register(_fn, None, True)
+for _fn in (builtins.abs, builtins.float, builtins.bool):
+    register(_fn, 1, True)
+for _fn in (builtins.int, builtins.min, builtins.max, builtins.round):
+    register(_fn, None, True)
+register(builtins.print, None, False)
+del _fn
@@ -0,0 +1,131 @@
+# Hot reload
+###############################
+# a loaded module whose file changed is evaluated again on its next
+# import, from scratch, into a new module env. eva.pollModules() instead
+# patches the envs of the changed modules in place, evaluating only what
+# the edit affects:
+#
+#   while serving:
+#       eva.pollModules()       # {"Math": ["square", "TABLE"]}, no watcher:
+#                               # stats the loaded modules' files
+#
+# the top-level forms of the new body are matched with the loaded one by
+# the name they define (var, def, def-memo, class, module, import). in the
+# module env, in file order, are evaluated
+# - the definitions whose form changed, and new ones
+# - the forms reading a name evaluated before them, transitively: also in
+#   the other loaded modules, reading it as (prop Module name)
+# - other forms (expressions) not in the loaded body
+# a name the new body doesn't define any more is removed from the env.
+#
+# reads are the names a form reads when it is evaluated: a function body
+# reads when it is called, in the env patched by then, so a def depends on
+# nothing. except for def-memo (its cache) and at opt_level 2, which may
+# inline a global's value into a function body.
+#
+# the module env stays the same object: importers and functions holding
+# it see the new values. instances keep their class, values computed
+# from the module by the main program are not evaluated again.
+
+from collections import deque
+
+_DEFINING_FORMS = {"var", "def", "def-memo", "class", "module", "import"}
+_MISSING = object()
+
+
+def pollModules(eva):
+    # {module name: names evaluated again or removed} of the modules reloaded
+    registry = eva.modules
+    lazy = eva.optimizer.level < 2
+    loaded = registry.loaded()
+    reloaded = {}
+    # (module name, names evaluated again), their readers are next
+    pending = deque()
+    for name, module_env in registry.changed():
+        old = registry.loadedBody(name)
+        new = registry.reload(name)
+        evaluated = _reevaluate(eva, module_env, _forms(old), _forms(new), set(), lazy)
+        registry.register(name, module_env)
+        registry.stats["reloads"] += 1
+        reloaded[name] = evaluated
+        pending.append((name, evaluated))
+    # (module, member) pairs whose readers were evaluated again
+    seen = set()
+    while pending:
+        module, members = pending.popleft()
+        dirty = {(module, member) for member in members} - seen
+        seen |= dirty
+        if not dirty:
+            continue
+        for name, module_env in loaded.items():
+            body = registry.loadedBody(name)
+            if name == module or body is None:
+                continue
+            forms = _forms(body)
+            evaluated = _reevaluate(eva, module_env, forms, forms, set(dirty), lazy)
+            if evaluated:
+                reloaded.setdefault(name, []).extend(evaluated)
+                pending.append((name, evaluated))
+    return reloaded
+
+
+def _reevaluate(eva, module_env, old, new, dirty, lazy):
+    # evaluate the forms of new that changed from old or read a dirty name
+    defined = {}
+    expressions = []
+    for form in old:
+        name = _definedName(form)
+        if name is None:
+            expressions.append(form)
+        else:
+            defined[name] = form
+    evaluated = []
+    for form in new:
+        name = _definedName(form)
+        if name is None:
+            changed = form not in expressions
+        else:
+            changed = defined.pop(name, _MISSING) != form
+        if changed or not dirty.isdisjoint(reads(form, lazy)):
+            eva.eval(form, module_env)
+            if name is not None:
+                dirty.add(name)
+                evaluated.append(name)
+    for name in defined:
+        # no longer defined
+        if module_env.record.pop(name, _MISSING) is not _MISSING:
+            evaluated.append(name)
+    return evaluated
+
+
+def _forms(body):
+    if body is None:
+        return []
+    return body[1:] if isinstance(body, list) and body and body[0] == "begin" else [body]
+
+
+def _definedName(form):
+    if isinstance(form, list) and len(form) > 1 and form[0] in _DEFINING_FORMS:
+        if isinstance(form[1], str):
+            return form[1]
+    return None
+
+
+def reads(exp, lazy=True, names=None):
+    # names (and (module, member) pairs) evaluating exp reads.
+    # lazy: not the ones in function bodies
+    if names is None:
+        names = set()
+    if isinstance(exp, str):
+        if exp and exp[0].isalpha():
+            names.add(exp)
+    elif isinstance(exp, list) and exp:
+        head = exp[0]
+        if head == "prop":
+            if len(exp) > 2 and isinstance(exp[1], str) and isinstance(exp[2], str):
+                names.add((exp[1], exp[2]))
+            reads(exp[1], lazy, names)
+        elif not (lazy and head in ("lambda", "def")):
+            for i in exp:
+                reads(i, lazy, names)
+    return names
@@ -0,0 +1,86 @@
+# Inline caches
+###############################
+# ['prop', instance, name] probes the instance fields, then walks
+# class -> parent class -> ... one dict at a time, on every access (and a
+# method call is a prop access). a PropCache belongs to one prop site and
+# remembers, per class, the class env the name was found in: the next
+# access on an instance of that class is one probe of the instance record
+# plus one of the remembered holder, whatever the inheritance depth.
+#
+# - monomorphic   the first class seen at the site, one (class, holder)
+#                 tuple: replaced in one store, a thread never reads a
+#                 class with another class's holder
+# - polymorphic   up to POLYMORPHIC_LIMIT more classes, in a dict
+# - megamorphic   past that the site stops caching and always walks
+#
+# entries are tagged with ClassEnvironment.epoch, defining a new name in
+# any class env invalidates them (see env.ClassEnvironment). a result is
+# cached only when the holder and every env walked before it are class
+# envs, lookups that fall through to a block/module/global env always walk.
+
+from env import ClassEnvironment, Instance
+
+POLYMORPHIC_LIMIT = 4
+
+
+class PropCache:
+    __slots__ = ("name", "monomorphic", "epoch", "polymorphic", "misses")
+
+    def __init__(self, name):
+        self.name = name
+        # monomorphic entry: (class env, holder record)
+        self.monomorphic = (None, None)
+        # polymorphic entries: class env -> holder record
+        self.polymorphic = {}
+        # all entries are valid for this ClassEnvironment.epoch only
+        self.epoch = -1
+        self.misses = 0
+
+    def __reduce__(self):
+        # written empty (see snapshot.py): entries are only valid for the
+        # epochs of the process that filled them
+        return PropCache, (self.name,)
+
+    def lookup(self, instance_env):
+        name = self.name
+        if type(instance_env) is Instance:
+            shape = instance_env.shape
+            slot = shape.names.get(name)
+            if slot is not None:
+                return instance_env.values[slot]
+            cls = shape.parent
+        else:
+            record = instance_env.record
+            if name in record:
+                return record[name]
+            cls = instance_env.parent
+        if self.epoch == ClassEnvironment.epoch:
+            entry = self.monomorphic
+            if cls is entry[0]:
+                return entry[1][name]
+            holder = self.polymorphic.get(cls)
+            if holder is not None:
+                return holder[name]
+        return self._miss(cls)
+
+    def _miss(self, cls):
+        self.misses += 1
+        name = self.name
+        if cls is None:
+            raise ValueError(f"Variable '{name}' is not defined.")
+        holder = cls.resolve(name)
+        env = cls
+        while type(env) is ClassEnvironment:
+            if env is holder:
+                self._store(cls, holder.record)
+                break
+            env = env.parent
+        return holder.lookup(name)
+
+    def _store(self, cls, holder_record):
+        if self.epoch != ClassEnvironment.epoch:
+            self.monomorphic = (cls, holder_record)
+            self.polymorphic.clear()
+            self.epoch = ClassEnvironment.epoch
+        elif len(self.polymorphic) < POLYMORPHIC_LIMIT:
+            self.polymorphic[cls] = holder_record
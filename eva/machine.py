@@ -0,0 +1,369 @@
+# Explicit-stack evaluator
+###############################
+# same semantics as the AST interpreter (Eva.eval), but the evaluation is
+# a loop over an explicit continuation stack instead of python recursion:
+# a node either produces a value, or pushes a continuation frame and
+# continues with a sub-expression. a function body is entered without
+# pushing anything, so
+# - a call in tail position reuses the caller's continuation (proper
+#   tail calls, constant stack for tail recursion)
+# - non-tail recursion grows the continuation list, so recursion depth is
+#   bounded by memory instead of sys.getrecursionlimit()
+# - the evaluation can stop between two steps and continue later from the
+#   same stack: Machine.evalAsync suspends when a builtin returns an
+#   awaitable (an `async def` builtin) and resumes with its result once it
+#   is done, so many scripts can wait on I/O on one event loop.
+#   ['await-all', exp...] evaluates the expressions concurrently
+#   (asyncio.gather), the value is the list of their values. builtins
+#   called from builtins (map, memo) run to the end without suspending.
+
+# continuation frames
+#######################
+# tuples (tag, ...), the value of the sub-expression is delivered to the
+# frame on top of the stack when it is popped.
+
+import asyncio
+import inspect
+import operator
+from env import ClassEnvironment, Environment, Instance
+
+BINARY_OPERATORS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    ">": operator.gt,
+    "<": operator.lt,
+    "=": operator.eq,
+}
+
+(
+    BINARY_RIGHT,
+    BINARY_APPLY,
+    NEG,
+    DEFINE,
+    ASSIGN,
+    SET_PROP,
+    SEQ,
+    IF,
+    WHILE_COND,
+    WHILE_BODY,
+    CLASS,
+    DEFINE_VALUE,
+    PROP,
+    SUPER,
+    CALLEE,
+    ARGS,
+    RETURN_VALUE,
+    REGISTER_MODULE,
+) = range(18)
+
+# marker: value is ready, deliver it to the top continuation
+_RETURN = object()
+
+
+class _Quote:
+    # an already evaluated value in expression position
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class _Await:
+    # stop the run, continue it with the result of awaitable
+    __slots__ = ("awaitable",)
+
+    def __init__(self, awaitable):
+        self.awaitable = awaitable
+
+
+class Machine:
+    def __init__(self, eva):
+        self.eva = eva
+        self._transformer = eva._transformer
+        self._sugar = {"++", "--", "+=", "-=", "switch", "for", "def", "def-memo"}
+        # set while evalAsync runs a step: awaitables suspend the run
+        self.suspend = False
+
+    def eval(self, exp, env):
+        return self._run(exp, env, [])
+
+    def evalBody(self, body, env):
+        stack = []
+        return self._run(self._enterBody(body, env, stack), env, stack)
+
+    def apply(self, fn, args):
+        # called by a builtin: runs to the end
+        suspend, self.suspend = self.suspend, False
+        try:
+            stack = []
+            exp, env = self._apply(fn, args, stack)
+            return self._run(exp, env, stack)
+        finally:
+            self.suspend = suspend
+
+    async def evalAsync(self, exp, env):
+        stack = []
+        value = self._step(exp, env, stack)
+        while type(value) is _Await:
+            value = self._step(_Quote(await value.awaitable), None, stack)
+        return value
+
+    def _step(self, exp, env, stack):
+        self.suspend = True
+        try:
+            return self._run(exp, env, stack)
+        finally:
+            self.suspend = False
+
+    def _enterBody(self, body, env, stack):
+        # function/class/module body: a 'begin' body runs in env itself,
+        # the last expression is evaluated without a continuation frame
+        if isinstance(body, list) and body and body[0] == "begin":
+            if len(body) == 1:
+                return _Quote(None)
+            if len(body) > 2:
+                stack.append((SEQ, body, 2, env))
+            return body[1]
+        return body
+
+    def _apply(self, fn, args, stack):
+        # return the (exp, env) to continue with
+        # built-in func
+        if callable(fn):
+            value = fn(*args)
+            if self.suspend and inspect.isawaitable(value):
+                return _Await(value), None
+            return _Quote(value), None
+        # user defined func
+        params, body, fn_env = fn
+        meter = self.eva.meter
+        if meter is not None:
+            # meter.call()
+            meter.left -= 1
+            meter.room -= 1
+            if meter.left < 0 or meter.room < 0:
+                meter.overrun()
+        activation_record = {}
+        for idx, param in enumerate(params):
+            activation_record[param] = args[idx]
+        activation_env = Environment(activation_record, fn_env)  # static scope
+        return self._enterBody(body, activation_env, stack), activation_env
+
+    def _run(self, exp, env, stack):
+        push = stack.append
+        pop = stack.pop
+        meter = self.eva.meter
+        value = None
+        while True:
+            # evaluate exp in env
+            # -----------------------
+            if exp is not _RETURN:
+                if isinstance(exp, (int, float)):
+                    value = exp
+                elif isinstance(exp, str):
+                    if exp[0] == '"' and exp[-1] == '"':
+                        value = exp[1:-1]
+                    elif exp[0].isalpha():
+                        value = env.lookup(exp)
+                    else:
+                        print(f"not inplemented {exp}")
+                        value = None
+                elif type(exp) is _Quote:
+                    value = exp.value
+                elif type(exp) is _Await:
+                    # the stack is kept, evalAsync continues it
+                    return exp
+                elif isinstance(exp, list):
+                    head = exp[0]
+                    if not isinstance(head, str):
+                        push((CALLEE, exp, env))
+                        exp = head
+                        continue
+                    op = BINARY_OPERATORS.get(head)
+                    if op is not None:
+                        if head == "-" and len(exp) == 2:
+                            push((NEG,))
+                        else:
+                            push((BINARY_RIGHT, op, exp[2], env))
+                        exp = exp[1]
+                        continue
+                    if head in self._sugar:
+                        exp = self._transformer.transform(exp)
+                        continue
+                    if head == "var":
+                        push((DEFINE, env, exp[1]))
+                        exp = exp[2]
+                        continue
+                    if head == "set":
+                        _, ref, value_exp = exp
+                        if ref[0] == "prop":
+                            push((SET_PROP, value_exp, ref[2], env))
+                            exp = ref[1]
+                        else:
+                            push((ASSIGN, env, ref))
+                            exp = value_exp
+                        continue
+                    if head == "begin":
+                        # a block declaring nothing runs in env
+                        if self.eva._declares(exp):
+                            if meter is not None:
+                                # meter.alloc()
+                                meter.room -= 1
+                                if meter.room < 0:
+                                    meter.overrun()
+                            env = Environment({}, env)
+                        exp = self._enterBody(exp, env, stack)
+                        continue
+                    if head == "if":
+                        push((IF, exp[2], exp[3], env))
+                        exp = exp[1]
+                        continue
+                    if head == "while":
+                        push((WHILE_COND, exp, env, None))
+                        exp = exp[1]
+                        continue
+                    if head == "lambda":
+                        _, params, body = exp
+                        if not isinstance(params, list):
+                            params = [params]
+                        value = [params, body, env]
+                    elif head == "class":
+                        push((CLASS, exp, env))
+                        exp = exp[2]
+                        continue
+                    elif head == "new":
+                        class_env = env.lookup(exp[1])
+                        if meter is not None:
+                            meter.alloc()
+                        instance_env = Instance(class_env)
+                        push((RETURN_VALUE, instance_env))
+                        fn = class_env.lookup("constructor")
+                        if len(exp) == 2:
+                            exp, env = self._apply(fn, [instance_env], stack)
+                        else:
+                            push((ARGS, exp, 2, env, [instance_env], fn))
+                            exp = exp[2]
+                        continue
+                    elif head == "prop":
+                        push((PROP, self.eva._propCache(exp)))
+                        exp = exp[1]
+                        continue
+                    elif head == "super":
+                        push((SUPER,))
+                        exp = exp[1]
+                        continue
+                    elif head == "module":
+                        _, module_name, body = exp
+                        if meter is not None:
+                            meter.alloc()
+                        module_env = Environment({}, env)
+                        push((DEFINE_VALUE, env, module_name, module_env))
+                        env = module_env
+                        exp = self._enterBody(body, env, stack)
+                        continue
+                    elif head == "await-all":
+                        if self.suspend:
+                            runs = (self.evalAsync(i, env) for i in exp[1:])
+                            exp = _Await(asyncio.gather(*runs))
+                            continue
+                        value = [self._run(i, env, []) for i in exp[1:]]
+                    elif head == "import":
+                        _, module_name = exp
+                        modules = self.eva.modules
+                        module_env = modules.lookup(module_name)
+                        if module_env is not None:
+                            value = env.define(module_name, module_env)
+                        else:
+                            push((REGISTER_MODULE, module_name))
+                            exp = ["module", module_name, modules.source(module_name)]
+                            continue
+                    else:
+                        # function call
+                        push((CALLEE, exp, env))
+                        exp = head
+                        continue
+                else:
+                    print(f"not inplemented {exp}")
+                    value = None
+                exp = _RETURN
+
+            # deliver value to the top continuation
+            # -----------------------
+            if not stack:
+                return value
+            frame = pop()
+            tag = frame[0]
+            if tag == BINARY_RIGHT:
+                push((BINARY_APPLY, frame[1], value))
+                exp, env = frame[2], frame[3]
+            elif tag == BINARY_APPLY:
+                value = frame[1](frame[2], value)
+            elif tag == SEQ:
+                _, block, idx, env = frame
+                if idx + 1 < len(block):
+                    push((SEQ, block, idx + 1, env))
+                exp = block[idx]
+            elif tag == IF:
+                exp = frame[1] if value else frame[2]
+                env = frame[3]
+            elif tag == WHILE_COND:
+                _, while_exp, env, ret = frame
+                if value:
+                    if meter is not None:
+                        # meter.step()
+                        meter.left -= 1
+                        if meter.left < 0:
+                            meter.overrun()
+                    push((WHILE_BODY, while_exp, env))
+                    exp = while_exp[2]
+                else:
+                    value = ret
+            elif tag == WHILE_BODY:
+                _, while_exp, env = frame
+                push((WHILE_COND, while_exp, env, value))
+                exp = while_exp[1]
+            elif tag == CALLEE:
+                _, call_exp, env = frame
+                if len(call_exp) == 1:
+                    exp, env = self._apply(value, [], stack)
+                else:
+                    push((ARGS, call_exp, 1, env, [], value))
+                    exp = call_exp[1]
+            elif tag == ARGS:
+                _, call_exp, idx, env, args, fn = frame
+                args.append(value)
+                if idx + 1 < len(call_exp):
+                    push((ARGS, call_exp, idx + 1, env, args, fn))
+                    exp = call_exp[idx + 1]
+                else:
+                    exp, env = self._apply(fn, args, stack)
+            elif tag == NEG:
+                value = -value
+            elif tag == DEFINE:
+                value = frame[1].define(frame[2], value)
+            elif tag == ASSIGN:
+                value = frame[1].assign(frame[2], value)
+            elif tag == SET_PROP:
+                _, value_exp, prop_name, env = frame
+                push((DEFINE, value, prop_name))
+                exp = value_exp
+            elif tag == CLASS:
+                _, class_exp, env = frame
+                _, class_name, _, body = class_exp
+                if meter is not None:
+                    meter.alloc()
+                class_env = ClassEnvironment({}, value or env)
+                push((DEFINE_VALUE, env, class_name, class_env))
+                env = class_env
+                exp = self._enterBody(body, env, stack)
+            elif tag == DEFINE_VALUE:
+                value = frame[1].define(frame[2], frame[3])
+            elif tag == PROP:
+                value = frame[1].lookup(value)
+            elif tag == SUPER:
+                value = value.parent
+            elif tag == RETURN_VALUE:
+                value = frame[1]
+            elif tag == REGISTER_MODULE:
+                value = self.eva.modules.register(frame[1], value)
@@ -0,0 +1,123 @@
+# Memoization
+###############################
+# ['def-memo', name, params, body] defines name like `def`, wrapped in a
+# Memo: a call with arguments seen before returns the cached result
+# instead of running the body again. (memo fn [maxsize]) wraps any
+# function value. a Memo is a host callable, every engine calls it like a
+# builtin, and recursive calls (fib names the Memo) go through the cache.
+#
+# - keyed by the argument tuple, a call with an unhashable argument (an
+#   array) runs uncached
+# - at most maxsize results (None: unbounded), least recently used first out
+# - stats: hits, misses, evictions
+#
+# caching is only correct for pure functions. def-memo checks the body
+# when it is desugared: assigning a variable that is not a param or local
+# of the body, or a prop, warns with ImpureMemoWarning.
+
+import warnings
+from collections import OrderedDict
+
+from host import declare
+
+DEFAULT_MAXSIZE = 1024
+
+_ASSIGNMENTS = {"set", "++", "--", "+=", "-="}
+
+
+class ImpureMemoWarning(UserWarning):
+    pass
+
+
+class Memo:
+    def __init__(self, fn, apply, maxsize=DEFAULT_MAXSIZE):
+        self.fn = fn
+        self.maxsize = maxsize
+        # apply(fn, args) calls fn on the engine, see Eva.apply
+        self._apply = apply
+        self._cache = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def __call__(self, *args):
+        try:
+            result = self._cache[args]
+        except KeyError:
+            pass
+        except TypeError:
+            # unhashable argument
+            return self._apply(self.fn, list(args))
+        else:
+            self.stats["hits"] += 1
+            self._cache.move_to_end(args)
+            return result
+        self.stats["misses"] += 1
+        result = self._apply(self.fn, list(args))
+        self._cache[args] = result
+        if self.maxsize is not None and len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+        return result
+
+    def __len__(self):
+        return len(self._cache)
+
+    def clear(self):
+        self._cache.clear()
+
+
+# purity check
+# --------------------------
+def impureAssignments(params, body):
+    # names body assigns that are not params/locals, 'prop' for props
+    local = set(params if isinstance(params, list) else [params])
+    _declarations(body, local)
+    found = []
+    _assignments(body, local, found)
+    return found
+
+
+def checkPurity(name, params, body):
+    for target in impureAssignments(params, body):
+        what = "a prop" if target == "prop" else f"non-local variable '{target}'"
+        warnings.warn(
+            f"def-memo '{name}' assigns {what}, cached results may be stale.",
+            ImpureMemoWarning,
+            stacklevel=2,
+        )
+
+
+def _declarations(exp, names):
+    # var/def names and lambda params anywhere in exp
+    if not isinstance(exp, list) or not exp:
+        return
+    head = exp[0]
+    if head in ("var", "def", "def-memo") and isinstance(exp[1], str):
+        names.add(exp[1])
+    if head in ("def", "def-memo", "lambda"):
+        params = exp[2] if head != "lambda" else exp[1]
+        names.update(params if isinstance(params, list) else [params])
+    for i in exp:
+        _declarations(i, names)
+
+
+def _assignments(exp, local, found):
+    if not isinstance(exp, list) or not exp:
+        return
+    if isinstance(exp[0], str) and exp[0] in _ASSIGNMENTS and len(exp) > 1:
+        target = exp[1]
+        if isinstance(target, list) and target and target[0] == "prop":
+            target = "prop"
+        if isinstance(target, str) and target not in local and target not in found:
+            found.append(target)
+    for i in exp:
+        _assignments(i, local, found)
+
+
+# builtins
+# --------------------------
+def builtins(apply):
+    @declare()
+    def memo(fn, maxsize=DEFAULT_MAXSIZE):
+        return Memo(fn, apply, maxsize)
+
+    return {"memo": memo}
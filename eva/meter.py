@@ -0,0 +1,150 @@
+# Resource limits
+###############################
+# untrusted programs run under a Meter:
+#
+#   with eva.limit(steps=10**6, memory=10**5, timeout=2.0) as meter:
+#       eva.eval(script)        # ResourceExceeded once a limit is passed
+#   meter.used()                # {"steps": ..., "memory": ..., "time": ...}
+#
+# (or Eva(limits={...}) meters the interpreter for its whole life)
+#
+# - steps:   function activations and loop iterations. a program can only
+#            run unbounded through these, between two of them it evaluates
+#            a bounded number of its own nodes: one counter per call or
+#            iteration instead of one per node
+# - memory:  environments (activations, blocks, classes, modules) and
+#            instances allocated
+# - timeout: seconds of wall clock since the meter started, the clock is
+#            read every WINDOW steps
+#
+# every engine counts steps at the same points. memory counts what the
+# engine actually allocates: a block declaring variables is an env in the
+# ast and stack engines and a frame in the closure engine, nothing in the
+# vm (its locals live in the activation), so one program uses less memory
+# on the vm. a block declaring nothing allocates nothing. a builtin call is not a step,
+# however long it runs: the deadline is checked at the next WINDOW steps.
+#
+# the hot paths (calls, blocks, loop iterations) inline the counting,
+# bench/bench_meter.py: a few % in the ast, stack and vm engines, up to
+# about 10% on call-bound programs in the closure engine.
+#
+# the engines only decrement `left` (steps) and `room` (allocations),
+# counters of a window of at most WINDOW events: small ints, which python
+# doesn't allocate. when one goes below 0, overrun() adds the window to
+# the totals, checks the limits and starts the next window.
+
+import time
+
+from runtime import running
+
+
+class ResourceExceeded(RuntimeError):
+    # limit: "steps", "memory" or "timeout", used went over maximum
+    def __init__(self, limit, used, maximum):
+        super().__init__(f"Resource limit '{limit}' exceeded: {used} > {maximum}.")
+        self.limit = limit
+        self.used = used
+        self.maximum = maximum
+
+
+class Meter:
+    # counters are written on every call: no per-object __dict__
+    __slots__ = (
+        "steps", "memory", "timeout", "left", "room", "_eva",
+        "_steps", "_step_window", "_allocs", "_alloc_window", "_start", "_deadline",
+    )
+    # at most 256: python keeps the ints -5..256 preallocated
+    WINDOW = 256
+
+    def __init__(self, steps=None, memory=None, timeout=None):
+        self.steps = steps
+        self.memory = memory
+        self.timeout = timeout
+        self._eva = None
+        self.reset()
+
+    def reset(self):
+        # totals before the current windows
+        self._steps = self._allocs = 0
+        self.left = self._step_window = _window(self.steps, 0)
+        self.room = self._alloc_window = _window(self.memory, 0)
+        self._start = time.monotonic()
+        self._deadline = None if self.timeout is None else self._start + self.timeout
+        return self
+
+    def start(self, eva):
+        # meter every evaluation of eva from now on
+        if self._eva is not None:
+            raise RuntimeError("Meter is already started.")
+        self._eva = eva
+        eva.meter = self
+        if running.eva is eva:
+            running.meter = self
+        return self.reset()
+
+    def stop(self):
+        if self._eva is not None:
+            if running.eva is self._eva:
+                running.meter = None
+            self._eva.meter = None
+            self._eva = None
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def used(self):
+        return {
+            "steps": self._steps + self._step_window - self.left,
+            "memory": self._allocs + self._alloc_window - self.room,
+            "time": time.monotonic() - self._start,
+        }
+
+    # counting, called by the engines
+    # --------------------------
+    def step(self):
+        self.left -= 1
+        if self.left < 0:
+            self.overrun()
+
+    def call(self):
+        # an activation: a step and its env. the closure engine and the vm
+        # inline this (one method call is a sizeable part of theirs)
+        self.left -= 1
+        self.room -= 1
+        if self.left < 0 or self.room < 0:
+            self.overrun()
+
+    def alloc(self):
+        self.room -= 1
+        if self.room < 0:
+            self.overrun()
+
+    def overrun(self):
+        # a window ran out: raise, or start the next one
+        if self.room < 0:
+            used = self._allocs + self._alloc_window - self.room
+            if self.memory is not None and used > self.memory:
+                raise ResourceExceeded("memory", used, self.memory)
+            self._allocs = used
+            self.room = self._alloc_window = _window(self.memory, used)
+        if self.left < 0:
+            used = self._steps + self._step_window - self.left
+            if self.steps is not None and used > self.steps:
+                raise ResourceExceeded("steps", used, self.steps)
+            if self._deadline is not None:
+                now = time.monotonic()
+                if now > self._deadline:
+                    raise ResourceExceeded("timeout", round(now - self._start, 3), self.timeout)
+            self._steps = used
+            self.left = self._step_window = _window(self.steps, used)
+
+
+def _window(limit, used):
+    # events until the next check
+    if limit is None:
+        return Meter.WINDOW
+    return min(Meter.WINDOW, limit - used)
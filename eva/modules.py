@@ -0,0 +1,189 @@
+# Module registry
+###############################
+# `import` used to open, read and python-eval ./import/<name> and build a
+# new module env every time it ran. the registry
+# - parses a module file once (streamed through reader.readForms) and
+#   keeps the parsed body in memory
+#   (optionally also pickled on disk, for the next process)
+# - keeps the module env of every loaded module: importing it again
+#   defines the existing env instead of re-evaluating the module
+# - invalidates both when the file changes: its (mtime, size) stamp is
+#   checked on every import, the on-disk cache is also checked by hash
+# - knows which loaded modules changed on disk (changed/loadedBody) and
+#   parses a changed file again form by form (reload), for hot reloading
+#   their envs in place (hotreload.py)
+
+import hashlib
+import os
+import pickle
+import threading
+from reader import ParseError, parse, readForms, splitForms
+
+
+class ModuleRegistry:
+    def __init__(self, path="./import", cache_dir=None):
+        self.path = path
+        # directory for pickled parsed modules, None: memory only
+        self.cache_dir = cache_dir
+        # name -> (stamp, body)
+        self._sources = {}
+        # name -> (stamp, module_env)
+        self._modules = {}
+        # name -> {source text of top-level forms: their parsed forms}, of
+        # the last reload (reader.splitForms)
+        self._forms = {}
+        # names of modules still the registry's this one was forked from,
+        # copied through _copy on first use (see fork)
+        self._forked = set()
+        self._copy = None
+        self.stats = {"hits": 0, "loads": 0, "parses": 0, "reloads": 0}
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _stamp(self, name):
+        stat = os.stat(self._file(name))
+        return stat.st_mtime_ns, stat.st_size
+
+    def lookup(self, name):
+        # the loaded module env, None when not loaded or the file changed
+        entry = self._entry(name)
+        if entry is None:
+            return None
+        stamp, module_env = entry
+        if stamp != self._stamp(name):
+            del self._modules[name]
+            return None
+        self.stats["hits"] += 1
+        return module_env
+
+    def register(self, name, module_env):
+        self._forked.discard(name)
+        self._modules[name] = (self._stamp(name), module_env)
+        return module_env
+
+    def changed(self):
+        # loaded modules whose file changed since they were loaded:
+        # [(name, module_env)], a deleted file is left to the next import
+        changed = []
+        for name, (stamp, module_env) in list(self.modules().items()):
+            try:
+                if stamp != self._stamp(name):
+                    changed.append((name, module_env))
+            except FileNotFoundError:
+                continue
+        return changed
+
+    def loaded(self):
+        # name -> module env of the loaded modules
+        return {name: module_env for name, (_, module_env) in self.modules().items()}
+
+    def modules(self):
+        # name -> (stamp, module env) of the loaded modules, all copied
+        for name in list(self._forked):
+            self._entry(name)
+        return self._modules
+
+    def loadedBody(self, name):
+        # the parsed body the loaded module env was evaluated from, None
+        # when it is not kept any more
+        loaded, source = self._modules.get(name), self._sources.get(name)
+        if loaded is None or source is None or loaded[0] != source[0]:
+            return None
+        return source[1]
+
+    def fork(self, copy):
+        # a registry with the same modules loaded, parsed bodies shared. a
+        # module env is copied through copy(module_env) (see pool.py) when
+        # first used
+        registry = ModuleRegistry(self.path, self.cache_dir)
+        registry._sources = dict(self._sources)
+        registry._modules = dict(self.modules())
+        registry._forked = set(self._modules)
+        registry._copy = copy
+        return registry
+
+    def _entry(self, name):
+        entry = self._modules.get(name)
+        if entry is not None and name in self._forked:
+            self._forked.discard(name)
+            entry = self._modules[name] = (entry[0], self._copy(entry[1]))
+        return entry
+
+    def forget(self, name):
+        self._forked.discard(name)
+        self._modules.pop(name, None)
+        self._sources.pop(name, None)
+        self._forms.pop(name, None)
+
+    def source(self, name):
+        # parsed module body ['begin', ...]
+        self.stats["loads"] += 1
+        stamp = self._stamp(name)
+        entry = self._sources.get(name)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        body = self._loadCached(name)
+        self._sources[name] = (stamp, body)
+        return body
+
+    def reload(self, name):
+        # parsed body of a changed module file, like source(). top-level
+        # forms with the same text as at the last reload are not parsed
+        # again (they are the same objects), the first reload parses all
+        self.stats["parses"] += 1
+        stamp = self._stamp(name)
+        with open(self._file(name), encoding="utf-8") as file:
+            text = file.read()
+        known, forms = self._forms.get(name, {}), {}
+        pieces = splitForms(text)
+        try:
+            for piece in pieces or ():
+                parsed = known.get(piece)
+                forms[piece] = parse(piece) if parsed is None else parsed
+        except ParseError:
+            pieces = None
+        if pieces is None:
+            # reported where it is in the file
+            body = ["begin", *parse(text)]
+            forms = {}
+        else:
+            body = ["begin", *(form for piece in pieces for form in forms[piece])]
+        self._forms[name] = forms
+        self._sources[name] = (stamp, body)
+        return body
+
+    # on-disk cache
+    # --------------------------
+    def _cacheFile(self, name):
+        return os.path.join(self.cache_dir, name + ".pickle")
+
+    def _loadCached(self, name):
+        if self.cache_dir is None:
+            return self._parse(name)
+        digest = hashlib.sha256()
+        with open(self._file(name), "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 16), b""):
+                digest.update(chunk)
+        digest = digest.hexdigest()
+        try:
+            with open(self._cacheFile(name), "rb") as file:
+                cached = pickle.load(file)
+            if cached["hash"] == digest:
+                return cached["body"]
+        except (OSError, EOFError, pickle.UnpicklingError, KeyError):
+            pass
+        body = self._parse(name)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # written aside and renamed: another interpreter reading the cache
+        # never sees a partly written file
+        temp = f"{self._cacheFile(name)}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp, "wb") as file:
+            pickle.dump({"hash": digest, "body": body}, file)
+        os.replace(temp, self._cacheFile(name))
+        return body
+
+    def _parse(self, name):
+        self.stats["parses"] += 1
+        with open(self._file(name), "rb") as file:
+            return ["begin", *readForms(file)]
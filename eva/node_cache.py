@@ -0,0 +1,38 @@
+# Node caches
+###############################
+# the AST walking engines cache what they derive from a node (its core
+# form, its prop site's inline cache, the optimized program) by id(node).
+# a list can't be weakly referenced, so an entry keeps its node alive
+# (its id can't be reused while the entry exists): a NodeCache keeps the
+# `maxsize` entries added last. the nodes of programs evaluated once are
+# dropped in time instead of living as long as the interpreter.
+#
+# a hit doesn't reorder anything (it is on the hot path of every sugar
+# node and prop site): a hot node evicted by newer ones is derived again
+# once and added back.
+
+
+class NodeCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        # id(node) -> (node, value), oldest first
+        self._entries = {}
+
+    def get(self, node, default=None):
+        entry = self._entries.get(id(node))
+        if entry is None or entry[0] is not node:
+            return default
+        return entry[1]
+
+    def put(self, node, value):
+        entries = self._entries
+        entries[id(node)] = (node, value)
+        if len(entries) > self.maxsize:
+            del entries[next(iter(entries))]
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
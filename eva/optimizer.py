@@ -0,0 +1,290 @@
+# AST optimizer
+###############################
+# a pass over the list AST before it runs, so work that is the same on
+# every evaluation (inside loop bodies too) is done once:
+#
+# level 0  nothing, the program runs as written
+# level 1  - fold + - * < > = over number literals
+#            ['+', ['*', 2, 3], 2]  ->  8
+#          - `if` with a literal condition keeps the taken branch
+#          - `switch` drops cases with a literal false condition, a literal
+#            true one becomes the else case
+# level 2  also
+#          - names bound in the env to a number/bool constant (true) are
+#            inlined, and calls to names bound to known pure builtins
+#            (operator.add, ...) become the operator form, so they fold too
+#          - calls of other pure host functions (host.py) with number
+#            arguments are replaced by their number result: (sqrt 16) -> 4.0
+#          - unused pure expressions in `begin` blocks are removed
+#
+# level 2 assumes the names it inlines are not rebound: names the program
+# itself binds (var/set/def/params/++/...) are never inlined, but code that
+# runs elsewhere could still rebind a global later.
+# a node is only copied when something in it changed.
+
+import operator
+
+import host
+from node_cache import NodeCache
+
+# operator forms that fold
+FOLDABLE = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "<": operator.lt,
+    ">": operator.gt,
+    "=": operator.eq,
+}
+
+# pure builtins that have an operator form: (fn a b) -> (op a b)
+INLINE_BUILTINS = {
+    operator.add: "+",
+    operator.sub: "-",
+    operator.mul: "*",
+    operator.lt: "<",
+    operator.gt: ">",
+    operator.eq: "=",
+}
+
+# forms that bind (or rebind) the name in their first operand
+_BINDING_FORMS = {"var", "set", "++", "--", "+=", "-="}
+
+
+def isConstant(exp):
+    # number (bool included) or "string" literal
+    if isinstance(exp, (int, float)):
+        return True
+    return isinstance(exp, str) and len(exp) > 1 and exp[0] == '"' and exp[-1] == '"'
+
+
+def constantValue(exp):
+    if isinstance(exp, str):
+        return exp[1:-1]
+    return exp
+
+
+def boundNames(exp, names=None):
+    # every name the program binds, anywhere
+    if names is None:
+        names = set()
+    if not isinstance(exp, list) or not exp:
+        return names
+    head = exp[0] if isinstance(exp[0], str) else None
+    if head in _BINDING_FORMS or head in ("class", "module", "import"):
+        if isinstance(exp[1], str):
+            names.add(exp[1])
+    elif head in ("def", "def-memo", "lambda"):
+        params = exp[1] if head == "lambda" else exp[2]
+        if head != "lambda":
+            names.add(exp[1])
+        names.update(params if isinstance(params, list) else [params])
+    for i in exp:
+        boundNames(i, names)
+    return names
+
+
+def _listBody(exp, index):
+    # a function body folded to a number stays a list: ['begin', 3]
+    if isinstance(exp[index], (int, float)):
+        exp = exp[:]
+        exp[index] = ["begin", exp[index]]
+    return exp
+
+
+class Optimizer:
+    def __init__(self, level=1):
+        self.level = level
+        # number of nodes folded/pruned/inlined/removed so far
+        self.optimizations = 0
+        # optimized programs: exp -> (env, optimized exp), the last 256
+        # (see node_cache.py), so are the envs they were optimized for
+        self._cache = NodeCache(256)
+
+    def optimize(self, exp, env=None, cache=True):
+        # env: where the program runs, names of level 2 are looked up there
+        # cache=False: exp is a temporary node, don't keep it
+        if self.level <= 0:
+            return exp
+        entry = self._cache.get(exp)
+        if entry is not None and entry[0] is env:
+            return entry[1]
+        self._env = env
+        self._bound = boundNames(exp) if self.level >= 2 else None
+        self._inlined = False
+        optimized = self._optimize(exp)
+        # a result with values inlined from env is only valid for now
+        if cache and isinstance(exp, list) and not self._inlined:
+            self._cache.put(exp, (env, optimized))
+        return optimized
+
+    def _optimize(self, exp):
+        if isinstance(exp, str):
+            return self._optimizeName(exp)
+        if not isinstance(exp, list) or not exp:
+            return exp
+        head = exp[0]
+        if head == "if" and len(exp) == 4:
+            return self._optimizeIf(exp)
+        if head == "switch":
+            return self._optimizeSwitch(exp)
+        if head == "begin":
+            return self._optimizeBegin(exp)
+        if head in ("var", "set", "+=", "-="):
+            return self._rebuild(exp, 2)
+        if head in ("++", "--", "import"):
+            return exp
+        if head == "lambda":
+            return _listBody(self._rebuild(exp, 2), 2)
+        if head == "def":
+            return _listBody(self._rebuild(exp, 3), 3)
+        if head == "class":
+            return self._rebuild(exp, 3)
+        if head == "def-memo":
+            return _listBody(self._rebuild(exp, 3, 4), 3)
+        if head == "module":
+            return self._rebuild(exp, 2)
+        if head == "prop":
+            return self._rebuild(exp, 1, 2)
+        if head == "new":
+            return self._rebuild(exp, 2)
+        if isinstance(head, str) and head not in FOLDABLE:
+            exp = self._inlineBuiltin(exp)
+            head = exp[0]
+        exp = self._rebuild(exp, 0 if not isinstance(head, str) else 1)
+        if isinstance(head, str) and head in FOLDABLE:
+            return self._fold(exp)
+        if isinstance(head, str):
+            return self._foldCall(exp)
+        return exp
+
+    def _rebuild(self, exp, start, stop=None):
+        # optimize exp[start:stop], copy exp only when a child changed
+        stop = len(exp) if stop is None else stop
+        children = [self._optimize(i) for i in exp[start:stop]]
+        if all(new is old for new, old in zip(children, exp[start:stop])):
+            return exp
+        return [*exp[:start], *children, *exp[stop:]]
+
+    # level 1
+    # --------------------------
+    def _fold(self, exp):
+        head, *operands = exp
+        if len(operands) != 2 and not (head == "-" and len(operands) == 1):
+            return exp
+        if not all(isinstance(i, (int, float)) for i in operands):
+            return exp
+        self.optimizations += 1
+        if head == "-" and len(operands) == 1:
+            return -operands[0]
+        return FOLDABLE[head](*operands)
+
+    def _optimizeIf(self, exp):
+        _, cond, stmt1, stmt2 = exp
+        new_cond = self._optimize(cond)
+        if isConstant(new_cond):
+            self.optimizations += 1
+            return self._optimize(stmt1 if constantValue(new_cond) else stmt2)
+        new_stmt1, new_stmt2 = self._optimize(stmt1), self._optimize(stmt2)
+        if new_cond is cond and new_stmt1 is stmt1 and new_stmt2 is stmt2:
+            return exp
+        return ["if", new_cond, new_stmt1, new_stmt2]
+
+    def _optimizeSwitch(self, exp):
+        cases = []
+        changed = False
+        for cond, block in exp[1:]:
+            new_cond = cond
+            if cond != "else":
+                new_cond = self._optimize(cond)
+                if isConstant(new_cond):
+                    self.optimizations += 1
+                    if not constantValue(new_cond):
+                        # never taken
+                        changed = True
+                        continue
+                    # always taken, the cases after it are unreachable
+                    new_cond = "else"
+            new_block = self._optimize(block)
+            changed = changed or new_cond is not cond or new_block is not block
+            cases.append([new_cond, new_block])
+            if new_cond == "else":
+                break
+        if not changed or not cases or cases[-1][0] != "else":
+            # a switch without an else case is kept as written
+            return exp
+        if len(cases) == 1:
+            return cases[0][1]
+        return ["switch", *cases]
+
+    # level 2
+    # --------------------------
+    def _optimizeName(self, exp):
+        if self._bound is None or isConstant(exp) or exp in self._bound:
+            return exp
+        value = self._globalValue(exp)
+        if isinstance(value, (int, float)):
+            self.optimizations += 1
+            self._inlined = True
+            return value
+        return exp
+
+    def _globalValue(self, name):
+        if self._env is None or not name[0].isalpha():
+            return None
+        try:
+            return self._env.lookup(name)
+        except ValueError:
+            return None
+
+    def _foldCall(self, exp):
+        if self._bound is None or exp[0] in self._bound:
+            return exp
+        args = exp[1:]
+        if not all(isinstance(i, (int, float)) for i in args):
+            return exp
+        fn = self._globalValue(exp[0])
+        if not callable(fn) or not host.isPure(fn, len(args)):
+            return exp
+        try:
+            value = fn(*args)
+        except Exception:
+            # raises when it runs
+            return exp
+        if not isinstance(value, (int, float)):
+            return exp
+        self.optimizations += 1
+        self._inlined = True
+        return value
+
+    def _inlineBuiltin(self, exp):
+        if self._bound is None or exp[0] in self._bound or len(exp) != 3:
+            return exp
+        fn = self._globalValue(exp[0])
+        # a builtin function: hashable, can be a key of INLINE_BUILTINS
+        if type(fn) is not type(operator.add):
+            return exp
+        form = INLINE_BUILTINS.get(fn)
+        if form is None:
+            return exp
+        self.optimizations += 1
+        self._inlined = True
+        return [form, *exp[1:]]
+
+    def _optimizeBegin(self, exp):
+        body = [self._optimize(i) for i in exp[1:]]
+        if self._bound is not None and body:
+            kept = [i for i in body[:-1] if not self._isPure(i)]
+            self.optimizations += len(body) - 1 - len(kept)
+            body = kept + body[-1:]
+        if len(body) == len(exp) - 1 and all(n is o for n, o in zip(body, exp[1:])):
+            return exp
+        return ["begin", *body]
+
+    def _isPure(self, exp):
+        # no effect and can't raise
+        if isConstant(exp):
+            return True
+        if isinstance(exp, list) and exp and exp[0] == "lambda":
+            return True
+        return False
@@ -0,0 +1,469 @@
+# Parallel evaluation
+###############################
+# eva.evalParallel(*exp) evaluates top-level forms like evalGlobal, but
+# runs independent pure forms in worker processes (a ProcessPoolExecutor,
+# one python interpreter per core, so no GIL between them):
+#
+#   (var a (fib 25))      both are offloaded and run at the same time,
+#   (var b (fib 26))      a and b are defined in program order
+#   (+ a b)               reads a and b: waits for both, runs here
+#
+# a form is offloaded when evaluating it calls a function, and it is pure:
+# assigns no name outside itself, imports nothing and calls no python
+# callable other than pure host functions (host.py) and the Eva builtins.
+# it reaches globals, through the functions it calls, that are data
+# (numbers, strings, arrays, lists of them) or global functions: a worker
+# gets copies, a method it calls on an instance, class or module would
+# change the copy only. one that reads a name a running form defines waits
+# for it. everything else runs in this process, after the running forms it
+# may depend on (defines, or reads the globals of) merged.
+#
+# a worker starts from a fresh global env: the task carries the global
+# names the form reads, transitively through the functions it calls, as
+# their source (functions) or pickled value (data), see Parallel._bindings.
+# the global env itself never crosses the process boundary, it is pickled
+# as a reference to the global env on the other side. when a task can't
+# be shipped or its result can't come back (a compiled function of the
+# closure/vm engines, ...) the form runs here instead, like any error of
+# an offloaded form: it runs again here, in program order, and raises.
+#
+# (pmap fn values) is `map` over worker processes, for a pure fn.
+# eva.evalBatch(program, rows, parallel=True) runs chunks of rows in them
+# (see batch.py).
+#
+# a metered interpreter (meter.py) runs everything here: workers would
+# run outside of its limits.
+
+import io
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from arrays import Array
+from compiler import Code
+from env import Environment
+import host
+from memo import impureAssignments
+from optimizer import boundNames
+
+# forms defining the name in their first operand in the env they run in
+_DEFINING_FORMS = {"var", "def", "def-memo", "module", "class"}
+_ATOMS = {int, float, str, bool, type(None)}
+
+
+# analysis
+# --------------------------
+def freeNames(exp, special_forms, names=None):
+    # names exp reads or writes that it doesn't bind itself
+    if names is None:
+        names = set()
+        _names(exp, special_forms, names)
+        return names - boundNames(exp)
+    _names(exp, special_forms, names)
+    return names
+
+
+def _names(exp, special_forms, names):
+    if isinstance(exp, str):
+        if exp[0].isalpha():
+            names.add(exp)
+        return
+    if not isinstance(exp, list) or not exp:
+        return
+    head = exp[0]
+    if head == "prop":
+        # the member name is not a variable
+        _names(exp[1], special_forms, names)
+        return
+    if isinstance(head, str) and head in special_forms:
+        exp = exp[1:]
+    for i in exp:
+        _names(i, special_forms, names)
+
+
+def callsFunction(exp, special_forms):
+    # does evaluating exp call a function (outside of function bodies)
+    if not isinstance(exp, list) or not exp:
+        return False
+    head = exp[0]
+    if head in ("lambda", "def", "def-memo"):
+        return False
+    if not isinstance(head, str) or head not in special_forms:
+        return True
+    return any(callsFunction(i, special_forms) for i in exp[1:])
+
+
+def isData(value):
+    # can a worker take a copy of value: nothing a call there can change
+    if type(value) in _ATOMS or type(value) is Array:
+        return True
+    if type(value) in (list, tuple):
+        # a function value holds its env
+        return all(isData(i) for i in value)
+    return False
+
+
+def functionSource(fn):
+    # (['lambda', params, body], env) of a function value, None when the
+    # engine doesn't keep its source (vm closures)
+    if not isinstance(fn, list) or len(fn) != 3:
+        return None
+    params, body, env = fn
+    if isinstance(body, Code):
+        body = body.exp
+    return ["lambda", params, body], env
+
+
+# pickling with the global env as a reference
+# --------------------------
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, global_env):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._global_env = global_env
+
+    def persistent_id(self, obj):
+        return "global" if obj is self._global_env else None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, global_env):
+        super().__init__(file)
+        self._global_env = global_env
+
+    def persistent_load(self, pid):
+        return self._global_env
+
+
+def dumps(obj, global_env):
+    buffer = io.BytesIO()
+    _Pickler(buffer, global_env).dump(obj)
+    return buffer.getvalue()
+
+
+def loads(data, global_env):
+    return _Unpickler(io.BytesIO(data), global_env).load()
+
+
+# worker side
+# --------------------------
+def _workerEva(engine, global_env, bindings):
+    from evai import Eva
+
+    # no pool of its own: pmap in a worker maps in the worker
+    eva = Eva(global_env, engine=engine, workers=0)
+    for kind, name, payload in bindings:
+        if kind == "exp":
+            eva.evalGlobal(payload)
+        else:
+            global_env.define(name, payload)
+    return eva
+
+
+def _runForm(engine, task):
+    # pickled result of the form, None: run it in the main process
+    global_env = Environment({})
+    try:
+        bindings, exp = loads(task, global_env)
+        eva = _workerEva(engine, global_env, bindings)
+        value = eva.evalGlobal(exp)
+        if isinstance(exp, list) and exp and exp[0] in _DEFINING_FORMS:
+            value = global_env.lookup(exp[1])
+        return dumps(value, global_env)
+    except Exception:
+        return None
+
+
+def _runMap(engine, task):
+    global_env = Environment({})
+    try:
+        bindings, captured, source, values = loads(task, global_env)
+        eva = _workerEva(engine, global_env, bindings)
+        fn = eva.eval(source, Environment(captured, global_env))
+        return dumps([eva.apply(fn, [i]) for i in values], global_env)
+    except Exception:
+        return None
+
+
+def _runBatch(engine, task):
+    from batch import Batch
+
+    global_env = Environment({})
+    try:
+        bindings, program, names, rows = loads(task, global_env)
+        eva = _workerEva(engine, global_env, bindings)
+        return dumps(list(Batch(eva, program, names).results(rows)), global_env)
+    except Exception:
+        return None
+
+
+# main process side
+# --------------------------
+class Parallel:
+    def __init__(self, eva, workers=None):
+        self.eva = eva
+        # worker processes, 0: evaluate everything in this process
+        self.workers = os.cpu_count() if workers is None else workers
+        # forms run in workers, and run here after all
+        self.stats = {"offloaded": 0, "fallbacks": 0}
+        # name -> (def form, value it defined), sources of the functions
+        # the vm engine doesn't keep
+        self._sources = {}
+        self._executor = None
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _submit(self, run, task):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers)
+        self.stats["offloaded"] += 1
+        return self._executor.submit(run, self.eva.engine, task)
+
+    # top-level forms
+    # --------------------------
+    def evalGlobal(self, *exp):
+        if not self.workers or self.eva.meter is not None:
+            return self.eva.evalGlobal(*exp)
+        special_forms = self.eva._special_forms
+        # running forms in program order: (form, future), the names they
+        # define and the globals they read
+        running, running_names, running_reads = [], set(), set()
+        result = None
+        for form in exp:
+            names = freeNames(form, special_forms) | self._writes(form)
+            calls = callsFunction(form, special_forms)
+            task = self._task(form, names) if calls and self._isPure(form) else None
+            if task is not None:
+                if task[1] & running_names:
+                    self._merge(running)
+                    running_names, running_reads = set(), set()
+                    # what it reads is defined here now, pack it again
+                    task = self._task(form, names)
+            if task is not None:
+                running.append((form, self._submit(_runForm, task[0])))
+                running_names |= self._writes(form)
+                running_reads |= task[1]
+                continue
+            # a call may read anything
+            if running and (calls or names & (running_names | running_reads)):
+                self._merge(running)
+                running_names, running_reads = set(), set()
+            result = self._evalHere(form)
+        if running:
+            last = running[-1][0] is exp[-1]
+            merged = self._merge(running)
+            if last:
+                # else the last form ran here
+                result = merged
+        return result
+
+    def _writes(self, form):
+        if isinstance(form, list) and form and form[0] in _DEFINING_FORMS:
+            return {form[1]}
+        return set()
+
+    def _isPure(self, form):
+        return not impureAssignments([], form) and not _imports(form)
+
+    def _task(self, form, names):
+        # (pickled task, global names it reads transitively) or None
+        bindings, read = [], set()
+        if not self._bindings(names, bindings, read):
+            return None
+        try:
+            return dumps((bindings, form), self.eva.global_env), read
+        except Exception:
+            return None
+
+    def _merge(self, running):
+        result = None
+        for form, future in running:
+            data = future.result()
+            if data is None:
+                self.stats["fallbacks"] += 1
+                result = self._evalHere(form)
+                continue
+            result = loads(data, self.eva.global_env)
+            for name in self._writes(form):
+                self.eva.global_env.define(name, result)
+            self._keepSource(form)
+        running.clear()
+        return result
+
+    def _evalHere(self, form):
+        result = self.eva.evalGlobal(form)
+        self._keepSource(form)
+        return result
+
+    def _keepSource(self, form):
+        if isinstance(form, list) and form and (form[0] == "def" or _isVarLambda(form)):
+            self._sources[form[1]] = (form, self.eva.global_env.record.get(form[1]))
+
+    def _bindings(self, names, bindings, seen):
+        # append what a worker needs to define the global names in `names`
+        # to bindings, dependencies first. False: can't be shipped
+        eva, record = self.eva, self.eva.global_env.record
+        special_forms = eva._special_forms
+        for name in sorted(names - seen):
+            seen.add(name)
+            if name not in record:
+                # a local, or undefined
+                continue
+            value = record[name]
+            if name in eva.builtins and value is eva.builtins[name]:
+                # the worker's Eva has its own
+                continue
+            source = self._sources.get(name)
+            if source is not None and source[1] is value:
+                form = source[0]
+                if not self._isPure(form):
+                    return False
+                if not self._bindings(freeNames(form, special_forms), bindings, seen):
+                    return False
+                bindings.append(("exp", name, form))
+            elif callable(value):
+                if not host.isPure(value):
+                    return False
+                bindings.append(("value", name, value))
+            elif functionSource(value) is not None and value[2] is eva.global_env:
+                form = ["var", name, functionSource(value)[0]]
+                if not self._isPure(form):
+                    return False
+                if not self._bindings(freeNames(form, special_forms), bindings, seen):
+                    return False
+                bindings.append(("exp", name, form))
+            elif isData(value):
+                bindings.append(("value", name, value))
+            else:
+                # an instance, class, module, function of another env
+                return False
+        return True
+
+    # pmap
+    # --------------------------
+    def map(self, fn, values):
+        values = list(values)
+        offload = self.workers and len(values) > 1 and self.eva.meter is None
+        offload = offload and all(isData(i) for i in values)
+        task = self._mapTask(fn) if offload else None
+        if task is None:
+            return [self.eva.apply(fn, [i]) for i in values]
+        bindings, captured, source = task
+        chunk = -(-len(values) // (self.workers * 4))
+        chunks = [values[i : i + chunk] for i in range(0, len(values), chunk)]
+        futures = []
+        for part in chunks:
+            try:
+                data = dumps((bindings, captured, source, part), self.eva.global_env)
+            except Exception:
+                return [self.eva.apply(fn, [i]) for i in values]
+            futures.append(self._submit(_runMap, data))
+        results = []
+        for part, future in zip(chunks, futures):
+            data = future.result()
+            if data is None:
+                self.stats["fallbacks"] += 1
+                results += [self.eva.apply(fn, [i]) for i in part]
+            else:
+                results += loads(data, self.eva.global_env)
+        return results
+
+    def _mapTask(self, fn):
+        # (bindings, captured locals, lambda source) of fn or None
+        found = functionSource(fn)
+        if found is None:
+            return None
+        source, env = found
+        if impureAssignments(source[1], source[2]) or _imports(source):
+            return None
+        # the locals fn closes over, innermost first
+        captured = {}
+        while env is not None and env is not self.eva.global_env:
+            for name, value in env.record.items():
+                captured.setdefault(name, value)
+            env = env.parent
+        if env is None or not all(isData(i) for i in captured.values()):
+            return None
+        names = freeNames(source, self.eva._special_forms) - set(captured)
+        bindings = []
+        if not self._bindings(names, bindings, set()):
+            return None
+        return bindings, captured, source
+
+    # evalBatch
+    # --------------------------
+    def batch(self, program, names, rows, chunk=1000):
+        # generator of the results of program over rows (dicts binding
+        # names), chunks of rows run in workers. None: it can't run there
+        if not self.workers or self.eva.meter is not None or not self._isPure(program):
+            return None
+        free = freeNames(program, self.eva._special_forms) - set(names)
+        bindings = []
+        if not self._bindings(free, bindings, set()):
+            return None
+        return self._batchResults(bindings, program, names, rows, chunk)
+
+    def _batchResults(self, bindings, program, names, rows, chunk):
+        from batch import Batch
+
+        global_env = self.eva.global_env
+        local = None
+        # (rows, future or None) in row order, at most two chunks a worker
+        pending = deque()
+        rows = iter(rows)
+        while True:
+            part = list(islice(rows, chunk))
+            if part:
+                try:
+                    # rows of instances etc. run here
+                    if not all(isData(i) for row in part for i in row.values()):
+                        raise ValueError
+                    task = dumps((bindings, program, names, part), global_env)
+                    pending.append((part, self._submit(_runBatch, task)))
+                except Exception:
+                    pending.append((part, None))
+            if not pending:
+                return
+            if part and len(pending) < self.workers * 2:
+                continue
+            part, future = pending.popleft()
+            data = None if future is None else future.result()
+            if data is not None:
+                yield from loads(data, global_env)
+                continue
+            # runs here, raises what it raised in the worker
+            self.stats["fallbacks"] += 1
+            if local is None:
+                local = Batch(self.eva, program, names)
+            yield from local.results(part)
+
+
+def _isVarLambda(form):
+    return (
+        form[0] == "var"
+        and isinstance(form[2], list)
+        and bool(form[2])
+        and form[2][0] == "lambda"
+    )
+
+
+def _imports(exp):
+    if not isinstance(exp, list) or not exp:
+        return False
+    return exp[0] == "import" or any(_imports(i) for i in exp)
+
+
+# builtins
+# --------------------------
+def builtins(parallel):
+    from arrays import fromValues
+
+    @host.declare(arity=2)
+    def pmap(fn, values):
+        return fromValues(parallel.map(fn, values))
+
+    return {"pmap": pmap}
@@ -0,0 +1,209 @@
+# Interpreter pool
+###############################
+# embedding many tenants in one process (one interpreter per request, on
+# worker threads):
+#
+#   pool = EvaPool(Environment({...builtins}), prelude=[defs...], modules=["Math"])
+#   with pool.interpreter() as eva:       # in any thread
+#       eva.eval(script)
+#
+# the prelude and the modules are evaluated once, into a template global
+# env. every interpreter the pool hands out gets its own copy of it: a
+# snapshot shares everything that is never written (the AST, compiled
+# code, builtins, numbers and strings) and copies only the mutable runtime
+# objects (envs, instances, function values that close over an env, memo
+# caches), with every reference to a template env redirected to the copy.
+# names a tenant defines or assigns, fields it sets, modules it imports
+# stay in its own copy, other tenants can't see them.
+#
+# a global (or loaded module) is copied when the tenant first uses it, a
+# snapshot starts empty: a request touching 3 names of a big prelude
+# copies those 3 and what they reach. copied on access, not on the first
+# write: a function read from the template would run in the template's
+# env, so anything read may be written through later. compiled code is
+# shared, it takes what it needs of an interpreter from the one running
+# it (runtime.py).
+#
+# `size` snapshots are kept ready, an interpreter given back is dropped
+# (it holds the tenant's state) and a fresh snapshot takes its place.
+# the template is never run after the pool is built, only copied.
+#
+# one interpreter must be used by one thread at a time.
+
+import queue
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from env import ClassEnvironment, Environment, Frame, Instance, Shape
+from evai import Eva
+from memo import Memo
+from vm import Cell, Closure
+
+_ENVS = (Environment, ClassEnvironment, Frame, Instance)
+_ATOMS = {int, float, str, bool, type(None)}
+_MISSING = object()
+
+
+class _Snapshot:
+    # copies the mutable objects reachable from a value, once each
+    def __init__(self, apply):
+        # id(original) -> copy, originals stay alive in the template
+        self._copies = {}
+        # apply of the interpreter the copies belong to, for memos
+        self._apply = apply
+
+    def bind(self, original, copy):
+        self._copies[id(original)] = copy
+
+    def copy(self, value):
+        kind = type(value)
+        if kind in _ATOMS:
+            return value
+        copied = self._copies.get(id(value), _MISSING)
+        if copied is not _MISSING:
+            return copied
+        if kind is list:
+            # a function value [params, body, env], any other list is AST
+            if len(value) != 3 or not isinstance(value[2], _ENVS):
+                return value
+            new = [value[0], value[1], None]
+            self.bind(value, new)
+            new[2] = self.copy(value[2])
+            return new
+        if kind is Environment or kind is ClassEnvironment:
+            new = kind.__new__(kind)
+            self.bind(value, new)
+            new.record = {}
+            new.parent = self.copy(value.parent)
+            if kind is ClassEnvironment:
+                new.shape = self.copy(value.shape)
+            new.record.update((var, self.copy(i)) for var, i in value.record.items())
+            return new
+        if kind is Frame:
+            new = Frame(value.names, None, None)
+            self.bind(value, new)
+            new.parent = self.copy(value.parent)
+            new.values = [self.copy(i) for i in value.values]
+            return new
+        if kind is Instance:
+            new = Instance.__new__(Instance)
+            self.bind(value, new)
+            new.shape = self.copy(value.shape)
+            new.values = [self.copy(i) for i in value.values]
+            return new
+        if kind is Shape:
+            new = Shape.__new__(Shape)
+            self.bind(value, new)
+            # a shape's names never change once created
+            new.names = value.names
+            new.size = value.size
+            new.parent = self.copy(value.parent)
+            new.root = self.copy(value.root)
+            new.transitions = {var: self.copy(i) for var, i in value.transitions.items()}
+            return new
+        if kind is Closure:
+            new = Closure(value.proto, None, None)
+            self.bind(value, new)
+            new.cells = [self.copy(i) for i in value.cells]
+            new.env = self.copy(value.env)
+            return new
+        if kind is Cell:
+            new = Cell(None)
+            self.bind(value, new)
+            new.value = self.copy(value.value)
+            return new
+        if kind is Memo:
+            new = Memo(None, self._apply, value.maxsize)
+            self.bind(value, new)
+            new.fn = self.copy(value.fn)
+            new._cache = OrderedDict((args, self.copy(i)) for args, i in value._cache.items())
+            return new
+        # numbers, strings, builtins, arrays (no operation changes them)
+        return value
+
+
+class _Template(Environment):
+    # parent of a snapshot's global env: the template's globals, a name is
+    # copied into the snapshot's global env the first time it is resolved
+    __slots__ = ("_owner", "_snapshot", "_builtins")
+
+    def __init__(self, template, owner, snapshot):
+        super().__init__(template.global_env.record, snapshot.copy(template.global_env.parent))
+        self._owner = owner
+        self._snapshot = snapshot
+        # the template's own builtins are bound to the template, the
+        # snapshot defined its own
+        self._builtins = template.builtins
+
+    def resolve(self, var):
+        value = self.record.get(var, _MISSING)
+        if value is _MISSING or value is self._builtins.get(var):
+            if self.parent is None:
+                raise ValueError(f"Variable '{var}' is not defined.")
+            return self.parent.resolve(var)
+        self._owner.define(var, self._snapshot.copy(value))
+        return self._owner
+
+    def copyAll(self):
+        # every global not copied yet (snapshot.save writes them all)
+        for var in list(self.record):
+            if var not in self._owner.record:
+                try:
+                    self.resolve(var)
+                except ValueError:
+                    pass
+
+
+class EvaPool:
+    def __init__(
+        self, global_env=None, engine="ast", opt_level=0, prelude=(), modules=(), size=4
+    ):
+        self.engine = engine
+        self.opt_level = opt_level
+        self.size = size
+        # no process pool per tenant
+        self._template = Eva(global_env, engine=engine, opt_level=opt_level, workers=0)
+        if prelude:
+            self._template.evalGlobal(*prelude)
+        for name in modules:
+            self._template.eval(["import", name])
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self.stats = {"snapshots": 0, "acquired": 0}
+        for _ in range(size):
+            self._ready.put(self.snapshot())
+
+    def snapshot(self):
+        # a new interpreter over a copy of the template global env
+        template = self._template
+        global_env = Environment()
+        eva = Eva(global_env, engine=self.engine, opt_level=self.opt_level, workers=0)
+        snapshot = _Snapshot(eva.apply)
+        snapshot.bind(template.global_env, global_env)
+        global_env.parent = _Template(template, global_env, snapshot)
+        eva.modules = template.modules.fork(snapshot.copy)
+        with self._lock:
+            self.stats["snapshots"] += 1
+        return eva
+
+    def acquire(self):
+        with self._lock:
+            self.stats["acquired"] += 1
+        try:
+            return self._ready.get_nowait()
+        except queue.Empty:
+            return self.snapshot()
+
+    def release(self, eva):
+        # eva holds a tenant's state, it is not handed out again
+        if self._ready.qsize() < self.size:
+            self._ready.put(self.snapshot())
+
+    @contextmanager
+    def interpreter(self):
+        eva = self.acquire()
+        try:
+            yield eva
+        finally:
+            self.release(eva)
@@ -0,0 +1,249 @@
+# Profiler
+###############################
+# opt-in instrumentation of the ast engine:
+#   Eva(global_env, profile=True)      profile everything, eva.profiler
+#   with eva.profile() as profiler:    profile the block only
+#
+# - evaluations per special form ("call" for function calls)
+# - per user-defined function (keyed by its `def` name, "<lambda>" for
+#   anonymous ones): calls, inclusive and exclusive wall time
+# - variable lookup depth histogram: how many envs the lookup of a
+#   variable reference went up before it found the name
+# - report(): sorted text report, collapsed(): collapsed stacks for
+#   flamegraph.pl/speedscope ("f;g;h <exclusive microseconds>")
+#
+# nothing is instrumented while the profiler is not started: start()
+# replaces the dispatch table, the node evaluation and the call entry
+# points of that Eva instance with counting versions, stop() puts the
+# originals back. other interpreters (and other profilers) are not
+# affected, one profiler at a time per interpreter.
+
+import time
+from collections import Counter
+
+from compiler import TailCall
+from env import ClassEnvironment, Environment
+
+
+class Profiler:
+    def __init__(self):
+        self.forms = Counter()
+        # name -> [calls, inclusive seconds, exclusive seconds]
+        self.functions = {}
+        # env hops -> lookups
+        self.lookup_depths = Counter()
+        # "f;g;h" -> exclusive seconds
+        self.stacks = Counter()
+        # function body node id -> (body, def name)
+        self._names = {}
+        # active frames [name, start, time spent in callees]
+        self._frames = []
+        # name -> activations of it on the frame stack (recursion)
+        self._active = Counter()
+        self._eva = None
+        self._forms = None
+
+    # attach/detach
+    # --------------------------
+    def start(self, eva):
+        if eva.engine != "ast":
+            raise ValueError(f"Profiling needs the 'ast' engine, not '{eva.engine}'.")
+        if self._eva is not None:
+            raise RuntimeError("Profiler is already started.")
+        if "_eval_tail" in eva.__dict__:
+            # its hooks would wrap the other profiler's, stop() drops both
+            raise RuntimeError("Eva is already profiled.")
+        self._eva = eva
+        self._forms = eva._special_forms
+        eva._special_forms = {
+            head: self._countForm(head, handler)
+            for head, handler in eva._special_forms.items()
+        }
+        eva._special_forms["var"] = self._countVar(eva._special_forms["var"])
+        eva._eval = self._countLookups(eva._eval)
+        eva._eval_call = self._countForm("call", eva._eval_call)
+        eva._eval_tail = self._evalTail
+        eva._callUserDefinedFunction = self._callUserDefinedFunction
+        return self
+
+    def stop(self):
+        eva = self._eva
+        if eva is None:
+            return self
+        for name in ("_eval", "_eval_call", "_eval_tail", "_callUserDefinedFunction"):
+            del eva.__dict__[name]
+        eva._special_forms = self._forms
+        self._eva = None
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # counting versions
+    # --------------------------
+    def _countForm(self, head, handler):
+        forms = self.forms
+
+        def counted(exp, env):
+            forms[head] += 1
+            return handler(exp, env)
+
+        return counted
+
+    def _countVar(self, handler):
+        # ['var', name, ['lambda', ...]] (a desugared def) names the function
+        names = self._names
+
+        def counted(exp, env):
+            value = exp[2]
+            if isinstance(value, list) and value and value[0] == "memo":
+                value = value[1]
+            if isinstance(value, list) and value and value[0] == "lambda":
+                names[id(value[2])] = (value[2], exp[1])
+            return handler(exp, env)
+
+        return counted
+
+    def _countLookups(self, evaluate):
+        # Eva._eval, a variable reference is looked up here: resolving once
+        # (Environment.lookup resolves again in the owner env)
+        eva, depths = self._eva, self.lookup_depths
+
+        def counted(exp, env=None):
+            if type(exp) is not str or not exp[0].isalpha():
+                return evaluate(exp, env)
+            if env is None:
+                env = eva.global_env
+            depth = 0
+            while type(env) is Environment or type(env) is ClassEnvironment:
+                if exp in env.record:
+                    depths[depth] += 1
+                    return env.record[exp]
+                env = env.parent
+                depth += 1
+                if env is None:
+                    raise ValueError(f"Variable '{exp}' is not defined.")
+            # a Frame/Instance (or other) parent keeps its own lookup
+            return env.lookup(exp)
+
+        return counted
+
+    def _name(self, fn):
+        body = fn[1]
+        entry = self._names.get(id(body))
+        if entry is None or entry[0] is not body:
+            # defined before the profiler started: the name it is bound to
+            # in its defining env chain
+            entry = (body, self._boundName(fn) or "<lambda>")
+            self._names[id(body)] = entry
+        return entry[1]
+
+    def _boundName(self, fn):
+        env = fn[2]
+        while env is not None:
+            for name, value in env.record.items():
+                if value is fn or getattr(value, "fn", None) is fn:
+                    return name
+            env = env.parent
+        return None
+
+    def _callUserDefinedFunction(self, fn, args):
+        # Eva._callUserDefinedFunction, a tail call replaces the frame
+        eva = self._eva
+        while True:
+            self._enter(self._name(fn))
+            try:
+                ret = eva._activate(fn, args)
+            finally:
+                self._leave()
+            if type(ret) is not TailCall:
+                return ret
+            fn, args = ret.fn, ret.args
+
+    def _evalTail(self, exp, env):
+        # Eva._eval_tail, counting the forms it evaluates in place
+        eva, forms = self._eva, self.forms
+        while isinstance(exp, list):
+            head = exp[0]
+            if head == "if":
+                forms[head] += 1
+                _, cond, stmt1, stmt2 = exp
+                exp = stmt1 if eva._eval(cond, env) else stmt2
+            elif head == "begin":
+                forms[head] += 1
+                if eva.meter is not None:
+                    eva.meter.alloc()
+                env = Environment({}, env)
+                for i in exp[1:-1]:
+                    eva._eval(i, env)
+                exp = exp[-1] if len(exp) > 1 else None
+            elif head == "switch":
+                forms[head] += 1
+                exp = eva._transformer.transform(exp)
+            elif isinstance(head, str) and head in eva._special_forms:
+                break
+            else:
+                forms["call"] += 1
+                fn = eva._eval(head, env)
+                args = [eva._eval(i, env) for i in exp[1:]]
+                if callable(fn):
+                    return fn(*args)
+                return TailCall(fn, args)
+        if exp is None:
+            return None
+        return eva._eval(exp, env)
+
+    # frames
+    # --------------------------
+    def _enter(self, name):
+        self._frames.append([name, time.perf_counter(), 0.0])
+        self._active[name] += 1
+
+    def _leave(self):
+        name, start, in_callees = self._frames[-1]
+        elapsed = time.perf_counter() - start
+        exclusive = elapsed - in_callees
+        stack = ";".join(frame[0] for frame in self._frames)
+        self._frames.pop()
+        self._active[name] -= 1
+        if self._frames:
+            self._frames[-1][2] += elapsed
+        entry = self.functions.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        # inclusive time of a recursive function counts the outermost call
+        if not self._active[name]:
+            entry[1] += elapsed
+        entry[2] += exclusive
+        self.stacks[stack] += exclusive
+
+    # reports
+    # --------------------------
+    def report(self):
+        lines = ["special forms", f"{'form':<12} {'evaluations':>12}"]
+        for head, count in self.forms.most_common():
+            lines.append(f"{head:<12} {count:>12}")
+        lines += [
+            "",
+            "functions (by inclusive time)",
+            f"{'name':<20} {'calls':>10} {'inclusive s':>12} {'exclusive s':>12}",
+        ]
+        functions = sorted(self.functions.items(), key=lambda item: -item[1][1])
+        for name, (calls, inclusive, exclusive) in functions:
+            lines.append(f"{name:<20} {calls:>10} {inclusive:>12.6f} {exclusive:>12.6f}")
+        lines += ["", "lookup depth (envs walked)", f"{'depth':>5} {'lookups':>12}"]
+        total = sum(self.lookup_depths.values()) or 1
+        for depth in sorted(self.lookup_depths):
+            count = self.lookup_depths[depth]
+            bar = "#" * round(40 * count / total)
+            lines.append(f"{depth:>5} {count:>12} {bar}")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        # one "f;g;h microseconds" line per stack, for flamegraph tools
+        return "\n".join(
+            f"{stack} {round(seconds * 1e6)}"
+            for stack, seconds in sorted(self.stacks.items())
+        )
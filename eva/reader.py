@@ -0,0 +1,196 @@
+# Eva reader
+###############################
+# S-expression tokenizer and parser producing the list-based AST:
+#
+#   (def square (x) (* x x))   ->  ['def', 'square', ['x'], ['*', 'x', 'x']]
+#
+# - symbol               'x', '+', 'MAX_VALUE'
+# - number               1, -10, 2.5
+# - string "hello"       '"hello"'  (quotes kept, like the AST uses them)
+# - ; comment            until end of line
+#
+# the bracket list syntax of older module files is read too:
+#   ['def','square','x',['*','x','x']],
+# [ ] work like ( ), a comma is whitespace and 'quoted' is the symbol (or
+# "string") inside the quotes.
+#
+# input is read in chunks from a str, a text/binary file object or an
+# mmap, top-level forms are yielded as soon as they are complete, so
+# memory stays bounded by the largest form and time is linear in input.
+
+import codecs
+import re
+
+_TOKEN = re.compile(
+    r"""(?P<atom>[^\s()\[\],;"']+)
+      | (?P<space>[\s,]+)
+      | (?P<open>[(\[])
+      | (?P<close>[)\]])
+      | (?P<string>"(?:[^"\\]|\\.)*")
+      | (?P<quoted>'(?:[^'\\]|\\.)*')
+      | (?P<comment>;[^\n]*)
+      | (?P<unterminated>["'])""",
+    re.VERBOSE,
+)
+# splitForms: brackets, strings, quoted symbols and comments are enough to
+# count brackets without tokenizing atoms
+_STRUCTURE = re.compile(r"""[()\[\]]|"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|;[^\n]*""")
+_LINE_FORM = re.compile(r"\n(?=[(\[])")
+_NUMBER = re.compile(r"[+-]?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?\Z")
+_CLOSING = {"(": ")", "[": "]"}
+# tokens the next chunk may continue
+_OPEN_ENDED = {"atom", "space", "comment"}
+
+
+class ParseError(ValueError):
+    def __init__(self, message, line, column):
+        super().__init__(f"{message} at line {line}, column {column}")
+        self.line = line
+        self.column = column
+
+
+def atom(text):
+    if _NUMBER.match(text):
+        if text.lstrip("+-").isdigit():
+            return int(text)
+        return float(text)
+    return text
+
+
+def _chunks(source, chunk_size):
+    if isinstance(source, str):
+        for start in range(0, len(source), chunk_size):
+            yield source[start : start + chunk_size]
+        return
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        yield decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def tokenize(source, chunk_size=1 << 16):
+    # yield (kind, text, line, column), line/column are 1-based
+    # a chunk is scanned up to its last newline, the rest waits for the
+    # next chunk (a token never spans a chunk boundary, except strings
+    # with newlines, which are completed from the following chunks). a
+    # buffer without newlines (a one-line input) is scanned up to its last
+    # token the next chunk can't continue, see _lineCut
+    line, line_start, offset = 1, 0, 0
+    buffer = ""
+    chunks = _chunks(source, chunk_size)
+    eof = False
+    while not eof:
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+            cut = len(buffer)
+        else:
+            buffer += chunk
+            cut = buffer.rfind("\n") + 1 or _lineCut(buffer)
+        for match in _TOKEN.finditer(buffer, 0, cut):
+            kind = match.lastgroup
+            if kind == "space" or kind == "comment" or kind == "string":
+                text = match.group()
+                if "\n" in text:
+                    line += text.count("\n")
+                    line_start = offset + match.start() + text.rfind("\n") + 1
+                if kind != "string":
+                    continue
+            elif kind == "unterminated":
+                if eof:
+                    column = offset + match.start() - line_start + 1
+                    raise ParseError("Unterminated string", line, column)
+                cut = match.start()
+                break
+            else:
+                text = match.group()
+            start = offset + match.start()
+            yield kind, text, line, start - line_start + 1
+        offset += cut
+        buffer = buffer[cut:]
+
+
+def _lineCut(buffer):
+    # end of the complete tokens of a buffer without newlines: an atom,
+    # space or comment reaching its end may go on in the next chunk
+    cut, end = 0, len(buffer)
+    for match in _TOKEN.finditer(buffer):
+        if match.lastgroup == "unterminated":
+            break
+        if match.end() == end and match.lastgroup in _OPEN_ENDED:
+            break
+        cut = match.end()
+    return cut
+
+
+def readForms(source, chunk_size=1 << 16):
+    # yield top-level forms one by one
+    stack = []
+    for kind, text, line, column in tokenize(source, chunk_size):
+        if kind == "open":
+            stack.append(([], _CLOSING[text], line, column))
+            continue
+        if kind == "close":
+            if not stack:
+                raise ParseError(f"Unexpected '{text}'", line, column)
+            form, closing, open_line, open_column = stack.pop()
+            if text != closing:
+                raise ParseError(
+                    f"Expected '{closing}' to close line {open_line}, column "
+                    f"{open_column}, got '{text}'",
+                    line,
+                    column,
+                )
+        elif kind == "quoted":
+            form = text[1:-1]
+        elif kind == "string":
+            form = text
+        else:
+            form = atom(text)
+        if stack:
+            stack[-1][0].append(form)
+        else:
+            yield form
+    if stack:
+        _, closing, line, column = stack[-1]
+        raise ParseError(f"Missing '{closing}'", line, column)
+
+
+def parse(text):
+    # all top-level forms of text as a list
+    return list(readForms(text))
+
+
+def splitForms(text):
+    # text cut into pieces of whole top-level forms, each parses on its own:
+    # cut before every line starting with a bracket, pieces joined until
+    # their brackets balance. None when they don't at the end
+    pieces = []
+    depth = begin = 0
+    cuts = [match.start() + 1 for match in _LINE_FORM.finditer(text)]
+    cuts.append(len(text))
+    for start, end in zip([0, *cuts], cuts):
+        depth += _depth(text[start:end])
+        if depth == 0:
+            pieces.append(text[begin:end])
+            begin = end
+    return None if depth else pieces
+
+
+def _depth(text):
+    # brackets opened minus closed
+    if '"' in text or "'" in text or ";" in text:
+        depth = 0
+        for match in _STRUCTURE.finditer(text):
+            char = text[match.start()]
+            if char == "(" or char == "[":
+                depth += 1
+            elif char == ")" or char == "]":
+                depth -= 1
+        return depth
+    return text.count("(") + text.count("[") - text.count(")") - text.count("]")
@@ -0,0 +1,111 @@
+# Resolver: static scopes and lexical addresses
+###############################
+# the closure compiler keeps a chain of static scopes while it walks the
+# AST, every variable reference is resolved once, at compile time:
+#
+# - ("slot", depth, slot)  declared in a frame scope `depth` hops up,
+#                          read/written as frame.values[slot]
+# - ("dynamic", depth)     reached a dict-backed scope (global/root env,
+#                          class body, module body) `depth` hops up,
+#                          continue with Environment.lookup there
+#
+# scope kinds
+#######################
+# frame    begin block, function activation   -> env.Frame
+# dynamic  root env, class body, module body  -> env.Environment
+#
+# a class body is dynamic because its runtime parent is the parent class
+# env, not the enclosing scope, and `prop` looks names up by string.
+
+
+class Scope:
+    def __init__(self, kind, parent=None, static_parent=True):
+        self.kind = kind
+        self.parent = parent
+        # {var:slot} for frame scopes, declared names for dynamic ones
+        self.names = {}
+        # False when the runtime parent is not the enclosing static scope
+        # (class with a parent class), names past it can't be checked
+        self.static_parent = static_parent
+
+    def declare(self, var):
+        if var not in self.names:
+            self.names[var] = len(self.names)
+        return self.names[var]
+
+    def resolve(self, var):
+        # return the lexical address of var and whether the name is known
+        # statically (declared in some enclosing scope)
+        depth = 0
+        scope = self
+        address = None
+        while scope is not None:
+            if address is None:
+                if scope.kind == "frame":
+                    if var in scope.names:
+                        return ("slot", depth, scope.names[var]), True
+                else:
+                    address = ("dynamic", depth)
+            if address is not None:
+                if var in scope.names:
+                    return address, True
+                if not scope.static_parent:
+                    return address, True
+            depth += 1
+            scope = scope.parent
+        return address, False
+
+
+# declarations
+#######################
+# names a scope declares, so that every reference in the scope can be
+# resolved before the statements run (a `def` may call a function that is
+# defined below it). walks into if/while/switch/call..., stops at forms
+# that open a scope of their own.
+
+
+def collectDeclarations(exps, names=None):
+    if names is None:
+        names = []
+    for exp in exps:
+        if not isinstance(exp, list) or not exp:
+            continue
+        head = exp[0]
+        if head in ("var", "def", "def-memo", "class", "module", "import"):
+            if exp[1] not in names:
+                names.append(exp[1])
+            if head == "var":
+                collectDeclarations(exp[2:], names)
+            elif head == "class":
+                collectDeclarations(exp[2:3], names)
+        elif head in ("begin", "for", "lambda"):
+            continue
+        elif head == "prop":
+            collectDeclarations(exp[1:2], names)
+        else:
+            collectDeclarations(exp, names)
+    return names
+
+
+# references
+#######################
+# every name an expression may read or write, in itself or in the
+# functions it defines: names it binds are included too, so never fewer
+# than its free variables. the closure compiler's escape analysis
+# (_compile_lambda) keeps a lambda from capturing frames none of these
+# names are declared in.
+
+
+def referencedNames(exp, names=None):
+    if names is None:
+        names = set()
+    if isinstance(exp, str):
+        if exp and exp[0].isalpha():
+            names.add(exp)
+    elif isinstance(exp, list) and exp:
+        if exp[0] == "prop":
+            # the member name is not a variable
+            exp = exp[:2]
+        for i in exp:
+            referencedNames(i, names)
+    return names
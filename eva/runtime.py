@@ -0,0 +1,35 @@
+# The running interpreter
+###############################
+# closure compiled code (compiler.py) is shared between interpreters: the
+# tenants of an EvaPool run the functions of their template, compiled by
+# the template's compiler. what the code needs of an interpreter (its
+# meter, module registry and compiler) is that of the one running it, per
+# thread:
+#
+#   runtime.call(eva, compiled, env)    # compiled(env), eva running
+#
+# the entry points of compiled code (Eva.run, Eva.apply) go through call.
+# nested ones (a builtin calling back into eva.apply) cost a compare.
+
+import threading
+
+
+class _Running(threading.local):
+    # eva: the running interpreter, meter: its Meter (kept in step by
+    # Meter.start/stop), read on every call and loop of compiled code
+    eva = None
+    meter = None
+
+
+running = _Running()
+
+
+def call(eva, fn, *args):
+    if running.eva is eva:
+        return fn(*args)
+    previous = running.eva, running.meter
+    running.eva, running.meter = eva, eva.meter
+    try:
+        return fn(*args)
+    finally:
+        running.eva, running.meter = previous
@@ -0,0 +1,115 @@
+# Snapshot and restore
+###############################
+# eva.snapshot(path) writes the state a prelude built (every global the
+# program defined, with the function values, class envs, instances and
+# module envs they reach, and the loaded modules) to a binary file;
+# eva.restore(path) loads it into another interpreter of the same engine
+# (or "ast" <-> "stack") in one pass instead of evaluating the prelude again.
+#
+# file: MAGIC, then one pickle (the object graph keeps its sharing, a
+# class env referenced by many instances is stored once). it is read
+# through mmap, the unpickler takes the records straight from the mapped
+# pages. nothing is loaded lazily: globals share objects (a class env, a
+# module env, an instance), pickled apart each would get its own copy, so
+# restore is one load of the whole graph. what can't be written is stored
+# as a reference and bound again on restore:
+# - the global env itself                  -> the restoring global env
+# - builtins of the Eva (array, memo, ...) -> the restoring Eva's ones
+# - host callables of the global env       -> the restoring global env's
+#   (print, operator.add, ...)                value of the same name
+# - Eva.apply (held by memo values)        -> the restoring Eva's apply
+#
+# the closure engine is not supported: its function values hold compiled
+# python closures. vm inline caches are written empty.
+
+import mmap
+import pickle
+from types import MethodType
+
+from memo import Memo
+
+MAGIC = b"EVA\x01"
+
+# engine -> kind of function values it makes, "ast" and "stack" share theirs
+_VALUES = {"ast": "ast", "stack": "ast", "vm": "vm"}
+
+
+class _Pickler(pickle.Pickler):
+    def __init__(self, file, eva):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self._eva = eva
+        # id(host callable) -> its global name, memo values are data
+        self._hosts = {
+            id(value): name
+            for name, value in eva.global_env.record.items()
+            if callable(value) and type(value) is not Memo
+        }
+
+    def persistent_id(self, obj):
+        eva = self._eva
+        if obj is eva.global_env:
+            return ("global",)
+        if type(obj) is MethodType and obj.__self__ is eva:
+            return ("method", obj.__name__)
+        name = self._hosts.get(id(obj))
+        if name is not None:
+            return ("builtin" if eva.builtins.get(name) is obj else "host", name)
+        return None
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, file, eva):
+        super().__init__(file)
+        self._eva = eva
+
+    def persistent_load(self, pid):
+        eva, kind = self._eva, pid[0]
+        if kind == "global":
+            return eva.global_env
+        if kind == "method":
+            return getattr(eva, pid[1])
+        if kind == "builtin":
+            return eva.builtins[pid[1]]
+        try:
+            return eva.global_env.record[pid[1]]
+        except KeyError:
+            raise ValueError(f"Snapshot needs host builtin '{pid[1]}' in the global env.")
+
+
+def save(eva, path):
+    if eva.engine not in _VALUES:
+        raise ValueError("Snapshots need the 'ast', 'stack' or 'vm' engine, not 'closure'.")
+    modules = eva.modules
+    copyAll = getattr(eva.global_env.parent, "copyAll", None)
+    if copyAll is not None:
+        # a pooled interpreter's globals not copied from the template yet
+        copyAll()
+    state = {
+        "engine": _VALUES[eva.engine],
+        # builtins and host callables are the restoring interpreter's
+        "globals": {
+            name: value
+            for name, value in eva.global_env.record.items()
+            if not callable(value) or type(value) is Memo
+        },
+        "modules": modules.modules(),
+        "sources": modules._sources,
+    }
+    with open(path, "wb") as file:
+        file.write(MAGIC)
+        _Pickler(file, eva).dump(state)
+
+
+def load(eva, path):
+    with open(path, "rb") as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if mapped.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"'{path}' is not an Eva snapshot.")
+            state = _Unpickler(mapped, eva).load()
+    if state["engine"] != _VALUES.get(eva.engine):
+        raise ValueError(f"Snapshot of {state['engine']} values can't be restored into '{eva.engine}'.")
+    eva.global_env.record.update(state["globals"])
+    eva.modules._modules.update(state["modules"])
+    eva.modules._forked -= state["modules"].keys()
+    eva.modules._sources.update(state["sources"])
+    return eva
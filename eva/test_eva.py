@@ -1,11 +1,34 @@
-from env import Environment
+from env import ClassEnvironment, Environment
 from evai import Eva
+from host import declare, describe, isPure
+from inline_cache import PropCache
+from memo import ImpureMemoWarning
+from meter import ResourceExceeded
+from optimizer import Optimizer
+from pool import EvaPool
+from modules import ModuleRegistry
+from reader import ParseError, parse, readForms
+import arrays
+import asyncio
+import io
+import math
 import operator
+import os
+import tempfile
+import threading
+import warnings
 
-global_env = Environment(
-    {"version": 1.0, "None": None, "true": True, "print": print, "+": operator.add}
-)
-eva = Eva(global_env)
+ENGINES = ["ast", "closure", "stack", "vm"]
+
+
+def make_eva(engine="ast", opt_level=0):
+    global_env = Environment(
+        {"version": 1.0, "None": None, "true": True, "print": print, "+": operator.add}
+    )
+    return Eva(global_env, engine=engine, opt_level=opt_level)
+
+
+eva = make_eva()
 
 
 def test_self_eval(eva):
@@ -375,6 +398,20 @@ def test_super_class(eva):
         )
         == 60
     )
+    # classes local to a block: a method names its class through super
+    local_classes = [
+        "begin",
+        [
+            "class",
+            "A",
+            "None",
+            ["begin", ["def", "constructor", "self", "self"], ["def", "f", "self", ["begin", 1]]],
+        ],
+        ["class", "B", "A", ["begin", ["def", "f", "self", [["prop", ["super", "B"], "f"], "self"]]]],
+        ["var", "b", ["new", "B"]],
+        [["prop", "b", "f"], "b"],
+    ]
+    assert eva.eval(local_classes) == 1
 
 
 def test_module(eva):
@@ -393,6 +430,19 @@ def test_module(eva):
     assert eva.eval(["prop", "Math", "MAX_VALUE"]) == 1000
     assert eva.eval([["prop", "Math", "abs"], -10]) == 10
     assert eva.eval([["prop", "Math", "square"], 10]) == 100
+    # a module whose body raises is not loaded: the next import runs it again
+    with tempfile.TemporaryDirectory() as path:
+        with open(os.path.join(path, "Broken"), "w") as file:
+            file.write("(var half 1)\n(undefinedName)")
+        broken = Eva(make_eva().global_env, engine=eva.engine)
+        broken.modules = ModuleRegistry(path)
+        for _ in range(2):
+            try:
+                broken.eval(["import", "Broken"])
+                assert False, f"{eva.engine} imported a broken module"
+            except ValueError:
+                pass
+        assert broken.modules.lookup("Broken") is None
 
 
 def test_import(eva):
@@ -402,7 +452,880 @@ def test_import(eva):
     assert eva.eval([["prop", "Math", "square"], 10]) == 100
 
 
-if __name__ == "__main__":
+def test_compile(eva):
+    # compile once, run many times
+    program = eva.compile(
+        [
+            "begin",
+            ["var", "sum", 0],
+            ["for", ["var", "i", 0], ["<", "i", 10], ["++", "i"], ["+=", "sum", "i"]],
+            "sum",
+        ]
+    )
+    assert eva.run(program) == 45
+    assert eva.run(program) == 45
+
+
+def test_lexical_scope(eva):
+    # a def may call a function defined below it in the same block
+    assert (
+        eva.eval(
+            [
+                "begin",
+                [
+                    "def",
+                    "isEven",
+                    "n",
+                    ["if", ["=", "n", 0], "true", ["isOdd", ["-", "n", 1]]],
+                ],
+                [
+                    "def",
+                    "isOdd",
+                    "n",
+                    ["if", ["=", "n", 0], "None", ["isEven", ["-", "n", 1]]],
+                ],
+                ["isEven", 10],
+            ]
+        )
+        == True
+    )
+    # a local read before its var runs sees the enclosing variable
+    assert (
+        eva.eval(
+            [
+                "begin",
+                ["var", "x", 1],
+                ["begin", ["var", "y", "x"], ["var", "x", 2], ["+", "x", "y"]],
+            ]
+        )
+        == 3
+    )
+
+
+def test_undefined_variable(eva):
+    try:
+        eva.evalGlobal(["var", "touched", 1], "not_defined")
+        assert False, "not_defined should not resolve"
+    except ValueError:
+        pass
+    # the closure engine reports it at compile time, before anything runs
+    if eva.engine == "closure":
+        assert "touched" not in eva.global_env.record
+
+
+def test_tail_call(eva):
+    # tail recursion runs in constant python stack
+    assert (
+        eva.eval(
+            [
+                "begin",
+                [
+                    "def",
+                    "loop",
+                    ["n", "acc"],
+                    [
+                        "if",
+                        ["=", "n", 0],
+                        "acc",
+                        ["begin", ["var", "m", ["-", "n", 1]], ["loop", "m", ["+", "acc", 1]]],
+                    ],
+                ],
+                ["loop", 20000, 0],
+            ]
+        )
+        == 20000
+    )
+
+
+def test_deep_recursion(eva):
+    # non-tail recursion deeper than the python recursion limit
+    if eva.engine not in ("stack", "vm"):
+        return
+    assert (
+        eva.eval(
+            [
+                "begin",
+                [
+                    "def",
+                    "count",
+                    "n",
+                    ["if", ["=", "n", 0], 0, ["+", 1, ["count", ["-", "n", 1]]]],
+                ],
+                ["count", 50000],
+            ]
+        )
+        == 50000
+    )
+
+
+def test_closure_state(eva):
+    # each closure keeps its own captured variable alive
+    assert (
+        eva.eval(
+            [
+                "begin",
+                [
+                    "def",
+                    "makeCounter",
+                    "start",
+                    [
+                        "begin",
+                        ["var", "count", "start"],
+                        ["lambda", [], ["begin", ["++", "count"], "count"]],
+                    ],
+                ],
+                ["var", "c1", ["makeCounter", 10]],
+                ["var", "c2", ["makeCounter", 100]],
+                ["c1"],
+                ["c1"],
+                ["c2"],
+                ["+", ["c1"], ["c2"]],
+            ]
+        )
+        == 115
+    )
+
+
+def test_desugar_once(eva):
+    # syntax sugar is transformed once per node, not once per iteration
+    program = [
+        "begin",
+        ["var", "sum", 0],
+        ["for", ["var", "i", 0], ["<", "i", 100], ["++", "i"], ["+=", "sum", "i"]],
+        "sum",
+    ]
+    before = eva.transformations
+    assert eva.eval(program) == 4950
+    assert eva.transformations - before == 3
+    if eva.engine in ("ast", "stack"):
+        before = eva.transformations
+        assert eva.eval(program) == 4950
+        assert eva.transformations == before
+        # programs evaluated once don't stay cached
+        cache = eva._transformer._cache
+        for n in range(2 * cache.maxsize):
+            eva.eval(["begin", ["var", "j", n], ["++", "j"]])
+        assert len(cache) <= cache.maxsize
+
+
+def test_import_cache(eva):
+    # a loaded module is not evaluated again
+    eva.eval(["import", "Math"])
+    math_env = eva.eval("Math")
+    eva.eval(["import", "Math"])
+    assert eva.eval("Math") is math_env
+    # until its file changes
+    modules = eva.modules
+    with tempfile.TemporaryDirectory() as path:
+        eva.modules = ModuleRegistry(path)
+        with open(os.path.join(path, "Config"), "w") as file:
+            file.write("['var','VALUE',1]")
+        eva.eval(["import", "Config"])
+        assert eva.eval(["prop", "Config", "VALUE"]) == 1
+        with open(os.path.join(path, "Config"), "w") as file:
+            file.write("['var','VALUE',10]")
+        eva.eval(["import", "Config"])
+        assert eva.eval(["prop", "Config", "VALUE"]) == 10
+        assert eva.modules.stats["parses"] == 2
+    eva.modules = modules
+
+
+def test_inline_cache(eva):
+    eva.evalGlobal(
+        [
+            "class",
+            "Shape",
+            "None",
+            [
+                "begin",
+                ["def", "constructor", "self", "self"],
+                ["def", "area", "self", ["begin", 0]],
+            ],
+        ],
+        [
+            "class",
+            "Square",
+            "Shape",
+            [
+                "begin",
+                ["def", "constructor", ["self", "s"], ["set", ["prop", "self", "s"], "s"]],
+                ["def", "area", "self", ["*", ["prop", "self", "s"], ["prop", "self", "s"]]],
+            ],
+        ],
+        ["class", "Dot", "Shape", ["begin"]],
+        ["def", "area_of", "shape", [["prop", "shape", "area"], "shape"]],
+    )
+    # one call site, instances of two classes
+    assert eva.eval(["area_of", ["new", "Square", 3]]) == 9
+    assert eva.eval(["area_of", ["new", "Dot"]]) == 0
+    assert eva.eval(["area_of", ["new", "Dot"]]) == 0
+    # a method defined on Dot later shadows the cached Shape.area
+    eva.eval(["set", ["prop", "Dot", "area"], ["lambda", "self", ["begin", 1]]])
+    assert eva.eval(["area_of", ["new", "Dot"]]) == 1
+    assert eva.eval(["area_of", ["new", "Square", 2]]) == 4
+    # prop sites of programs evaluated once don't stay cached
+    caches = eva._prop_caches
+    for n in range(2 * caches.maxsize):
+        assert eva.eval([["prop", ["new", "Square", n], "area"], ["new", "Square", n]]) == n * n
+    assert len(caches) <= caches.maxsize
+
+
+def test_instance_shape(eva):
+    eva.evalGlobal(
+        [
+            "class",
+            "Pair",
+            "None",
+            [
+                "begin",
+                [
+                    "def",
+                    "constructor",
+                    ["self", "a", "b"],
+                    [
+                        "begin",
+                        ["set", ["prop", "self", "a"], "a"],
+                        ["set", ["prop", "self", "b"], "b"],
+                    ],
+                ],
+            ],
+        ],
+    )
+    p = eva.eval(["var", "p", ["new", "Pair", 1, 2]])
+    q = eva.eval(["new", "Pair", 3, 4])
+    # instances built the same way share one shape, values are a list
+    assert p.shape is q.shape
+    assert p.values == [1, 2] and p.record == {"a": 1, "b": 2}
+    eva.eval(["set", ["prop", "p", "a"], 10])
+    assert p.shape is q.shape and eva.eval(["prop", "p", "a"]) == 10
+    # a new field moves only this instance to another shape
+    eva.eval(["set", ["prop", "p", "c"], 5])
+    assert p.shape is not q.shape
+    assert eva.eval(["+", ["prop", "p", "c"], ["prop", "p", "b"]]) == 7
+
+
+def test_array(eva):
+    assert eva.eval(["sum", ["*", ["array", 1, 2, 3], 2]]) == 12
+    assert eva.eval(["get", ["+", 1, ["range", 3]], 2]) == 3
+    assert eva.eval(["len", ["range", 2, 10, 2]]) == 4
+    assert eva.eval(["sum", [">", ["range", 10], 4]]) == 5
+    assert eva.eval(["-", 10, ["array", 1, 2.5]]).tolist() == [9, 7.5]
+    assert eva.eval(["-", ["array", 1, 2]]).tolist() == [-1, -2]
+    squares = ["map", ["lambda", "x", ["*", "x", "x"]], ["range", 4]]
+    assert eva.eval(["sum", squares]) == 14
+    try:
+        eva.eval(["+", ["range", 2], ["range", 3]])
+        assert False, "length mismatch"
+    except ValueError:
+        pass
+    # values that are not machine numbers are kept as objects, with or
+    # without numpy
+    saved = arrays.numpy
+    for numpy in {saved, None}:
+        arrays.numpy = numpy
+        try:
+            eva.eval(["var", "words", ["map", ["lambda", "x", '"w"'], ["range", 2]]])
+            assert eva.eval("words").tolist() == ["w", "w"]
+            assert eva.eval(["get", "words", 1]) == "w"
+            eva.eval(["var", "big", ["*", ["array", 1, 2], 2**62]])
+            assert eva.eval("big").tolist() == [2**62, 2**63]
+            assert eva.eval(["sum", "big"]) == 3 * 2**62
+            assert eva.eval(["array", 2**64, 1]).tolist() == [2**64, 1]
+            nested = eva.eval(["map", ["lambda", "n", ["range", "n"]], ["range", 3]])
+            assert [i.tolist() for i in nested] == [[], [0], [0, 1]]
+            assert eva.eval(["-", ["array", 2**64]]).tolist() == [-(2**64)]
+        finally:
+            arrays.numpy = saved
+
+
+def test_memo(eva):
+    fib = ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]
+    eva.eval(["def-memo", "fib", "n", ["if", ["<", "n", 2], "n", fib]])
+    assert eva.eval(["fib", 30]) == 832040
+    assert eva.eval("fib").stats == {"hits": 28, "misses": 31, "evictions": 0}
+    # bounded, least recently used out first
+    eva.eval(["var", "square", ["memo", ["lambda", "x", ["*", "x", "x"]], 2]])
+    for x in (1, 2, 1, 3, 2):
+        assert eva.eval(["square", x]) == x * x
+    square = eva.eval("square")
+    assert len(square) == 2
+    assert square.stats == {"hits": 1, "misses": 4, "evictions": 2}
+    # assigning a non-local variable is reported
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        eva.eval(["var", "calls", 0])
+        eva.eval(["def-memo", "counted", "x", ["begin", ["++", "calls"], "x"]])
+        assert eva.eval(["+", ["counted", 1], ["counted", 1]]) == 2
+    assert [w.category for w in caught] == [ImpureMemoWarning]
+    assert eva.eval("calls") == 1
+
+
+def test_parallel(eva):
+    fib = ["if", ["<", "n", 2], "n", ["+", ["pfib", ["-", "n", 1]], ["pfib", ["-", "n", 2]]]]
+    offloaded = eva.parallel.stats["offloaded"]
+    assert (
+        eva.evalParallel(
+            ["def", "pfib", "n", fib],
+            ["var", "pa", ["pfib", 12]],
+            ["var", "pb", ["pfib", 13]],
+            # assigns a global: runs here, after pa is defined
+            ["var", "pc", ["begin", ["set", "pa", ["pfib", 1]], "pb"]],
+            ["+", "pa", "pc"],
+        )
+        == 234
+    )
+    assert eva.parallel.stats["offloaded"] >= offloaded + 2
+    products = eva.eval(["pmap", ["lambda", "x", ["*", "x", ["pfib", "x"]]], ["range", 6]])
+    assert list(products) == [0, 1, 2, 6, 12, 25]
+    # results that aren't numbers
+    pairs = eva.eval(["pmap", ["lambda", "x", ["array", "x", "x"]], ["range", 3]])
+    assert [list(i) for i in pairs] == [[0, 0], [1, 1], [2, 2]]
+    assert list(eva.eval(["pmap", ["lambda", "x", '"s"'], ["range", 2]])) == ["s", "s"]
+    # a class evaluated in a worker is defined here
+    offloaded = eva.parallel.stats["offloaded"]
+    eva.evalParallel(["class", "PTable", "None", ["begin", ["var", "size", ["pfib", 10]]]])
+    assert eva.eval(["prop", "PTable", "size"]) == 55
+    assert eva.parallel.stats["offloaded"] == offloaded + 1
+    # the value of the last form, not of the last offloaded one
+    assert eva.evalParallel(["var", "pd", ["pfib", 10]], 7) == 7 and eva.eval("pd") == 55
+    # a method changing an instance runs here, on the instance
+    eva.evalGlobal(
+        [
+            "class",
+            "PCounter",
+            "None",
+            [
+                "begin",
+                ["def", "constructor", "self", ["set", ["prop", "self", "n"], 0]],
+                [
+                    "def",
+                    "inc",
+                    "self",
+                    ["set", ["prop", "self", "n"], ["+", ["prop", "self", "n"], 1]],
+                ],
+            ],
+        ],
+        ["var", "pcounter", ["new", "PCounter"]],
+    )
+    offloaded = eva.parallel.stats["offloaded"]
+    inc = ["var", "r", [["prop", "pcounter", "inc"], "pcounter"]]
+    assert eva.evalParallel(inc, ["prop", "pcounter", "n"]) == 1
+    assert eva.eval(["prop", "pcounter", "n"]) == 1
+    assert eva.parallel.stats["offloaded"] == offloaded
+    eva.parallel.shutdown()
+
+
+def test_batch(eva):
+    score = [
+        "begin",
+        # reads a row name, defined once for the batch
+        ["def", "bonus", "x", ["*", "x", "rate"]],
+        ["switch", [[">", "x", 5], ["bonus", "x"]], ["else", ["+", "x", "version"]]],
+    ]
+    rows = [{"x": i, "rate": i % 3} for i in range(10)]
+    expected = [eva.eval(score, Environment(dict(row), eva.global_env)) for row in rows]
+    pulled = []
+
+    def stream():
+        for row in rows:
+            pulled.append(row)
+            yield row
+
+    results = eva.evalBatch(score, stream())
+    assert next(results) == expected[0] and len(pulled) == 1
+    assert list(results) == expected[1:]
+    out = [None] * len(rows)
+    assert eva.evalBatch(score, rows, out=out) is out and out == expected
+    assert list(eva.evalBatch(score, rows, parallel=True, chunk=3)) == expected
+    eva.parallel.shutdown()
+    # calls a function of the engine
+    eva.evalGlobal(["def", "twice", "x", ["*", "x", 2]])
+    assert list(eva.evalBatch(["twice", "x"], rows[:3])) == [0, 2, 4]
+    assert list(eva.evalBatch("x", [])) == []
+
+
+@declare(arity=3, pure=True)
+def clamp(x, low, high):
+    return min(max(x, low), high)
+
+
+def test_host():
+    # registry
+    assert describe(clamp).arity == 3 and isPure(clamp) and isPure(clamp, 3)
+    assert not isPure(clamp, 2) and isPure(math.sqrt, 1) and not isPure(print)
+    assert describe(lambda: 0) is None
+    env = {"sqrt": math.sqrt, "clamp": clamp, "neg": operator.neg, "rand": id}
+    env["tup"] = lambda *args: args
+    # pure calls with constant arguments fold at level 2
+    optimizer = Optimizer(2)
+    assert optimizer.optimize(["clamp", ["sqrt", 16], 0, 3], Environment(dict(env))) == 3
+    assert optimizer.optimize(["rand", 1], Environment(dict(env))) == ["rand", 1]
+    # bound by the program: not folded
+    program = ["begin", ["var", "sqrt", "neg"], ["sqrt", 4]]
+    assert Optimizer(2).optimize(program, Environment(dict(env))) == program
+    for engine in ENGINES:
+        eva = Eva(Environment(dict(env, version=1.0)), engine=engine, opt_level=2)
+        assert eva.eval(["sqrt", 16]) == 4.0
+        # 0 to 4 arguments, in order, in and out of tail position
+        for args in ([], [1], [1, "version"], [1, 5, ["neg", 3]], [1, 5, 3, 4]):
+            expected = tuple(eva.eval(i) for i in args)
+            assert eva.eval(["tup", *args]) == expected, engine
+            body = ["begin", ["var", "r", ["tup", *args]], ["tup", *args]]
+            assert eva.eval(["begin", ["def", "f", [], body], ["f"]]) == expected, engine
+        eva.evalGlobal(["var", "n", 7])
+        assert eva.eval(["clamp", "n", 0, ["neg", -5]]) == 5
+        # a declared arity is checked when the closure engine compiles
+        wrong = ["begin", ["def", "g", "x", ["clamp", "x", 1]], 0]
+        try:
+            eva.eval(wrong)
+        except ValueError as error:
+            assert engine == "closure" and "Expected 3 arguments" in str(error)
+        except TypeError:
+            assert engine != "closure"
+        else:
+            assert engine != "closure"
+    # declared pure: runs in a worker process
+    eva = Eva(Environment(dict(env)))
+    offloaded = eva.parallel.stats["offloaded"]
+    assert eva.evalParallel(["clamp", 9, 0, 4], ["clamp", -1, 0, 4]) == 0
+    assert eva.parallel.stats["offloaded"] == offloaded + 2
+    eva.parallel.shutdown()
+
+
+def test_escape():
+    block = [
+        "begin",
+        ["var", "tmp", "i"],
+        [
+            "set",
+            "fns",
+            [
+                "list",
+                ["lambda", "x", ["*", "x", 2]],
+                ["lambda", "x", ["+", "x", "k"]],
+                # declared in the block after the lambda is made
+                ["lambda", [], ["begin", ["var", "late", "tmp"], ["+", "late", "k"]]],
+            ],
+        ],
+    ]
+    make = [
+        "def",
+        "make",
+        "k",
+        [
+            "begin",
+            ["var", "big", ["range", 100]],
+            ["var", "fns", 0],
+            ["for", ["var", "i", 0], ["<", "i", 2], ["++", "i"], block],
+            "fns",
+        ],
+    ]
+    for engine in ENGINES:
+        eva = make_eva(engine)
+        eva.global_env.define("list", lambda *values: list(values))
+        eva.eval(make)
+        double, adder, late = eva.eval(["make", 5])
+        assert [eva.apply(double, [3]), eva.apply(adder, [3]), eva.apply(late, [])] == [6, 8, 6]
+        if engine == "closure":
+            # no local: the global env, one shared function value
+            assert double[2] is eva.global_env and double is eva.eval(["make", 1])[0]
+            # the activation, not the loop body block
+            assert set(adder[2].names) == {"k", "big", "fns"}
+            assert set(late[2].names) == {"tmp"}
+        if engine == "vm":
+            assert double is eva.eval(["make", 1])[0] and adder.cells
+        if engine in ("closure", "vm"):
+            # tenants share the compiled lambda, each env keeps its own
+            prelude = [["def", "one", [], ["lambda", [], 1]]]
+            pool = EvaPool(eva.global_env, engine, prelude=prelude, size=2)
+            with pool.interpreter() as a, pool.interpreter() as b:
+                fa, fb = a.eval(["one"]), b.eval(["one"])
+                assert fa is not fb and fa is a.eval(["one"]) and fb is b.eval(["one"])
+    # names an imported module may look up: captured as before
+    eva = make_eva("closure")
+    program = ["begin", ["var", "f", ["lambda", [], ["import", "Math"]]], "f"]
+    assert eva.eval(["begin", ["var", "local", 1], program])[2] is not eva.global_env
+
+
+def test_hot_reload():
+    def write(path, text):
+        with open(path, "w") as file:
+            file.write(text)
+        # distinct stamps, however fast the edits come
+        write.stamp += 10**9
+        os.utime(path, ns=(write.stamp, write.stamp))
+
+    write.stamp = 10**18
+    for engine in ENGINES:
+        with tempfile.TemporaryDirectory() as path:
+            a, b = os.path.join(path, "A"), os.path.join(path, "B")
+            write(a, "(def sq (x) (* x x))\n(var K 3)\n(var T (sq K))\n(var old 1)\n(var N 0)")
+            write(b, "(import A)\n(var U (+ (prop A T) 1))\n(def f (y) (+ y (prop A K)))")
+            eva = make_eva(engine)
+            eva.modules = ModuleRegistry(path)
+            eva.eval(["import", "B"])
+            module_a = eva.eval(["prop", "B", "A"])
+            assert eva.eval(["prop", "B", "U"]) == 10 and eva.pollModules() == {}
+            # sq changed: T reads it, U reads A's T. f reads K when called
+            write(a, "(def sq (x) (* x (* x x)))\n(var K 3)\n(var T (sq K))\n(var N 0)")
+            reloaded = eva.pollModules()
+            assert reloaded == {"A": ["sq", "T", "old"], "B": ["U"]}, (engine, reloaded)
+            assert eva.eval(["prop", "B", "U"]) == 28 and eva.eval([["prop", "B", "f"], 1]) == 4
+            assert eva.eval(["prop", "B", "A"]) is module_a and "old" not in module_a.record
+            # unchanged forms are not parsed again
+            square = eva.modules.source("A")[1]
+            write(a, "(def sq (x) (* x (* x x)))\n(var K 5)\n(var T (sq K))\n(var N 0)")
+            assert eva.pollModules() == {"A": ["K", "T"], "B": ["U"]}
+            assert eva.modules.source("A")[1] is square and eva.eval(["prop", "B", "U"]) == 126
+            # still reported where the error is
+            write(a, "(def sq (x) (* x x))\n(var K")
+            try:
+                eva.pollModules()
+                assert False
+            except ParseError as error:
+                assert error.line == 2
+            assert eva.modules.stats["reloads"] == 2
+
+
+def test_pool():
+    # no shared default record/global env
+    assert Environment().record is not Environment().record
+    assert Eva().global_env.record is not Eva().global_env.record
+    point = [
+        "class",
+        "Point",
+        "None",
+        [
+            "begin",
+            [
+                "def",
+                "constructor",
+                ["self", "x", "y"],
+                ["begin", ["set", ["prop", "self", "x"], "x"], ["set", ["prop", "self", "y"], "y"]],
+            ],
+            ["def", "calc", "self", ["+", ["prop", "self", "x"], ["prop", "self", "y"]]],
+        ],
+    ]
+    prelude = [
+        point,
+        ["var", "counter", 0],
+        ["def", "bump", "n", ["begin", ["+=", "counter", "n"], "counter"]],
+        ["var", "origin", ["new", "Point", 1, 2]],
+    ]
+    for engine in ENGINES:
+        pool = EvaPool(make_eva().global_env, engine, prelude=prelude, size=2)
+        failures = []
+
+        def tenant(n):
+            with pool.interpreter() as eva:
+                for _ in range(100):
+                    eva.eval(["bump", n])
+                eva.eval(["set", ["prop", "origin", "x"], n])
+                if eva.eval(["+", "counter", ["prop", "origin", "x"]]) != 101 * n:
+                    failures.append(n)
+
+        threads = [threading.Thread(target=tenant, args=(n,)) for n in range(1, 5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert failures == []
+        with pool.interpreter() as eva:
+            assert eva.eval(["+", "counter", [["prop", "origin", "calc"], "origin"]]) == 3
+
+    # compiled code of the template run by tenants imports and writes into
+    # the tenant's modules, loaded in the template or not
+    bump = [
+        "def",
+        "bump",
+        [],
+        [
+            "begin",
+            ["import", "Math"],
+            ["set", ["prop", "Math", "MAX_VALUE"], ["+", ["prop", "Math", "MAX_VALUE"], 1]],
+            ["prop", "Math", "MAX_VALUE"],
+        ],
+    ]
+    for engine in ENGINES:
+        for modules in ((), ["Math"]):
+            pool = EvaPool(make_eva().global_env, engine, prelude=[bump], modules=modules, size=1)
+            template = pool._template
+            for _ in range(2):
+                with pool.interpreter() as eva:
+                    assert eva.eval(["bump"]) == 1001, engine
+            assert set(template.modules.loaded()) == set(modules), engine
+            if modules:
+                assert template.eval(["prop", "Math", "MAX_VALUE"]) == 1000
+
+    # a snapshot copies the globals it uses only
+    pool = EvaPool(make_eva().global_env, "ast", prelude=prelude, size=1)
+    with pool.interpreter() as eva:
+        assert "origin" not in eva.global_env.record
+        assert eva.eval(["bump", 1]) == 1
+        assert "counter" in eva.global_env.record and "origin" not in eva.global_env.record
+
+
+def test_async():
+    order = []
+
+    async def fetch(x):
+        order.append(x)
+        await asyncio.sleep(0.01 * x)
+        order.append(-x)
+        return x * 10
+
+    program = [
+        "begin",
+        ["def", "twice", "x", ["+", ["fetch", "x"], ["fetch", "x"]]],
+        ["var", "r", ["await-all", ["fetch", 2], ["twice", 1]]],
+        ["+", ["get", "r", 0], ["get", "r", 1]],
+    ]
+    for engine in ("ast", "stack"):
+        eva = make_eva(engine)
+        eva.global_env.define("fetch", fetch)
+        order.clear()
+        assert asyncio.run(eva.evalAsync(program)) == 40
+        # both calls of await-all started before either finished
+        assert order[:2] == [2, 1]
+        # a builtin result that is not awaitable is a value, as in eval
+        eva.global_env.define("fetch", lambda x: x * 10)
+        assert asyncio.run(eva.evalAsync(program)) == eva.eval(program) == 40
+    # the other engines evaluate await-all one after the other
+    for engine in ENGINES:
+        eva = make_eva(engine)
+        eva.global_env.define("fetch", lambda x: x * 10)
+        assert eva.eval(program) == 40
+        assert eva.eval(["await-all", 1, ["fetch", 2]]) == [1, 20]
+    try:
+        asyncio.run(make_eva("vm").evalAsync(1))
+        assert False, "vm engine ran async"
+    except ValueError:
+        pass
+
+
+def test_snapshot():
+    path = os.path.join(tempfile.mkdtemp(), "prelude")
+    for engine in ("ast", "stack", "vm"):
+        eva = make_eva(engine)
+        eva.evalGlobal(
+            ["var", "counter", 0],
+            ["def", "bump", "n", ["begin", ["+=", "counter", "n"], "counter"]],
+            ["def-memo", "square", "x", ["*", "x", "x"]],
+            ["square", 3],
+            ["module", "Box", ["begin", ["var", "size", 2], ["def", "area", [], ["*", "size", "size"]]]],
+        )
+        eva.snapshot(path)
+        restored = make_eva(engine).restore(path)
+        assert restored.eval(["bump", 5]) == 5
+        assert restored.eval(["square", 3]) == 9
+        assert restored.eval("square").stats["hits"] == 1
+        restored.eval(["set", ["prop", "Box", "size"], 3])
+        assert restored.eval([["prop", "Box", "area"]]) == 9
+        # the original is untouched
+        assert eva.eval("counter") == 0 and eva.eval([["prop", "Box", "area"]]) == 4
+    try:
+        make_eva("closure").snapshot(path)
+        assert False, "closure engine snapshot"
+    except ValueError:
+        pass
+
+
+def test_limits():
+    forever = ["while", "true", ["var", "x", 1]]
+    recurse = ["begin", ["def", "down", "n", ["+", 1, ["down", "n"]]], ["down", 1]]
+    for engine in ENGINES:
+        for program, limits, limit in (
+            (forever, {"steps": 1000}, "steps"),
+            (forever, {"timeout": 0.05}, "timeout"),
+            (recurse, {"memory": 100}, "memory"),
+        ):
+            eva = make_eva(engine)
+            with eva.limit(**limits) as meter:
+                try:
+                    eva.eval(program)
+                    assert False, f"{engine} {limit} limit"
+                except ResourceExceeded as error:
+                    assert error.limit == limit
+            assert eva.meter is None
+        # exact step count: 10 iterations, 10 calls
+        eva = make_eva(engine)
+        eva.evalGlobal(["def", "one", [], ["begin", 1]])
+        with eva.limit(steps=20) as meter:
+            eva.eval(["for", ["var", "i", 0], ["<", "i", 10], ["++", "i"], ["one"]])
+        assert meter.used()["steps"] == 20
+        # a block declaring nothing allocates no env (vm: no block envs at all)
+        with eva.limit() as meter:
+            eva.eval(["begin", ["begin", ["+", 1, 2]], ["begin", ["var", "z", 1], "z"]])
+        assert meter.used()["memory"] == (0 if engine == "vm" else 1)
+        eva = Eva(make_eva(engine).global_env, engine=engine, limits={"steps": 5})
+        try:
+            eva.eval(["for", ["var", "i", 0], ["<", "i", 10], ["++", "i"], "i"])
+            assert False, f"{engine} limits="
+        except ResourceExceeded as error:
+            assert (error.limit, error.used, error.maximum) == ("steps", 6, 5)
+        # a pooled interpreter running a function of the template is
+        # metered by its own meter
+        pool = EvaPool(make_eva().global_env, engine, prelude=[["def", "spin", [], forever]], size=1)
+        with pool.interpreter() as eva:
+            with eva.limit(steps=1000, timeout=1.0):
+                try:
+                    eva.eval(["spin"])
+                    assert False, f"{engine} pooled limit"
+                except ResourceExceeded as error:
+                    assert error.limit == "steps"
+
+
+def test_prop_cache():
+    base = ClassEnvironment({"get": 1}, Environment({}))
+    leaf = base
+    for _ in range(5):
+        leaf = ClassEnvironment({}, leaf)
+    instance = Environment({}, leaf)
+    cache = PropCache("get")
+    assert cache.lookup(instance) == 1
+    assert cache.lookup(Environment({}, leaf)) == 1
+    assert cache.misses == 1
+    # own props are not cached, they are always probed first
+    instance.define("get", 0)
+    assert cache.lookup(instance) == 0
+    leaf.parent.define("get", 2)
+    assert cache.lookup(Environment({}, leaf)) == 2
+    assert cache.misses == 2
+
+
+def test_optimizer():
+    assert Optimizer(1).optimize(["+", ["*", 2, 3], 2]) == 8
+    assert Optimizer(1).optimize(["if", [">", 2, 1], "a", "b"]) == "a"
+    switch = ["switch", [["<", 3, 1], 1], [["=", "x", 1], 2], ["else", 3]]
+    assert Optimizer(1).optimize(switch) == ["switch", [["=", "x", 1], 2], ["else", 3]]
+    # a function body folded to a number stays a list
+    assert Optimizer(1).optimize(["def", "f", [], ["+", 1, 2]]) == ["def", "f", [], ["begin", 3]]
+    # level 2: env constants and known builtins, unused pure expressions
+    env = Environment({"true": True, "mul": operator.mul})
+    program = ["begin", 1, '"unused"', ["if", "true", ["mul", 6, 7], 0]]
+    assert Optimizer(2).optimize(program, env) == ["begin", 42]
+    # names the program binds are not inlined
+    program = ["begin", ["set", "true", 0], ["if", "true", 1, 2]]
+    assert Optimizer(2).optimize(program, env) == program
+
+    program = [
+        "begin",
+        ["var", "total", 0],
+        [
+            "for",
+            ["var", "i", 0],
+            ["<", "i", ["*", 2, 5]],
+            ["++", "i"],
+            [
+                "switch",
+                [["<", 1, 0], ["set", "total", -1]],
+                [["<", "i", ["+", 2, 2]], ["+=", "total", ["mul", "i", 2]]],
+                ["else", ["+=", "total", ["if", "true", ["-", 3, 2], 100]]],
+            ],
+        ],
+        "total",
+    ]
+    for engine in ENGINES:
+        results = []
+        for opt_level in (0, 1, 2):
+            eva = make_eva(engine, opt_level)
+            eva.global_env.define("mul", operator.mul)
+            results.append(eva.eval(program))
+        assert results == [18, 18, 18]
+        assert eva.optimizer.optimizations > 0
+        # programs evaluated once don't stay cached
+        cache = eva.optimizer._cache
+        for n in range(2 * cache.maxsize):
+            assert eva.eval(["+", n, ["mul", 1, 1]]) == n + 1
+        assert len(cache) <= cache.maxsize
+    # a builtin evaluating a program while one runs gets it optimized too
+    eva = make_eva("ast", 1)
+    seen = []
+    eva.global_env.define("nested", lambda: seen.append(eva.eval == eva._evalOptimized))
+    eva.eval(["begin", ["nested"], ["nested"]])
+    assert seen == [True, True]
+
+
+def test_reader():
+    source = """
+    ; comment
+    (def square (x) (* x x))
+    (print "hello world" -10 2.5)
+    """
+    forms = [
+        ["def", "square", ["x"], ["*", "x", "x"]],
+        ["print", '"hello world"', -10, 2.5],
+    ]
+    assert parse(source) == forms
+    # streamed in small chunks, from a binary file object
+    assert list(readForms(io.BytesIO(source.encode()), chunk_size=3)) == forms
+    # one line: forms come as soon as they are complete, atoms, comments
+    # and strings cut by a chunk boundary are read whole
+    line = " ".join(f'(var name{i} "s {i}")' for i in range(100)) + " ; end"
+    stream = io.StringIO(line)
+    forms = readForms(stream, chunk_size=7)
+    assert next(forms) == ["var", "name0", '"s 0"'] and stream.tell() < 50
+    rest = parse(line)[1:]
+    assert list(forms) == rest and len(rest) == 99 and rest[-1][1] == "name99"
+    # bracket list syntax of older module files
+    assert parse("['def','square','x',['*','x','x']],") == [
+        ["def", "square", "x", ["*", "x", "x"]]
+    ]
+    try:
+        parse("(begin\n  (+ 1 2]")
+        assert False, "mismatched bracket"
+    except ParseError as error:
+        assert (error.line, error.column) == (2, 9)
+
+
+def test_profiler():
+    eva = make_eva()
+    fib = ["if", ["<", "n", 2], "n", ["+", ["fib", ["-", "n", 1]], ["fib", ["-", "n", 2]]]]
+    with eva.profile() as profiler:
+        eva.eval(["def", "fib", "n", fib])
+        assert eva.eval(["fib", 10]) == 55
+    assert profiler.forms["def"] == 1 and profiler.forms["call"] == 177
+    calls, inclusive, exclusive = profiler.functions["fib"]
+    assert calls == 177 and 0 <= exclusive <= inclusive + 1e-9
+    assert profiler.lookup_depths[1] > 0
+    assert "fib" in profiler.report()
+    stack, micros = profiler.collapsed().splitlines()[-1].rsplit(" ", 1)
+    assert stack.split(";") == ["fib"] * 10 and int(micros) >= 0
+    # detached: nothing more is counted
+    eva.eval(["fib", 5])
+    assert profiler.functions["fib"][0] == 177
+    # each profiler counts its own interpreter, stopped in any order
+    lookup = Environment.lookup
+    first, second = make_eva(), make_eva()
+    first_profiler, second_profiler = first.profile(), second.profile()
+    first.eval(["var", "x", 1])
+    assert first.eval("x") == 1
+    first_profiler.stop()
+    assert second.eval(["begin", ["var", "y", 2], "y"]) == 2
+    second_profiler.stop()
+    assert Environment.lookup is lookup
+    assert sum(first_profiler.lookup_depths.values()) == 1
+    assert dict(second_profiler.lookup_depths) == {0: 1}
+    assert "_eval" not in first.__dict__ and "_eval" not in second.__dict__
+    # one profiler at a time
+    profiled = Eva(make_eva().global_env, profile=True)
+    try:
+        profiled.profile()
+        assert False, "profiled twice"
+    except RuntimeError:
+        pass
+    profiled.profiler.stop()
+    with profiled.profile() as again:
+        assert profiled.eval(["+", 1, 2]) == 3
+    assert again.forms and "_eval" not in profiled.__dict__
+    try:
+        make_eva("vm").profile()
+        assert False, "vm engine profiled"
+    except ValueError:
+        pass
+
+
+def run_all(eva):
     test_self_eval(eva)
     test_math(eva)
     test_variable(eva)
@@ -420,4 +1343,35 @@ if __name__ == "__main__":
     test_super_class(eva)
     test_module(eva)
     test_import(eva)
+    test_compile(eva)
+    test_lexical_scope(eva)
+    test_undefined_variable(eva)
+    test_tail_call(eva)
+    test_deep_recursion(eva)
+    test_closure_state(eva)
+    test_desugar_once(eva)
+    test_import_cache(eva)
+    test_inline_cache(eva)
+    test_instance_shape(eva)
+    test_array(eva)
+    test_memo(eva)
+    test_parallel(eva)
+    test_batch(eva)
+
+
+if __name__ == "__main__":
+    for engine in ENGINES:
+        for opt_level in (0, 2):
+            run_all(make_eva(engine, opt_level))
+    test_optimizer()
+    test_prop_cache()
+    test_reader()
+    test_profiler()
+    test_pool()
+    test_async()
+    test_snapshot()
+    test_limits()
+    test_host()
+    test_escape()
+    test_hot_reload()
     print("all tests passed!")
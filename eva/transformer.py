@@ -1,15 +1,51 @@
 # AST Transformer
+from memo import checkPurity
+from node_cache import NodeCache
 
 
 class Transformer:
     def __init__(self):
-        pass
+        # number of sugar -> core transformations performed
+        self.transformations = 0
+        # desugaring cache: sugar node -> transformed node, see node_cache.py
+        self._cache = NodeCache()
+        self._transforms = {
+            "def": self.transformDefToVarLambda,
+            "def-memo": self.transformDefMemoToVar,
+            "switch": self.transformSwitchToIfexp,
+            "for": self.transformForToWhile,
+            "++": self.transformIncToSet,
+            "--": self.transformDecToSet,
+            "+=": self.transformIncValToSet,
+            "-=": self.transformDecValToSet,
+        }
+
+    def transform(self, exp):
+        # transform a sugar node once, the same node object always maps to
+        # the same core node, so a hot loop allocates nothing for sugar
+        transformed = self._cache.get(exp)
+        if transformed is None:
+            transformed = self._cache.put(exp, self._transforms[exp[0]](exp))
+        return transformed
+
+    def clearCache(self):
+        self._cache.clear()
 
     def transformDefToVarLambda(self, def_exp):
+        self.transformations += 1
         def_tag, fname, params, body = def_exp
         return ["var", fname, ["lambda", params, body]]
 
+    # ['def-memo', fname, params, body, maxsize?]
+    # -> ['var', fname, ['memo', ['lambda', params, body], maxsize?]]
+    def transformDefMemoToVar(self, def_exp):
+        self.transformations += 1
+        def_tag, fname, params, body, *maxsize = def_exp
+        checkPurity(fname, params, body)
+        return ["var", fname, ["memo", ["lambda", params, body], *maxsize]]
+
     def transformSwitchToIfexp(self, exp):
+        self.transformations += 1
         switch_tag, *condtions = exp
         length = len(condtions)
         if_exp = ["if", None, None, None]
@@ -28,27 +64,32 @@ class Transformer:
         return if_exp
 
     def transformForToWhile(self, for_exp):
+        self.transformations += 1
         for_tag, init, end_cond, update, body = for_exp
 
         stmt = ["begin", init, ["while", end_cond, ["begin", body, update]]]
         return stmt
 
     def transformIncToSet(self, inc_exp):
+        self.transformations += 1
         tag, var = inc_exp
         assert tag == "++"
         return ["set", var, ["+", var, 1]]
 
     def transformDecToSet(self, inc_exp):
+        self.transformations += 1
         tag, var = inc_exp
         assert tag == "--"
         return ["set", var, ["-", var, 1]]
 
     def transformIncValToSet(self, inc_exp):
+        self.transformations += 1
         tag, var, value = inc_exp
         assert tag == "+="
         return ["set", var, ["+", var, value]]
 
     def transformDecValToSet(self, inc_exp):
+        self.transformations += 1
         tag, var, value = inc_exp
         assert tag == "-="
         return ["set", var, ["-", var, value]]
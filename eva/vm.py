@@ -0,0 +1,417 @@
+# Stack VM
+###############################
+# executes the bytecode of bytecode.BytecodeCompiler. Eva calls don't
+# recurse in python: an activation is pushed to `frames`, a tail call
+# replaces the current activation.
+#
+# activation
+#######################
+# code/consts  of the running Proto
+# ip           next instruction offset
+# stack        operand stack
+# locals       params and block locals (a Cell when captured)
+# cells        upvalues of the running closure
+# denv         dynamic env: root/class/module Environment names fall back to
+# override     value returned instead of the body's (constructor -> instance,
+#              imported module body -> module env)
+
+from bytecode import (
+    LOAD_CONST,
+    LOAD_LOCAL,
+    LOAD_CELL,
+    LOAD_UPVAL,
+    LOAD_NAME,
+    STORE_LOCAL,
+    STORE_CELL,
+    DEFINE_NAME,
+    ASSIGN_LOCAL,
+    ASSIGN_CELL,
+    ASSIGN_UPVAL,
+    ASSIGN_NAME,
+    CLEAR_LOCAL,
+    MAKE_CELL,
+    CELL_PARAM,
+    POP,
+    ADD,
+    SUB,
+    MUL,
+    GT,
+    LT,
+    EQ,
+    NEG,
+    JUMP,
+    JUMP_IF_FALSE,
+    MAKE_CLOSURE,
+    CALL,
+    TAIL_CALL,
+    NEW,
+    GET_PROP,
+    SET_PROP,
+    SUPER,
+    CLASS_ENTER,
+    CLASS_EXIT,
+    MODULE_ENTER,
+    MODULE_EXIT,
+    IMPORT,
+    REGISTER_MODULE,
+    RETURN,
+    BytecodeCompiler,
+)
+from env import ClassEnvironment, Environment, Instance, UNDEFINED
+
+
+class Cell:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Closure:
+    __slots__ = ("proto", "cells", "env")
+
+    def __init__(self, proto, cells, env):
+        self.proto = proto
+        self.cells = cells
+        self.env = env
+
+
+class VM:
+    def __init__(self, eva):
+        self.eva = eva
+        self._compiler = BytecodeCompiler(eva._transformer)
+
+    def compile(self, exp, body=False):
+        return self._compiler.compileProgram(exp, body)
+
+    def eval(self, exp, env):
+        return self.execute(self.compile(exp), env)
+
+    def evalBody(self, body, env):
+        return self.execute(self.compile(body, body=True), env)
+
+    def execute(self, proto, env):
+        return self._run(proto, [UNDEFINED] * proto.nlocals, (), env, None)
+
+    def call(self, closure, args):
+        proto = closure.proto
+        if len(args) < proto.nparams:
+            raise ValueError(f"Expected {proto.nparams} arguments, got {len(args)}.")
+        if self.eva.meter is not None:
+            self.eva.meter.call()
+        locals_ = list(args[: proto.nparams])
+        locals_.extend([UNDEFINED] * (proto.nlocals - proto.nparams))
+        return self._run(proto, locals_, closure.cells, closure.env, None)
+
+    # slow paths: the innermost binding is not defined yet
+    # --------------------------
+    def _fallbackLoad(self, reference, locals_, cells, denv):
+        var, addresses = reference
+        for address in addresses:
+            if address[0] == "name":
+                return denv.lookup(var)
+            if address[0] == "dynamic":
+                try:
+                    return denv.lookup(var)
+                except ValueError:
+                    continue
+            if address[0] == "local":
+                value = locals_[address[1]]
+                if address[2]:
+                    value = value.value
+            else:
+                value = cells[address[1]].value
+            if value is not UNDEFINED:
+                return value
+        raise ValueError(f"Variable '{var}' is not defined.")
+
+    def _fallbackAssign(self, reference, value, locals_, cells, denv):
+        var, addresses = reference
+        for address in addresses:
+            if address[0] == "name":
+                return denv.assign(var, value)
+            if address[0] == "dynamic":
+                try:
+                    return denv.assign(var, value)
+                except ValueError:
+                    continue
+            if address[0] == "local":
+                if address[2]:
+                    cell = locals_[address[1]]
+                    if cell.value is not UNDEFINED:
+                        cell.value = value
+                        return value
+                elif locals_[address[1]] is not UNDEFINED:
+                    locals_[address[1]] = value
+                    return value
+            elif cells[address[1]].value is not UNDEFINED:
+                cells[address[1]].value = value
+                return value
+        raise ValueError(f"Variable '{var}' is not defined.")
+
+    def _import(self, module_name):
+        body = self.eva.modules.source(module_name)
+        return self._compiler.compileModuleBody(module_name, body)
+
+    def _run(self, proto, locals_, cells, denv, override):
+        frames = []
+        meter = self.eva.meter
+        code, consts = proto.code, proto.consts
+        ip = 0
+        stack = []
+        push, pop = stack.append, stack.pop
+        while True:
+            op = code[ip]
+            a = code[ip + 1]
+            ip += 3
+
+            if op == LOAD_LOCAL:
+                value = locals_[a]
+                if value is UNDEFINED:
+                    value = self._fallbackLoad(consts[code[ip - 1]], locals_, cells, denv)
+                push(value)
+            elif op == LOAD_CONST:
+                push(consts[a])
+            elif op == ADD:
+                right = pop()
+                stack[-1] = stack[-1] + right
+            elif op == SUB:
+                right = pop()
+                stack[-1] = stack[-1] - right
+            elif op == MUL:
+                right = pop()
+                stack[-1] = stack[-1] * right
+            elif op == LT:
+                right = pop()
+                stack[-1] = stack[-1] < right
+            elif op == GT:
+                right = pop()
+                stack[-1] = stack[-1] > right
+            elif op == EQ:
+                right = pop()
+                stack[-1] = stack[-1] == right
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    ip = a
+            elif op == JUMP:
+                # a jump back is a loop iteration
+                if meter is not None and a < ip:
+                    # meter.step()
+                    meter.left -= 1
+                    if meter.left < 0:
+                        meter.overrun()
+                ip = a
+            elif op == POP:
+                pop()
+            elif op == STORE_LOCAL:
+                locals_[a] = stack[-1]
+            elif op == ASSIGN_LOCAL:
+                if locals_[a] is UNDEFINED:
+                    self._fallbackAssign(
+                        consts[code[ip - 1]], stack[-1], locals_, cells, denv
+                    )
+                else:
+                    locals_[a] = stack[-1]
+            elif op == LOAD_CELL:
+                value = locals_[a].value
+                if value is UNDEFINED:
+                    value = self._fallbackLoad(consts[code[ip - 1]], locals_, cells, denv)
+                push(value)
+            elif op == LOAD_UPVAL:
+                value = cells[a].value
+                if value is UNDEFINED:
+                    value = self._fallbackLoad(consts[code[ip - 1]], locals_, cells, denv)
+                push(value)
+            elif op == LOAD_NAME:
+                try:
+                    push(denv.lookup(consts[a]))
+                except ValueError:
+                    # not inherited: an enclosing binding (bytecode "dynamic")
+                    b = code[ip - 1]
+                    if not b:
+                        raise
+                    push(self._fallbackLoad(consts[b - 1], locals_, cells, denv))
+
+            # calls
+            # --------------------------
+            elif op == CALL or op == TAIL_CALL or op == NEW:
+                if op == CALL and a < 3:
+                    fn = stack[-1 - a]
+                    if type(fn) is not Closure and callable(fn):
+                        # built-in func, arguments straight off the stack
+                        if a == 1:
+                            arg = pop()
+                            stack[-1] = fn(arg)
+                        elif a == 2:
+                            right = pop()
+                            left = pop()
+                            stack[-1] = fn(left, right)
+                        else:
+                            stack[-1] = fn()
+                        continue
+                if a:
+                    args = stack[-a:]
+                    del stack[-a:]
+                else:
+                    args = []
+                fn = pop()
+                if op == NEW:
+                    if meter is not None:
+                        meter.alloc()
+                    instance_env = Instance(fn)
+                    args.insert(0, instance_env)
+                    fn = fn.lookup("constructor")
+                if type(fn) is not Closure:
+                    # built-in func
+                    if not callable(fn):
+                        raise TypeError(f"'{fn}' is not a function.")
+                    value = fn(*args)
+                    if op != TAIL_CALL:
+                        push(value)
+                        continue
+                    # returning from the current activation
+                    if override is not None:
+                        value = override
+                    if not frames:
+                        return value
+                    code, consts, ip, stack, locals_, cells, denv, override = frames.pop()
+                    push, pop = stack.append, stack.pop
+                    push(value)
+                    continue
+                # user defined func
+                if meter is not None:
+                    # meter.call()
+                    meter.left -= 1
+                    meter.room -= 1
+                    if meter.left < 0 or meter.room < 0:
+                        meter.overrun()
+                callee = fn.proto
+                if len(args) != callee.nparams:
+                    if len(args) < callee.nparams:
+                        raise ValueError(
+                            f"Expected {callee.nparams} arguments, got {len(args)}."
+                        )
+                    del args[callee.nparams :]
+                if op != TAIL_CALL:
+                    frames.append((code, consts, ip, stack, locals_, cells, denv, override))
+                    override = instance_env if op == NEW else None
+                    stack = []
+                    push, pop = stack.append, stack.pop
+                else:
+                    del stack[:]
+                if callee.nlocals > callee.nparams:
+                    args.extend([UNDEFINED] * (callee.nlocals - callee.nparams))
+                code, consts, ip = callee.code, callee.consts, 0
+                locals_, cells, denv = args, fn.cells, fn.env
+            elif op == RETURN:
+                value = pop() if override is None else override
+                if not frames:
+                    return value
+                code, consts, ip, stack, locals_, cells, denv, override = frames.pop()
+                push, pop = stack.append, stack.pop
+                push(value)
+
+            # variables, closures
+            # --------------------------
+            elif op == STORE_CELL:
+                locals_[a].value = stack[-1]
+            elif op == ASSIGN_CELL:
+                cell = locals_[a]
+                if cell.value is UNDEFINED:
+                    self._fallbackAssign(
+                        consts[code[ip - 1]], stack[-1], locals_, cells, denv
+                    )
+                else:
+                    cell.value = stack[-1]
+            elif op == ASSIGN_UPVAL:
+                cell = cells[a]
+                if cell.value is UNDEFINED:
+                    self._fallbackAssign(
+                        consts[code[ip - 1]], stack[-1], locals_, cells, denv
+                    )
+                else:
+                    cell.value = stack[-1]
+            elif op == DEFINE_NAME:
+                denv.define(consts[a], stack[-1])
+            elif op == ASSIGN_NAME:
+                try:
+                    denv.assign(consts[a], stack[-1])
+                except ValueError:
+                    b = code[ip - 1]
+                    if not b:
+                        raise
+                    self._fallbackAssign(consts[b - 1], stack[-1], locals_, cells, denv)
+            elif op == CLEAR_LOCAL:
+                locals_[a] = UNDEFINED
+            elif op == MAKE_CELL:
+                locals_[a] = Cell(UNDEFINED)
+            elif op == CELL_PARAM:
+                locals_[a] = Cell(locals_[a])
+            elif op == MAKE_CLOSURE:
+                callee = consts[a]
+                if code[ip - 1]:
+                    # no upvalues: shared in its dynamic env
+                    try:
+                        closures = denv.closures
+                    except AttributeError:
+                        closures = denv.closures = {}
+                    closure = closures.get(callee)
+                    if closure is None:
+                        closure = closures[callee] = Closure(callee, [], denv)
+                    push(closure)
+                    continue
+                captured = [
+                    locals_[index] if from_parent_local else cells[index]
+                    for from_parent_local, index in callee.upvalues
+                ]
+                push(Closure(callee, captured, denv))
+            elif op == NEG:
+                stack[-1] = -stack[-1]
+
+            # classes, modules
+            # --------------------------
+            elif op == GET_PROP:
+                stack[-1] = consts[a].lookup(stack[-1])
+            elif op == SET_PROP:
+                value = pop()
+                stack[-1] = stack[-1].define(consts[a], value)
+            elif op == SUPER:
+                stack[-1] = stack[-1].parent
+            elif op == CLASS_ENTER:
+                parent_env = pop()
+                push(denv)
+                if meter is not None:
+                    meter.alloc()
+                denv = ClassEnvironment({}, parent_env or denv)
+            elif op == MODULE_ENTER:
+                push(denv)
+                if meter is not None:
+                    meter.alloc()
+                denv = Environment({}, denv)
+            elif op == CLASS_EXIT or op == MODULE_EXIT:
+                value = denv
+                denv = pop()
+                push(value)
+            elif op == IMPORT:
+                module_env = self.eva.modules.lookup(consts[a])
+                if module_env is not None:
+                    push(module_env)
+                    # loaded: skip REGISTER_MODULE
+                    ip += 3
+                    continue
+                module = self._import(consts[a])
+                if meter is not None:
+                    meter.alloc()
+                # registered by REGISTER_MODULE once the body ran, a body
+                # that raises leaves nothing loaded (like the other engines)
+                module_env = Environment({}, denv)
+                frames.append((code, consts, ip, stack, locals_, cells, denv, override))
+                code, consts, ip = module.code, module.consts, 0
+                stack = []
+                push, pop = stack.append, stack.pop
+                locals_, cells, denv = [UNDEFINED] * module.nlocals, (), module_env
+                override = module_env
+            elif op == REGISTER_MODULE:
+                self.eva.modules.register(consts[a], stack[-1])
+            else:
+                raise RuntimeError(f"Unknown opcode {op}.")